@@ -0,0 +1,114 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the benchmark of the client evaluation.
+# Run from the source directory: python -m benchmarks.evaluation_benchmark
+# ---------------------------------------------------------------------------
+
+import time
+import torch
+import numpy as np
+import torch.nn.functional as F
+
+from argparse import ArgumentParser, Namespace
+from omegaconf import OmegaConf
+from torch.utils.data import DataLoader, TensorDataset
+
+from datasets.client_data import ClientData
+from datasets.utils import DatasetSplit
+from models.nets import CNNMnist, MLP
+from optim.evaluation import VmapEvaluator, evaluate_client
+
+def get_parser() -> ArgumentParser:
+    """Get parser.
+
+    Returns:
+        ArgumentParser: The parser object.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--num-users", type=int, default=100, help="Number of clients")
+    parser.add_argument("--samples-per-user", type=int, default=300, help="Samples of every client")
+    parser.add_argument("--model", type=str, default="cnnmnist", help="<mlp, cnnmnist>")
+    parser.add_argument("--train-batch-size", type=int, default=10, help="Batch size of the per-sample loader")
+    parser.add_argument("--eval-batch-size", type=int, default=128, help="Batch size of the evaluation engine")
+    parser.add_argument("--vmap-clients", type=str, default="10,50", help="Comma separated numbers of models per vmap group")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    return parser
+
+def build_model(args: Namespace):
+
+    if args.model == 'mlp':
+        return MLP(dim_in=784, dim_hidden=200, dim_out=10)
+    elif args.model == 'cnnmnist':
+        return CNNMnist(OmegaConf.create({'dataset': {'num_channels': 1, 'num_classes': 10}}))
+    else:
+        raise ValueError(f'{args.model} not implemented.')
+
+def loader_evaluation(net, dataset, idxs, batch_size):
+    """The former localTest: a shuffled per-sample DataLoader with autograd enabled."""
+    data_loader = DataLoader(DatasetSplit(dataset, idxs), batch_size=batch_size, shuffle=True)
+
+    test_loss = 0
+    correct = 0
+    for data, target in data_loader:
+        log_probs = net(data)
+        test_loss += F.cross_entropy(log_probs, target, reduction='sum').item()
+        y_pred = log_probs.data.max(1, keepdim=True)[1]
+        correct += y_pred.eq(target.data.view_as(y_pred)).long().cpu().sum()
+
+    return 100.00 * correct.item() / len(idxs), test_loss / len(idxs)
+
+def main(args: Namespace):
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+
+    num_samples = args.num_users * args.samples_per_user
+    dataset = TensorDataset(torch.rand(num_samples, 1, 28, 28), torch.randint(0, 10, (num_samples,)))
+    dict_users = {i: np.random.permutation(num_samples)[:args.samples_per_user] for i in range(args.num_users)}
+
+    net = build_model(args)
+    net.eval()
+
+    print(f'{args.model}: {args.num_users} users with {args.samples_per_user} samples')
+
+    start = time.perf_counter()
+    loader_results = np.array([loader_evaluation(net, dataset, dict_users[i], args.train_batch_size) for i in range(args.num_users)])
+    loader_time = time.perf_counter() - start
+    print(f'{"DataLoader":>12s}: {loader_time:.2f}s')
+
+    start = time.perf_counter()
+    client_data = ClientData(dataset, dict_users)
+    pack_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine_results = np.array([evaluate_client(net, client_data, i, args.eval_batch_size)[:2] for i in range(args.num_users)])
+    engine_time = time.perf_counter() - start
+    print(f'{"engine":>12s}: {engine_time:.2f}s ({loader_time / engine_time:.1f}x), packing the data once: {pack_time:.2f}s')
+
+    print(f'max |accuracy diff| = {np.abs(loader_results[:, 0] - engine_results[:, 0]).max():.3e}, '
+          f'max |loss diff| = {np.abs(loader_results[:, 1] - engine_results[:, 1]).max():.3e}')
+
+    # the same model for every client, stacked like distinct client models
+    rows = torch.cat([v.reshape(-1) for v in net.state_dict().values()]).repeat(args.num_users, 1)
+    vmap_evaluator = VmapEvaluator(net)
+    for group_size in [int(g) for g in args.vmap_clients.split(',')]:
+        start = time.perf_counter()
+        vmap_results = []
+        for group in range(0, args.num_users, group_size):
+            user_idxs = list(range(group, min(group + group_size, args.num_users)))
+            vmap_results += vmap_evaluator(rows[user_idxs], client_data, user_idxs, args.eval_batch_size)
+        vmap_time = time.perf_counter() - start
+        vmap_results = np.array(vmap_results)
+
+        print(f'{"vmap " + str(group_size):>12s}: {vmap_time:.2f}s ({loader_time / vmap_time:.1f}x), '
+              f'max |accuracy diff| = {np.abs(loader_results[:, 0] - vmap_results[:, 0]).max():.3e}, '
+              f'max |loss diff| = {np.abs(loader_results[:, 1] - vmap_results[:, 1]).max():.3e}')
+
+if __name__ == '__main__':
+
+    args = get_parser().parse_args()
+    main(args)
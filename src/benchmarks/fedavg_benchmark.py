@@ -0,0 +1,96 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+# 
+# ---------------------------------------------------------------------------
+# File contains the benchmark of the FedAvg engines.
+# Run from the source directory: python -m benchmarks.fedavg_benchmark
+# ---------------------------------------------------------------------------
+
+import time
+import copy
+import torch
+import numpy as np
+
+from argparse import ArgumentParser, Namespace
+from omegaconf import OmegaConf
+
+from comm import get_aggregator
+from models.nets import CNNLeaf, CNNMnist, MLP
+
+def get_parser() -> ArgumentParser:
+    """Get parser.
+
+    Returns:
+        ArgumentParser: The parser object.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--num-users", type=int, default=50, help="Number of clients")
+    parser.add_argument("--num-clusters", type=int, default=5, help="Number of blocks in the clustering matrix")
+    parser.add_argument("--model", type=str, default="cnnmnist", help="<mlp, cnnmnist, cnnleaf>")
+    parser.add_argument("--engines", type=str, default="loop,matrix_sequential,matrix", help="Comma separated FedAvg engines")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    return parser
+
+def build_models(args: Namespace):
+
+    config = OmegaConf.create({'dataset': {'num_channels': 1, 'num_classes': 10}})
+
+    if args.model == 'mlp':
+        net = MLP(dim_in=784, dim_hidden=200, dim_out=10)
+    elif args.model == 'cnnmnist':
+        net = CNNMnist(config)
+    elif args.model == 'cnnleaf':
+        net = CNNLeaf(config)
+    else:
+        raise ValueError(f'{args.model} not implemented.')
+
+    net_list = []
+    for _ in range(args.num_users):
+        local_net = copy.deepcopy(net)
+        with torch.no_grad():
+            for p in local_net.parameters():
+                p.normal_()
+        net_list.append(local_net)
+
+    return net_list
+
+def build_clustering(args: Namespace):
+
+    membership = np.arange(args.num_users) * args.num_clusters // args.num_users
+    clustering_matrix = (membership[:, None] == membership[None, :]).astype(float)
+    dict_users = {i: np.arange(np.random.randint(50, 500)) for i in range(args.num_users)}
+
+    return clustering_matrix, dict_users
+
+def main(args: Namespace):
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+
+    net_list = build_models(args)
+    clustering_matrix, dict_users = build_clustering(args)
+
+    nr_params = sum(v.numel() for v in net_list[0].state_dict().values())
+    print(f'{args.model}: {args.num_users} users, {args.num_clusters} clusters, {nr_params} parameters per user')
+
+    results = {}
+    for engine in args.engines.split(','):
+        nets = copy.deepcopy(net_list)
+        start = time.perf_counter()
+        nets = get_aggregator(engine)(nets, clustering_matrix, dict_users)
+        elapsed = time.perf_counter() - start
+
+        results[engine] = torch.stack([torch.cat([v.reshape(-1) for v in net.state_dict().values()]) for net in nets])
+        print(f'{engine:>10s}: {elapsed:.3f}s')
+
+    reference = next(iter(results))
+    for engine, params in results.items():
+        max_diff = (params - results[reference]).abs().max().item()
+        print(f'max |{engine} - {reference}| = {max_diff:.3e}')
+
+if __name__ == '__main__':
+
+    args = get_parser().parse_args()
+    main(args)
@@ -0,0 +1,101 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the benchmark of the matching distance between center sets.
+# Run from the source directory: python -m benchmarks.matching_benchmark
+# ---------------------------------------------------------------------------
+
+import time
+import math
+import itertools
+import numpy as np
+
+from argparse import ArgumentParser, Namespace
+
+# utils.cluster imports optim, which imports utils.cluster: enter through optim like main.py
+import optim
+from utils.cluster import min_matching_distance, min_matching_distances
+
+def get_parser() -> ArgumentParser:
+    """Get parser.
+
+    Returns:
+        ArgumentParser: The parser object.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--num-centers", type=str, default="2,5,10", help="Comma separated numbers of centers per set")
+    parser.add_argument("--dim", type=int, default=2, help="Dimension of the centers")
+    parser.add_argument("--pairs", type=int, default=10000, help="Number of pairs of center sets")
+    parser.add_argument("--enumeration-seconds", type=float, default=10, help="Time budget of the permutation enumeration per number of centers")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    return parser
+
+def enumeration_distance(center_small, center_big, deadline):
+    """The permutation enumeration that min_matching_distance replaced.
+
+    Returns:
+        distance (float): the distance, or None if the deadline passed first
+        nr_permutations (int): number of permutations enumerated
+    """
+    distance = np.inf
+    for nr_permutations, p in enumerate(itertools.permutations(range(len(center_big)))):
+        if time.perf_counter() > deadline:
+            return None, nr_permutations
+
+        summation = 0
+        for i in range(len(center_small)):
+            summation = summation + (np.linalg.norm(center_small[i] - center_big[list(p)][i])**2)
+
+        dist = np.sqrt(summation)/len(center_small)
+        if dist < distance:
+            distance = dist
+
+    return distance, nr_permutations + 1
+
+def main(args: Namespace):
+
+    rng = np.random.default_rng(args.seed)
+
+    print(f'{args.pairs} pairs of sets of {args.dim}-dimensional centers')
+    print(f'{"k":>3s} {"enumeration":>14s} {"per pair":>12s} {"batched":>12s} {"speedup":>10s} {"max error":>10s}')
+
+    for k in [int(k) for k in args.num_centers.split(',')]:
+        centers_0 = rng.normal(size=(args.pairs, k, args.dim))
+        centers_1 = rng.normal(size=(args.pairs, k, args.dim))
+
+        # the enumeration is timed on the pairs it finishes within its budget, or extrapolated from a partial pair
+        deadline = time.perf_counter() + args.enumeration_seconds
+        start = time.perf_counter()
+        reference = []
+        for c0, c1 in zip(centers_0, centers_1):
+            distance, nr_permutations = enumeration_distance(c0, c1, deadline)
+            if distance is None:
+                break
+            reference.append(distance)
+        elapsed = time.perf_counter() - start
+
+        if len(reference) > 0:
+            enumeration = elapsed / len(reference)
+        else:
+            enumeration = elapsed / max(nr_permutations, 1) * math.factorial(k)
+
+        start = time.perf_counter()
+        for c0, c1 in zip(centers_0[:len(reference) or 100], centers_1[:len(reference) or 100]):
+            min_matching_distance(c0, c1)
+        per_pair = (time.perf_counter() - start) / (len(reference) or 100)
+
+        start = time.perf_counter()
+        distances = min_matching_distances(centers_0, centers_1)
+        batched = (time.perf_counter() - start) / args.pairs
+
+        error = np.abs(distances[:len(reference)] - np.array(reference)).max() if len(reference) > 0 else float('nan')
+        print(f'{k:>3d} {enumeration * 1e6:>12.1f}us {per_pair * 1e6:>10.1f}us {batched * 1e6:>10.2f}us '
+              f'{enumeration / batched:>9.0f}x {error:>10.2e}')
+
+if __name__ == '__main__':
+
+    args = get_parser().parse_args()
+    main(args)
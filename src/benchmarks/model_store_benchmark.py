@@ -0,0 +1,122 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the peak memory benchmark of the client model stores.
+# Run from the source directory: python -m benchmarks.model_store_benchmark
+# ---------------------------------------------------------------------------
+
+import sys
+import time
+import torch
+import resource
+import tempfile
+import subprocess
+import numpy as np
+
+from pathlib import Path
+from argparse import ArgumentParser, Namespace
+from omegaconf import OmegaConf
+
+from comm import get_aggregator
+from models.nets import CNNLeaf, CNNMnist, MLP
+from models.store import ClientModelStore, MemmapModelStore
+
+def get_parser() -> ArgumentParser:
+    """Get parser.
+
+    Returns:
+        ArgumentParser: The parser object.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--num-users", type=int, default=5000, help="Number of clients")
+    parser.add_argument("--num-clusters", type=int, default=50, help="Number of blocks in the clustering matrix")
+    parser.add_argument("--rounds", type=int, default=3, help="Number of simulated rounds")
+    parser.add_argument("--frac", type=float, default=1.0, help="Fraction of clients trained per round")
+    parser.add_argument("--model", type=str, default="cnnmnist", help="<mlp, cnnmnist, cnnleaf>")
+    parser.add_argument("--stores", type=str, default="memory,memmap", help="Comma separated model stores")
+    parser.add_argument("--aggregation", type=str, default="matrix_sequential", help="<matrix_sequential, matrix, topk, graph>")
+    parser.add_argument("--store", type=str, default=None, help="Run a single model store in this process")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    return parser
+
+def build_model(args: Namespace):
+
+    config = OmegaConf.create({'dataset': {'num_channels': 1, 'num_classes': 10}})
+
+    if args.model == 'mlp':
+        return MLP(dim_in=784, dim_hidden=200, dim_out=10)
+    elif args.model == 'cnnmnist':
+        return CNNMnist(config)
+    elif args.model == 'cnnleaf':
+        return CNNLeaf(config)
+    else:
+        raise ValueError(f'{args.model} not implemented.')
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_store(args: Namespace):
+    """Simulates local training and FedAvg rounds on one store, prints time and peak RSS."""
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+
+    net = build_model(args)
+
+    membership = np.arange(args.num_users) * args.num_clusters // args.num_users
+    clustering_matrix = (membership[:, None] == membership[None, :]).astype(float)
+    dict_users = [np.arange(np.random.randint(50, 500)) for _ in range(args.num_users)]
+    aggregator = get_aggregator(args.aggregation)
+    baseline = peak_rss_mb()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+
+        if args.store == 'memmap':
+            model_store = MemmapModelStore(net, args.num_users, Path(tmp_dir).joinpath('client_models.npy'))
+        else:
+            model_store = ClientModelStore(net, args.num_users)
+
+        for _ in range(args.rounds):
+            m = max(int(args.frac * args.num_users), 1)
+            for idx in np.random.choice(range(args.num_users), m, replace=False):
+                model_store.load(idx)
+                with torch.no_grad():
+                    for p in net.parameters():
+                        p.add_(torch.randn_like(p), alpha=0.01)
+                model_store.store(idx)
+
+            users = np.arange(args.num_users)
+            params, rows = model_store.gather(users)
+            averaged, inverse = aggregator(params, clustering_matrix, dict_users, rows=rows)
+            del params
+            model_store.assign(users, averaged, inverse)
+            del averaged
+
+        elapsed = time.perf_counter() - start
+
+    print(f'{args.store:>8s}: {elapsed:.2f}s, peak RSS {peak_rss_mb():.1f} MB '
+          f'({peak_rss_mb() - baseline:.1f} MB above the {baseline:.1f} MB after setup)')
+
+def main(args: Namespace):
+
+    net = build_model(args)
+    nr_params = sum(v.numel() for v in net.state_dict().values())
+    print(f'{args.model}: {args.num_users} users, {args.num_clusters} clusters, {args.rounds} rounds, {args.aggregation} aggregation, '
+          f'{nr_params} parameters per user ({args.num_users * nr_params * 4 / 2**20:.1f} MB dense)')
+
+    # every store runs in a fresh process, the peak RSS of a process never decreases
+    for store in args.stores.split(','):
+        argv = sys.argv[1:] + ['--store', store]
+        subprocess.run([sys.executable, '-m', 'benchmarks.model_store_benchmark'] + argv, check=True)
+
+if __name__ == '__main__':
+
+    args = get_parser().parse_args()
+    if args.store is None:
+        main(args)
+    else:
+        run_store(args)
@@ -0,0 +1,83 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the benchmark of the sparse client graph of the signature clustering.
+# Run from the source directory: python -m benchmarks.signature_graph_benchmark
+# ---------------------------------------------------------------------------
+
+import time
+import numpy as np
+
+from argparse import ArgumentParser, Namespace
+
+# utils.cluster imports optim, which imports utils.cluster: enter through optim like main.py
+import optim
+from utils.cluster import signature_graph, pairwise_matching_distances
+
+def get_parser() -> ArgumentParser:
+    """Get parser.
+
+    Returns:
+        ArgumentParser: The parser object.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--num-users", type=str, default="2000,10000", help="Comma separated numbers of clients")
+    parser.add_argument("--exact-users", type=int, default=2000, help="Largest number of clients compared to the dense matrix")
+    parser.add_argument("--num-centers", type=int, default=5, help="Centers per client")
+    parser.add_argument("--dim", type=int, default=2, help="Dimension of the centers")
+    parser.add_argument("--clusters", type=int, default=50, help="Number of groups of related clients")
+    parser.add_argument("--spread", type=float, default=20, help="Scale of the centers of the groups")
+    parser.add_argument("--noise", type=float, default=0.3, help="Scale of the deviation of a client from its group")
+    parser.add_argument("--threshold", type=float, default=1, help="Distance under which two clients are connected")
+    parser.add_argument("--slacks", type=str, default="1,1.5,2", help="Comma separated radius factors of the sorted candidates")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    return parser
+
+def synthetic_centers(num_users: int, args: Namespace, rng):
+    """Center sets of clients drawn around the center sets of args.clusters groups, in random order."""
+    groups = rng.uniform(0, args.spread, size=(args.clusters, args.num_centers, args.dim))
+    members = rng.integers(0, args.clusters, size=num_users)
+
+    centers = groups[members] + rng.normal(scale=args.noise, size=(num_users, args.num_centers, args.dim))
+    order = np.argsort(rng.random((num_users, args.num_centers)), axis=1)
+
+    return np.take_along_axis(centers, order[:, :, None], axis=1)
+
+def main(args: Namespace):
+
+    rng = np.random.default_rng(args.seed)
+
+    print(f'{args.num_centers} centers of dimension {args.dim} per client, {args.clusters} groups, threshold {args.threshold}')
+    print(f'{"users":>7s} {"method":>12s} {"time":>9s} {"edges":>10s} {"recall":>8s}')
+
+    for num_users in [int(n) for n in args.num_users.split(',')]:
+        centers = synthetic_centers(num_users, args, rng)
+
+        exact = None
+        if num_users <= args.exact_users:
+            start = time.perf_counter()
+            exact = pairwise_matching_distances(centers) < args.threshold
+            elapsed = time.perf_counter() - start
+            print(f'{num_users:>7d} {"dense":>12s} {elapsed:>8.2f}s {int(exact.sum()):>10d} {1:>8.4f}')
+
+        methods = [('mean', 1.0)] + [('sorted', float(slack)) for slack in args.slacks.split(',')]
+        for candidates, slack in methods:
+            start = time.perf_counter()
+            clustering_matrix, _ = signature_graph(centers, args.threshold, candidates=candidates, slack=slack)
+            elapsed = time.perf_counter() - start
+
+            # the mean candidates find every edge, they are the reference beyond exact_users
+            if exact is None:
+                exact = clustering_matrix.toarray() > 0
+
+            name = candidates if candidates == 'mean' else f'sorted {slack:g}'
+            recall = clustering_matrix.multiply(exact).sum() / exact.sum()
+            print(f'{num_users:>7d} {name:>12s} {elapsed:>8.2f}s {clustering_matrix.nnz:>10d} {recall:>8.4f}')
+
+if __name__ == '__main__':
+
+    args = get_parser().parse_args()
+    main(args)
@@ -0,0 +1,90 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the benchmark of the per-client and batched UMAP transform of clustering_umap.
+# Run from the source directory: python -m benchmarks.umap_benchmark
+# ---------------------------------------------------------------------------
+
+import time
+import umap
+import torch
+import numpy as np
+
+from argparse import ArgumentParser, Namespace
+
+# utils.cluster imports optim, which imports utils.cluster: enter through optim like main.py
+import optim
+from datasets.client_data import ClientData
+from utils.cluster import umap_embeddings
+
+def get_parser() -> ArgumentParser:
+    """Get parser.
+
+    Returns:
+        ArgumentParser: The parser object.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--num-users", type=str, default="20,100,500", help="Comma separated numbers of clients")
+    parser.add_argument("--samples", type=int, default=100, help="Samples per client")
+    parser.add_argument("--dataset-size", type=int, default=20000, help="Samples of the synthetic dataset")
+    parser.add_argument("--fit-samples", type=int, default=5000, help="Samples the reducer is fitted on")
+    parser.add_argument("--classes", type=int, default=10, help="Classes of the synthetic dataset")
+    parser.add_argument("--transform-samples", type=int, default=10000, help="Samples per batched transform call")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    return parser
+
+class SyntheticImages:
+    """[1, 28, 28] images scattered around one random prototype per class."""
+
+    def __init__(self, args: Namespace, rng):
+
+        prototypes = rng.uniform(0, 1, size=(args.classes, 1, 28, 28))
+        self.labels = rng.integers(0, args.classes, size=args.dataset_size)
+        self.images = torch.as_tensor(prototypes[self.labels] + rng.normal(scale=0.3, size=(args.dataset_size, 1, 28, 28)),
+                                      dtype=torch.float32)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        return self.images[idx], int(self.labels[idx])
+
+def main(args: Namespace):
+
+    rng = np.random.default_rng(args.seed)
+    dataset = SyntheticImages(args, rng)
+
+    start = time.perf_counter()
+    reducer = umap.UMAP(n_components=2, random_state=args.seed)
+    reducer.fit(dataset.images[:args.fit_samples].reshape(args.fit_samples, -1).numpy().astype(np.float64))
+    # the first transform compiles the numba kernels
+    reducer.transform(dataset.images[:10].reshape(10, -1).numpy().astype(np.float64))
+    print(f'Reducer fitted on {args.fit_samples} samples in {time.perf_counter() - start:.1f}s, {args.samples} samples per client')
+    print(f'{"users":>6s} {"per client":>11s} {"batched":>9s} {"speedup":>8s} {"mean shift":>11s}')
+
+    for num_users in [int(n) for n in args.num_users.split(',')]:
+        dict_users = {idx: set(rng.choice(len(dataset), args.samples, replace=False).tolist()) for idx in range(num_users)}
+        client_data = ClientData(dataset, dict_users)
+        users = np.arange(num_users)
+
+        torch.manual_seed(args.seed)
+        start = time.perf_counter()
+        per_client, _ = umap_embeddings(reducer, client_data, users)
+        per_client_time = time.perf_counter() - start
+
+        torch.manual_seed(args.seed)
+        start = time.perf_counter()
+        batched, _ = umap_embeddings(reducer, client_data, users, batched=True, transform_samples=args.transform_samples)
+        batched_time = time.perf_counter() - start
+
+        # distance between the two embeddings of a sample, in the units of the clustering threshold
+        shift = np.linalg.norm(per_client - batched, axis=1).mean()
+        print(f'{num_users:>6d} {per_client_time:>10.2f}s {batched_time:>8.2f}s {per_client_time / batched_time:>7.1f}x {shift:>11.3f}')
+
+if __name__ == '__main__':
+
+    args = get_parser().parse_args()
+    main(args)
@@ -0,0 +1,103 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the throughput benchmark of vmapped local training.
+# Run from the source directory: python -m benchmarks.vmap_benchmark
+# ---------------------------------------------------------------------------
+
+import time
+import torch
+import numpy as np
+
+from argparse import ArgumentParser, Namespace
+from omegaconf import OmegaConf
+
+from models.nets import CNNMnist, MLP
+from optim.vmap_update import VmapLocalUpdate
+
+def get_parser() -> ArgumentParser:
+    """Get parser.
+
+    Returns:
+        ArgumentParser: The parser object.
+    """
+    parser = ArgumentParser()
+    parser.add_argument("--num-users", type=int, default=64, help="Number of clients trained in one round")
+    parser.add_argument("--group-sizes", type=str, default="8,16,32,64", help="Comma separated numbers of clients per vmap group")
+    parser.add_argument("--model", type=str, default="mlp", help="<mlp, cnnmnist>")
+    parser.add_argument("--min-samples", type=int, default=100, help="Smallest client dataset")
+    parser.add_argument("--max-samples", type=int, default=300, help="Largest client dataset")
+    parser.add_argument("--batch-size", type=int, default=10, help="Local batch size")
+    parser.add_argument("--local-ep", type=int, default=1, help="Number of local epochs")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    return parser
+
+def build_model(args: Namespace):
+
+    if args.model == 'mlp':
+        return MLP(dim_in=784, dim_hidden=200, dim_out=10)
+    elif args.model == 'cnnmnist':
+        return CNNMnist(OmegaConf.create({'dataset': {'num_channels': 1, 'num_classes': 10}}))
+    else:
+        raise ValueError(f'{args.model} not implemented.')
+
+def sequential_round(net, rows, client_data, args: Namespace):
+    """The loop of FLT.localUpdate on in-memory tensors."""
+    state = net.state_dict()
+    loss_func = torch.nn.CrossEntropyLoss()
+
+    for row, (images, labels) in zip(rows, client_data):
+        offset = 0
+        for k, v in state.items():
+            v.copy_(row[offset: offset + v.numel()].view(v.shape))
+            offset += v.numel()
+
+        net.train()
+        optimizer = torch.optim.SGD(net.parameters(), lr=0.01, momentum=0.5)
+        for _ in range(args.local_ep):
+            for batch in torch.randperm(len(labels)).split(args.batch_size):
+                net.zero_grad()
+                loss = loss_func(net(images[batch]), labels[batch])
+                loss.backward()
+                optimizer.step()
+
+def main(args: Namespace):
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+
+    net = build_model(args)
+    nr_params = sum(v.numel() for v in net.state_dict().values())
+    rows = torch.cat([v.reshape(-1) for v in net.state_dict().values()]).repeat(args.num_users, 1)
+
+    client_data = []
+    for _ in range(args.num_users):
+        n = np.random.randint(args.min_samples, args.max_samples + 1)
+        client_data.append((torch.randn(n, 1, 28, 28), torch.randint(0, 10, (n,))))
+
+    # FLT groups the clients by dataset size
+    client_data = sorted(client_data, key=lambda data: len(data[1]))
+
+    print(f'{args.model}: {args.num_users} users with {args.min_samples}-{args.max_samples} samples, '
+          f'{nr_params} parameters per user, {torch.get_num_threads()} threads')
+
+    start = time.perf_counter()
+    sequential_round(net, rows, client_data, args)
+    sequential = time.perf_counter() - start
+    print(f'{"sequential":>12s}: {sequential:.2f}s')
+
+    vmap_update = VmapLocalUpdate(net, lr=0.01, momentum=0.5, batch_size=args.batch_size, local_ep=args.local_ep)
+    for group_size in [int(g) for g in args.group_sizes.split(',')]:
+        start = time.perf_counter()
+        for group in range(0, args.num_users, group_size):
+            vmap_update(rows[group: group + group_size], client_data[group: group + group_size])
+        elapsed = time.perf_counter() - start
+        print(f'{"vmap " + str(group_size):>12s}: {elapsed:.2f}s ({sequential / elapsed:.1f}x)')
+
+if __name__ == '__main__':
+
+    args = get_parser().parse_args()
+    main(args)
@@ -0,0 +1,14 @@
+from functools import partial
+from .fedavg import FedAvg, FedAvgMatrix, FedAvgSparse
+
+def get_aggregator(name: str):
+    
+    available_aggregators = {
+        'loop': FedAvg,
+        'matrix': FedAvgMatrix,
+        'matrix_sequential': partial(FedAvgMatrix, sequential=True),
+        'topk': FedAvgSparse,
+        'graph': FedAvgSparse,
+    }
+
+    return available_aggregators[name]
\ No newline at end of file
@@ -3,16 +3,25 @@
 # Created Date: 23-Nov-2020
 # 
 # Refactored By: Sayak Mukherjee
-# Last Update: 27-Oct-2023
+# Last Update: 18-Oct-2026
 # ---------------------------------------------------------------------------
 # File contains the code for federated averaging.
 # ---------------------------------------------------------------------------
 
 import torch
 import tqdm
+import logging
+import numpy as np
+import scipy.linalg
+import scipy.sparse
 
 from collections import OrderedDict
 
+logger = logging.getLogger(__name__)
+
+# upper bound on the number of elements of one [N, chunk] slice of the parameter matrix
+AGGREGATION_CHUNK_NUMEL = 2**24
+
 def FedAvg(net_local_list, clustering_matrix, dict_users):
             
     for idx in tqdm.tqdm(range(len(net_local_list))):
@@ -34,4 +43,325 @@ def FedAvg(net_local_list, clustering_matrix, dict_users):
 
             one_w_avg[k] = torch.div(one_w_avg[k], sum_len)
         net_local_list[idx].load_state_dict(one_w_avg)
-    return net_local_list
\ No newline at end of file
+    return net_local_list
+
+def flatten_state_dicts(net_list, dtype=torch.float32):
+    """Stacks the state dicts of a list of models into one [N, P] tensor.
+
+    Arguments:
+        net_list (list): models sharing the same architecture
+        dtype (torch.dtype): dtype of the flat parameter matrix
+
+    Returns:
+        params (torch.Tensor): [N, P] matrix, one row per model
+        layout (list(tuple)): (key, shape, numel) for every state dict entry
+    """
+    template = net_list[0].state_dict()
+    layout = [(k, v.shape, v.numel()) for k, v in template.items()]
+    nr_params = sum(numel for _, _, numel in layout)
+    device = next(iter(template.values())).device
+
+    params = torch.empty((len(net_list), nr_params), dtype=dtype, device=device)
+    for i, net in enumerate(net_list):
+        offset = 0
+        for k, v in net.state_dict().items():
+            params[i, offset: offset + v.numel()].copy_(v.reshape(-1))
+            offset += v.numel()
+
+    return params, layout
+
+@torch.no_grad()
+def load_flat_state(net, flat, layout):
+    """Copies a flat parameter row back into the (existing) tensors of a model."""
+    state = net.state_dict()
+    offset = 0
+    for k, shape, numel in layout:
+        state[k].copy_(flat[offset: offset + numel].view(shape))
+        offset += numel
+
+def aggregation_weights(clustering_matrix, dict_users, sequential=False):
+    """Builds the row-normalized FedAvg weight matrix.
+
+    Entry (i, j) is the share of client j in the average of client i, i.e.
+    len(dict_users[j]) normalized over all j with clustering_matrix[i][j] == 1.
+
+    FedAvg updates the models in place while looping over the clients, so client i
+    averages the already aggregated models of clients j < i. With sequential=True
+    the returned matrix reproduces this order dependence: solving (I - L) M = D + U,
+    with L the strictly lower triangular part of the weights, gives the M for which
+    M @ X equals the output of the loop.
+
+    Arguments:
+        clustering_matrix (ndarray): [N, N] adjacency matrix
+        dict_users (dict): sample indices per client
+        sequential (bool): reproduce the in-place update order of FedAvg
+
+    Returns:
+        weights (ndarray): [N, N] float64 weight matrix
+    """
+    adjacency = np.asarray(clustering_matrix) == 1
+    nr_samples = np.array([len(dict_users[i]) for i in range(adjacency.shape[1])], dtype=np.float64)
+
+    weights = adjacency * nr_samples[None, :]
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    if sequential:
+        lower = np.tril(weights, k=-1)
+        weights = scipy.linalg.solve_triangular(np.eye(len(weights)) - lower, weights - lower, 
+                                                lower=True, unit_diagonal=True)
+
+    return weights
+
+def sparse_aggregation_weights(affinity_matrix, dict_users):
+    """Builds the row-normalized FedAvg weight matrix from a sparse affinity matrix.
+
+    Entry (i, j) is proportional to affinity_matrix[i, j] * len(dict_users[j]).
+
+    Arguments:
+        affinity_matrix (scipy.sparse or ndarray): [N, N] client affinities
+        dict_users (dict): sample indices per client
+
+    Returns:
+        weights (torch.Tensor): [N, N] sparse COO float64 weight matrix
+    """
+    affinity = scipy.sparse.csr_matrix(affinity_matrix, dtype=np.float64)
+    nr_samples = np.array([len(dict_users[i]) for i in range(affinity.shape[1])], dtype=np.float64)
+
+    weights = affinity.multiply(nr_samples[None, :]).tocsr()
+    weights = scipy.sparse.diags(1 / np.asarray(weights.sum(axis=1)).reshape(-1)) @ weights
+    weights = weights.tocoo()
+
+    return torch.sparse_coo_tensor(np.vstack((weights.row, weights.col)), weights.data, weights.shape).coalesce()
+
+def neighbourhood_classes(clustering_matrix):
+    """Groups the clients whose rows of the clustering matrix are identical.
+
+    Clients with the same neighbourhood share the same FedAvg result, so the
+    average only has to be computed once per class.
+
+    Arguments:
+        clustering_matrix (ndarray or scipy.sparse): [N, N] adjacency matrix
+
+    Returns:
+        representatives (ndarray): first client of every class
+        inverse (ndarray): class index of every client
+    """
+    if scipy.sparse.issparse(clustering_matrix):
+        adjacency = scipy.sparse.csr_matrix(clustering_matrix == 1)
+        adjacency.sort_indices()
+        keys = [adjacency.indices[adjacency.indptr[idx]: adjacency.indptr[idx + 1]].tobytes() for idx in range(adjacency.shape[0])]
+    else:
+        keys = [np.packbits(row).tobytes() for row in np.asarray(clustering_matrix) == 1]
+
+    class_of_row = {}
+    representatives = []
+    inverse = np.empty(len(keys), dtype=np.int64)
+    for idx, key in enumerate(keys):
+        if key not in class_of_row:
+            class_of_row[key] = len(representatives)
+            representatives.append(idx)
+        inverse[idx] = class_of_row[key]
+
+    return np.array(representatives, dtype=np.int64), inverse
+
+def collapse_weights(weights, rows, nr_rows):
+    """Sums the weight columns of clients that share a parameter row.
+
+    Arguments:
+        weights (ndarray or torch.Tensor): [M, N] aggregation weights, dense or sparse COO
+        rows (ndarray): parameter row of every client
+        nr_rows (int): number of parameter rows
+
+    Returns:
+        weights (ndarray or torch.Tensor): [M, nr_rows] aggregation weights
+    """
+    if isinstance(weights, torch.Tensor) and weights.is_sparse:
+        indices = weights.indices().clone()
+        indices[1] = torch.as_tensor(rows, device=indices.device)[indices[1]]
+        return torch.sparse_coo_tensor(indices, weights.values(), (weights.shape[0], nr_rows)).coalesce()
+
+    collapsed = np.zeros((weights.shape[0], nr_rows))
+    np.add.at(collapsed.T, rows, np.asarray(weights).T)
+
+    return collapsed
+
+@torch.no_grad()
+def weighted_average(params, weights, rows=None, chunk_numel=AGGREGATION_CHUNK_NUMEL):
+    """Computes weights @ params, chunked along the parameter axis.
+
+    Arguments:
+        params (torch.Tensor or MemmapRows): [N, P] flat parameters, or [B, P] distinct rows if rows is given
+        weights (ndarray or torch.Tensor): [M, N] aggregation weights, dense or sparse COO
+        rows (ndarray): client i has the parameters params[rows[i]]
+        chunk_numel (int): bound on the elements of one [N, chunk] slice
+
+    Returns:
+        averaged (torch.Tensor or ColumnChunkAverage): [M, P] averaged parameters,
+            computed lazily by column chunks for MemmapRows
+    """
+    if rows is not None:
+        weights = collapse_weights(weights, rows, len(params))
+
+    if not isinstance(params, torch.Tensor):
+        return ColumnChunkAverage(params, weights, chunk_numel)
+
+    if isinstance(weights, torch.Tensor):
+        weights = weights.to(dtype=params.dtype, device=params.device)
+    else:
+        weights = torch.as_tensor(weights, dtype=params.dtype, device=params.device)
+    averaged = torch.empty((weights.shape[0], params.shape[1]), dtype=params.dtype, device=params.device)
+
+    chunk = max(1, chunk_numel // max(1, params.shape[0]))
+    for start in range(0, params.shape[1], chunk):
+        stop = min(start + chunk, params.shape[1])
+        if weights.is_sparse:
+            averaged[:, start:stop] = torch.sparse.mm(weights, params[:, start:stop])
+        else:
+            averaged[:, start:stop] = weights @ params[:, start:stop]
+
+    return averaged
+
+class ColumnChunkAverage:
+    """weights @ params of the rows of a memory-mapped model store, one chunk of columns at a time.
+
+    The [M, P] average is never held in memory: MemmapModelStore.assign writes every
+    chunk into the store as soon as it is computed. The chunks of the columns that
+    are not written yet are still read from the pre-aggregation rows.
+
+    Arguments:
+        params (MemmapRows): [N, P] rows of a memory-mapped model store
+        weights (ndarray or torch.Tensor): [M, N] aggregation weights, dense or sparse COO
+        chunk_numel (int): bound on the elements of one [N, chunk] or [M, chunk] slice
+    """
+
+    def __init__(self, params, weights, chunk_numel=AGGREGATION_CHUNK_NUMEL):
+
+        self.params = params
+        # converted once, not for every chunk
+        if not isinstance(weights, torch.Tensor):
+            weights = torch.as_tensor(weights, dtype=torch.float32)
+        self.weights = weights.to(dtype=torch.float32, device=params.store.device)
+        self.chunk = max(1, chunk_numel // max(1, weights.shape[0], params.shape[0]))
+
+    @property
+    def shape(self):
+        return (self.weights.shape[0], self.params.shape[1])
+
+    def column_chunks(self):
+        """Yields (start, stop, [M, stop - start] averaged columns)."""
+        for start in range(0, self.params.shape[1], self.chunk):
+            stop = min(start + self.chunk, self.params.shape[1])
+            yield start, stop, weighted_average(self.params.columns(start, stop), self.weights)
+
+    def dense(self):
+        """[M, P] tensor of the average."""
+        return torch.cat([columns for _, _, columns in self.column_chunks()], dim=1)
+
+def fedavg_matrix(params, clustering_matrix, dict_users, sequential=False, rows=None):
+    """Matrix form of FedAvg on flat parameters.
+
+    Arguments:
+        params (torch.Tensor): [N, P] flat parameters, or [B, P] distinct rows if rows is given
+        clustering_matrix (ndarray): [N, N] adjacency matrix
+        dict_users (dict or list): sample indices per client
+        sequential (bool): reproduce the in-place update order of FedAvg
+        rows (ndarray): client i has the parameters params[rows[i]]
+
+    Returns:
+        averaged (torch.Tensor): [U, P] one average per neighbourhood class
+        inverse (ndarray): class of every client, client i gets averaged[inverse[i]]
+    """
+    nr_users = len(clustering_matrix)
+
+    if sequential:
+        weights = aggregation_weights(clustering_matrix, dict_users, sequential)
+        inverse = np.arange(nr_users)
+    else:
+        representatives, inverse = neighbourhood_classes(clustering_matrix)
+        weights = aggregation_weights(np.asarray(clustering_matrix)[representatives], dict_users)
+        logger.info(f'FedAvg over {len(representatives)} distinct neighbourhoods of {nr_users} users')
+
+    return weighted_average(params, weights, rows), inverse
+
+def fedavg_sparse(params, affinity_matrix, dict_users, rows=None):
+    """Sparse form of FedAvg on flat parameters, see fedavg_matrix."""
+    weights = sparse_aggregation_weights(affinity_matrix, dict_users)
+    logger.info(f'Sparse FedAvg with {weights._nnz()} edges over {weights.shape[0]} users')
+
+    return weighted_average(params, weights, rows), np.arange(weights.shape[0])
+
+def _aggregate(engine, net_local_list, *args, **kwargs):
+    """Runs a flat engine on a list of models (updated in place) or on flat parameters."""
+    if not isinstance(net_local_list, (list, tuple)):
+        return engine(net_local_list, *args, **kwargs)
+
+    params, layout = flatten_state_dicts(net_local_list)
+    averaged, inverse = engine(params, *args, **kwargs)
+    del params
+
+    for idx in range(len(net_local_list)):
+        load_flat_state(net_local_list[idx], averaged[inverse[idx]], layout)
+
+    return net_local_list
+
+def FedAvgMatrix(net_local_list, clustering_matrix, dict_users, sequential=False, rows=None):
+    """Matrix form of FedAvg: every client's average is one row of W @ X.
+
+    Drop-in replacement for FedAvg; the models in net_local_list are updated in place.
+    By default every client averages the models as they were before aggregation and
+    the average is computed once per class of identical clustering matrix rows.
+    sequential=True reproduces FedAvg bit for bit up to float rounding.
+
+    Given the flat parameters instead of models, (averaged, inverse) of
+    fedavg_matrix is returned.
+    """
+    return _aggregate(fedavg_matrix, net_local_list, clustering_matrix, dict_users, sequential, rows=rows)
+
+def FedAvgSparse(net_local_list, affinity_matrix, dict_users, rows=None):
+    """FedAvg as a sparse-dense product over a (top-k) affinity matrix.
+
+    The cost is O(nnz * P) instead of O(N^2 * P); the models in net_local_list are
+    updated in place. Given flat parameters, (averaged, inverse) is returned.
+    """
+    return _aggregate(fedavg_sparse, net_local_list, affinity_matrix, dict_users, rows=rows)
+
+class StreamingFedAvg:
+    """Running weighted sums for FedAvg.
+
+    Every client model is folded into the sums it contributes to as soon as it is
+    available, so the client models never have to be held at the same time.
+    By default the sums have the semantics of FedAvgMatrix: every client averages the
+    models as they were before aggregation, and there is one sum per class of identical
+    clustering matrix rows. sequential=True folds in the weights of the triangular
+    solve of aggregation_weights instead and reproduces FedAvg, at the cost of one sum
+    per client: the sequential weights of two clients differ even if their
+    neighbourhoods are the same.
+    """
+
+    def __init__(self, clustering_matrix, dict_users, sequential=False):
+
+        if sequential:
+            self.weights = aggregation_weights(clustering_matrix, dict_users, sequential)
+            self.inverse = np.arange(len(self.weights))
+        else:
+            representatives, self.inverse = neighbourhood_classes(clustering_matrix)
+            self.weights = aggregation_weights(np.asarray(clustering_matrix)[representatives], dict_users)
+
+        self.sums = None
+
+    @torch.no_grad()
+    def fold(self, idx, flat):
+        """Adds the weighted flat parameters of client idx to the running sums."""
+        if self.sums is None:
+            self.sums = torch.zeros((len(self.weights), flat.shape[-1]), dtype=flat.dtype, device=flat.device)
+
+        classes = np.flatnonzero(self.weights[:, idx])
+        if len(classes) > 0:
+            column = torch.as_tensor(self.weights[classes, idx], dtype=flat.dtype, device=flat.device)
+            self.sums.index_add_(0, torch.as_tensor(classes, device=flat.device), column[:, None] * flat.view(1, -1))
+
+    def average(self):
+        """Returns (averaged, inverse), client i gets averaged[inverse[i]]."""
+        logger.info(f'Streaming FedAvg with {len(self.weights)} running sums for {len(self.inverse)} users')
+
+        return self.sums, self.inverse
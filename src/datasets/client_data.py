@@ -0,0 +1,129 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the pre-tensorized samples of the clients.
+# ---------------------------------------------------------------------------
+
+import torch
+import hashlib
+import itertools
+import numpy as np
+
+from torch.utils.data import Dataset
+
+# distinguishes the fingerprints of different ClientData
+_instance_ids = itertools.count()
+
+class ClientData:
+    """Samples of all clients of a dataset, transformed once into packed tensors.
+
+    Every sample that belongs to at least one client is fetched through the
+    __getitem__ of the dataset (PIL conversion and transforms) exactly once. The
+    samples of a client are then selected by index, and mini-batches are drawn by
+    permuting these indices, with no per-sample Python work.
+
+    Arguments:
+        dataset (Dataset): dataset the indices of dict_users refer to
+        dict_users (dict): sample indices of every client
+        device: device of the packed tensors
+    """
+
+    def __init__(self, dataset: Dataset, dict_users, device='cpu'):
+
+        self.dict_users = dict_users
+        self.dataset_size = len(dataset)
+
+        # order of DatasetSplit
+        user_idxs = {user_idx: np.asarray(list(idxs), dtype=np.int64) for user_idx, idxs in dict_users.items()}
+
+        self.sample_idxs = np.unique(np.concatenate(list(user_idxs.values())))
+
+        images, labels = zip(*[dataset[i] for i in self.sample_idxs])
+        self.images = torch.stack(images).to(device)
+        self.labels = torch.as_tensor(labels, dtype=torch.long).to(device)
+
+        # positions of the samples of every client in the packed tensors
+        self.positions = {user_idx: torch.as_tensor(np.searchsorted(self.sample_idxs, idxs), device=device)
+                          for user_idx, idxs in user_idxs.items()}
+
+        # clients with the same set of samples share a fingerprint
+        instance_id = next(_instance_ids)
+        self.fingerprints = {user_idx: (instance_id, hashlib.blake2b(np.sort(idxs).tobytes(), digest_size=16).hexdigest())
+                             for user_idx, idxs in user_idxs.items()}
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def sample_shape(self):
+        return self.images.shape[1:]
+
+    def subsample(self, num_samples: int, seed: int = 0):
+        """The same packed tensors with a fixed random subset of at most num_samples per client."""
+        rng = np.random.default_rng(seed)
+
+        subset = object.__new__(ClientData)
+        subset.dict_users = self.dict_users
+        subset.dataset_size = self.dataset_size
+        subset.sample_idxs = self.sample_idxs
+        subset.images = self.images
+        subset.labels = self.labels
+        subset.positions = {}
+        for user_idx, positions in self.positions.items():
+            keep = np.sort(rng.permutation(len(positions))[:num_samples])
+            subset.positions[user_idx] = positions[torch.as_tensor(keep, device=positions.device)]
+
+        instance_id = next(_instance_ids)
+        subset.fingerprints = {user_idx: (instance_id, hashlib.blake2b(np.sort(positions.cpu().numpy()).tobytes(), digest_size=16).hexdigest())
+                               for user_idx, positions in subset.positions.items()}
+
+        return subset
+
+    def fingerprint(self, user_idx):
+        """Equal for two clients of this data with the same set of samples."""
+        return self.fingerprints[user_idx]
+
+    def sample_digest(self, user_idx):
+        """Hex digest of the dataset indices of the samples of a client, equal across runs and instances."""
+        idxs = np.sort(self.sample_idxs[self.positions[user_idx].cpu().numpy()])
+        return hashlib.blake2b(idxs.tobytes(), digest_size=16).hexdigest()
+
+    def num_samples(self, user_idx):
+        return len(self.positions[user_idx])
+
+    def _positions(self, user_idx, shuffle):
+        """Positions of the samples of a client, shuffled like DataLoader(shuffle=True).
+
+        The permutation is drawn from the global torch RNG the way DataLoader draws
+        it, so runs stay reproducible against the per-sample loaders.
+        """
+        positions = self.positions[user_idx]
+        if not shuffle:
+            return positions
+
+        # seed of the loader iterator, then seed of the RandomSampler
+        torch.empty((), dtype=torch.int64).random_()
+        seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        generator = torch.Generator()
+        generator.manual_seed(seed)
+
+        return positions[torch.randperm(len(positions), generator=generator).to(positions.device)]
+
+    def sample_positions(self, user_idx, shuffle=False):
+        """Positions of the samples of a client in the packed tensors, shuffled like client() and batches()."""
+        return self._positions(user_idx, shuffle)
+
+    def client(self, user_idx, shuffle=False):
+        """All (images, labels) of a client, in the order of dict_users unless shuffled."""
+        positions = self._positions(user_idx, shuffle)
+        return self.images[positions], self.labels[positions]
+
+    def batches(self, user_idx, batch_size, shuffle=False):
+        """Yields the (images, labels) mini-batches of a client."""
+        positions = self._positions(user_idx, shuffle)
+
+        for start in range(0, len(positions), batch_size):
+            batch = positions[start: start + batch_size]
+            yield self.images[batch], self.labels[batch]
@@ -0,0 +1,423 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+# 
+# ---------------------------------------------------------------------------
+# File contains the flat parameter store of the client models.
+# ---------------------------------------------------------------------------
+
+import torch
+import numpy as np
+
+from pathlib import Path
+from .basenet import BaseNet
+from comm.fedavg import ColumnChunkAverage
+
+# upper bound on the number of elements read from disk at once
+MEMMAP_BLOCK_NUMEL = 2**24
+
+class ModelTokens:
+    """Content tokens of the client models: clients with equal tokens have identical weights.
+
+    All clients start with token 0, writing the models of a set of clients gives
+    them one new token together.
+    """
+
+    def __init__(self, num_users: int):
+
+        self.tokens = np.zeros(num_users, dtype=np.int64)
+        self.next_token = 1
+
+    def __getitem__(self, user_idx):
+        return self.tokens[user_idx]
+
+    def renew(self, users):
+        self.tokens[users] = self.next_token
+        self.next_token += 1
+
+class ClientModelStore:
+    """Parameters and buffers of all clients as rows of one flat buffer pool.
+
+    A single template module is shared by all clients: load() copies the row of a
+    client into the existing tensors of the template and store() copies them back,
+    so no module is ever deep-copied.
+
+    Rows are copy-on-write: clients with identical weights (all clients at start,
+    the members of a cluster after FedAvg) reference the same row until one of
+    them is stored after local training.
+    """
+
+    def __init__(self, net: BaseNet, num_users: int):
+
+        self.net = net
+        self.num_users = num_users
+
+        state = net.state_dict()
+        self.layout = [(k, v.shape, v.numel()) for k, v in state.items()]
+        self.nr_params = sum(numel for _, _, numel in self.layout)
+
+        device = next(iter(state.values())).device
+        self.buffers = torch.empty((1, self.nr_params), dtype=torch.float32, device=device)
+        self.refcount = np.zeros(1, dtype=np.int64)
+        self.free_slots = [0]
+
+        self.slots = np.full(num_users, self._allocate(), dtype=np.int64)
+        self.refcount[self.slots[0]] = num_users
+        self._write(self.slots[0], net)
+
+        self.tokens = ModelTokens(num_users)
+
+    def __len__(self):
+        return self.num_users
+
+    def __getitem__(self, user_idx):
+        return self.buffers[self.slots[user_idx]]
+
+    def _allocate(self):
+        """Returns a free row, doubling the buffer pool if none is left.
+
+        Rows are always released before new ones are allocated, so the pool never
+        needs more than num_users rows.
+        """
+        if len(self.free_slots) == 0:
+            capacity = len(self.buffers)
+            new_capacity = min(2 * capacity, self.num_users)
+            buffers = torch.empty((new_capacity, self.nr_params), dtype=self.buffers.dtype, device=self.buffers.device)
+            buffers[:capacity] = self.buffers
+            self.buffers = buffers
+            self.refcount = np.concatenate((self.refcount, np.zeros(new_capacity - capacity, dtype=np.int64)))
+            self.free_slots = list(range(new_capacity - 1, capacity - 1, -1))
+
+        return self.free_slots.pop()
+
+    def _release(self, slot):
+        self.refcount[slot] -= 1
+        if self.refcount[slot] == 0:
+            self.free_slots.append(slot)
+
+    @torch.no_grad()
+    def _write(self, slot, net: BaseNet):
+        row = self.buffers[slot]
+
+        offset = 0
+        for k, v in net.state_dict().items():
+            row[offset: offset + v.numel()] = v.reshape(-1)
+            offset += v.numel()
+
+    @torch.no_grad()
+    def load(self, user_idx, net: BaseNet = None):
+        """Copies the parameters of a client into net (the template by default)."""
+        net = self.net if net is None else net
+        state = net.state_dict()
+        row = self[user_idx]
+
+        offset = 0
+        for k, shape, numel in self.layout:
+            state[k].copy_(row[offset: offset + numel].view(shape))
+            offset += numel
+
+        return net
+
+    def store(self, user_idx, net: BaseNet = None):
+        """Copies the parameters of net (the template by default) into the row of a client."""
+        net = self.net if net is None else net
+        self._write(self._own(user_idx), net)
+        self.tokens.renew(user_idx)
+
+    @torch.no_grad()
+    def store_row(self, user_idx, row):
+        """Copies a flat [P] row into the row of a client."""
+        slot = self._own(user_idx)
+        self.buffers[slot] = row
+        self.tokens.renew(user_idx)
+
+    def _own(self, user_idx):
+        """Slot of a client that is not shared with any other client."""
+        # a shared row is copied on write
+        if self.refcount[self.slots[user_idx]] > 1:
+            self._release(self.slots[user_idx])
+            self.slots[user_idx] = self._allocate()
+            self.refcount[self.slots[user_idx]] = 1
+
+        return self.slots[user_idx]
+
+    def gather(self, users):
+        """Distinct parameter rows of users.
+
+        Returns:
+            params (torch.Tensor): [B, P] rows, a view if they are the whole pool
+            rows (ndarray): users[i] has the parameters params[rows[i]]
+        """
+        used, rows = np.unique(self.slots[np.asarray(users)], return_inverse=True)
+        if len(used) == len(self.buffers):
+            return self.buffers, rows
+
+        return self.buffers[used], rows
+
+    def dense(self):
+        """[num_users, P] copy with one row per client."""
+        return self.buffers[self.slots]
+
+    @torch.no_grad()
+    def assign(self, users, averaged, inverse):
+        """Makes users[i] share the row averaged[inverse[i]] with the other members of its class."""
+        users = np.asarray(users)
+        for class_idx in range(len(averaged)):
+            members = users[inverse == class_idx]
+            if len(members) == 0:
+                continue
+
+            for slot in self.slots[members]:
+                self._release(slot)
+
+            slot = self._allocate()
+            self.buffers[slot] = averaged[class_idx]
+            self.slots[members] = slot
+            self.refcount[slot] = len(members)
+            self.tokens.renew(members)
+
+        if np.count_nonzero(self.refcount) <= len(self.buffers) // 4:
+            self._compact()
+
+    def _compact(self):
+        """Moves the rows in use to the front of a pool of (at most) twice their number."""
+        used = np.flatnonzero(self.refcount)
+        new_slot = np.zeros(len(self.buffers), dtype=np.int64)
+        new_slot[used] = np.arange(len(used))
+
+        capacity = min(2 * len(used), self.num_users)
+        buffers = torch.empty((capacity, self.nr_params), dtype=self.buffers.dtype, device=self.buffers.device)
+        buffers[:len(used)] = self.buffers[used]
+
+        self.buffers = buffers
+        self.slots = new_slot[self.slots]
+        self.refcount = np.concatenate((self.refcount[used], np.zeros(capacity - len(used), dtype=np.int64)))
+        self.free_slots = list(range(capacity - 1, len(used) - 1, -1))
+
+    def memory_report(self):
+        """Number of distinct rows in use and their size."""
+        unique_buffers = int(np.count_nonzero(self.refcount))
+        row_bytes = self.nr_params * self.buffers.element_size()
+
+        return {
+            'num_users': self.num_users,
+            'unique_buffers': unique_buffers,
+            'capacity': len(self.buffers),
+            'resident_mb': len(self.buffers) * row_bytes / 2**20,
+            'dense_mb': self.num_users * row_bytes / 2**20,
+        }
+
+class MemmapRows:
+    """Rows of a memory-mapped store, read in blocks of consecutive rows."""
+
+    def __init__(self, store, users):
+
+        self.store = store
+        self.users = np.asarray(users)
+
+    def __len__(self):
+        return len(self.users)
+
+    @property
+    def shape(self):
+        return (len(self.users), self.store.nr_params)
+
+    def columns(self, start, stop):
+        """[len(users), stop - start] tensor of the columns start:stop of the rows of users."""
+        return self.store._read(self.users, start, stop)
+
+class MemmapModelStore:
+    """Client models as rows of a memory-mapped [num_users, P] float32 file.
+
+    Same interface as ClientModelStore. Only the rows that are loaded or stored are
+    paged in, and every access maps the file anew, so rows do not stay resident.
+    """
+
+    def __init__(self, net: BaseNet, num_users: int, path: Path):
+
+        self.net = net
+        self.num_users = num_users
+        self.path = Path(path)
+
+        state = net.state_dict()
+        self.layout = [(k, v.shape, v.numel()) for k, v in state.items()]
+        self.nr_params = sum(numel for _, _, numel in self.layout)
+        self.device = next(iter(state.values())).device
+
+        Path.mkdir(self.path.parent, exist_ok=True, parents=True)
+        params = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.float32, shape=(num_users, self.nr_params))
+        self.offset = params.offset
+        del params
+
+        # all clients start from the same weights
+        row = self._flatten(net).cpu().numpy()
+        block_rows = max(1, MEMMAP_BLOCK_NUMEL // self.nr_params)
+        for start in range(0, num_users, block_rows):
+            stop = min(start + block_rows, num_users)
+            rows = self._map(start, stop)
+            rows[:] = row
+            rows.flush()
+            del rows
+
+        self.tokens = ModelTokens(num_users)
+
+    def __len__(self):
+        return self.num_users
+
+    def __getitem__(self, user_idx):
+        return self._read(np.array([user_idx]))[0]
+
+    def _map(self, start, stop):
+        return np.memmap(self.path, dtype=np.float32, mode='r+', 
+                         offset=self.offset + start * self.nr_params * 4, shape=(stop - start, self.nr_params))
+
+    def _read(self, users, column_start=0, column_stop=None):
+        """Copies the rows of users, or their columns column_start:column_stop, into a tensor on the device of the template."""
+        users = np.asarray(users)
+        start, stop = users.min(), users.max() + 1
+        rows = self._map(start, stop)
+        block = torch.from_numpy(np.array(rows[users - start, column_start: column_stop]))
+        del rows
+
+        return block.to(self.device)
+
+    def _flatten(self, net: BaseNet):
+        return torch.cat([v.detach().reshape(-1).float() for v in net.state_dict().values()])
+
+    @torch.no_grad()
+    def load(self, user_idx, net: BaseNet = None):
+        """Copies the parameters of a client into net (the template by default)."""
+        net = self.net if net is None else net
+        state = net.state_dict()
+        row = self[user_idx]
+
+        offset = 0
+        for k, shape, numel in self.layout:
+            state[k].copy_(row[offset: offset + numel].view(shape))
+            offset += numel
+
+        return net
+
+    @torch.no_grad()
+    def store(self, user_idx, net: BaseNet = None):
+        """Copies the parameters of net (the template by default) into the row of a client."""
+        net = self.net if net is None else net
+
+        self.store_row(user_idx, self._flatten(net))
+
+    @torch.no_grad()
+    def store_row(self, user_idx, row):
+        """Copies a flat [P] row into the row of a client."""
+        # no flush: later maps of the file share the dirty pages of the page cache
+        rows = self._map(user_idx, user_idx + 1)
+        rows[0] = row.cpu().numpy()
+        del rows
+
+        self.tokens.renew(user_idx)
+
+    def gather(self, users):
+        """Rows of users, read lazily in blocks by the FedAvg engines."""
+        return MemmapRows(self, users), None
+
+    def dense(self):
+        """[num_users, P] copy with one row per client."""
+        return self._read(np.arange(self.num_users))
+
+    @torch.no_grad()
+    def assign(self, users, averaged, inverse):
+        """Writes averaged[inverse[i]] into the row of users[i].
+
+        A ColumnChunkAverage is written chunk by chunk as it is computed, the
+        [M, P] average is never held in memory.
+        """
+        users = np.asarray(users)
+        if isinstance(averaged, ColumnChunkAverage):
+            self._assign_column_chunks(users, averaged, inverse)
+        else:
+            self._assign_rows(users, averaged.cpu().numpy(), inverse)
+
+        for class_idx in np.unique(inverse):
+            self.tokens.renew(users[inverse == class_idx])
+
+    def _assign_column_chunks(self, users, averaged, inverse):
+        # the chunk of columns of the average is complete before its columns are overwritten
+        first, last = users.min(), users.max() + 1
+        for start, stop, columns in averaged.column_chunks():
+            rows = self._map(first, last)
+            rows[users - first, start: stop] = columns.cpu().numpy()[inverse]
+            rows.flush()
+            del rows
+
+    def _assign_rows(self, users, averaged, inverse):
+
+        order = np.argsort(users)
+        block_rows = max(1, MEMMAP_BLOCK_NUMEL // self.nr_params)
+        for start in range(0, len(order), block_rows):
+            block = order[start: start + block_rows]
+            first, last = users[block].min(), users[block].max() + 1
+            rows = self._map(first, last)
+            rows[users[block] - first] = averaged[inverse[block]]
+            rows.flush()
+            del rows
+
+    def memory_report(self):
+        """The rows live on disk, none of them is kept in memory."""
+        row_bytes = self.nr_params * 4
+
+        return {
+            'num_users': self.num_users,
+            'unique_buffers': self.num_users,
+            'capacity': self.num_users,
+            'resident_mb': 0.0,
+            'dense_mb': self.num_users * row_bytes / 2**20,
+        }
+
+class ModelStoreSnapshot:
+    """Read-only copy of the models of some clients of a store.
+
+    Clients with the same content token share one copied row, so a snapshot after
+    FedAvg holds about one row per cluster. It has the load/__getitem__/tokens
+    interface of the stores the evaluation reads from, and its own template
+    module, so it can be evaluated while the store keeps training.
+
+    Arguments:
+        store: ClientModelStore or MemmapModelStore to copy from
+        users (list): clients to copy
+        net (BaseNet): template module of the snapshot, the one of the store by default
+    """
+
+    def __init__(self, store, users, net: BaseNet = None):
+
+        self.net = store.net if net is None else net
+        self.layout = store.layout
+        self.nr_params = store.nr_params
+
+        users = np.asarray(users)
+        tokens = np.asarray(store.tokens[users])
+        _, first, inverse = np.unique(tokens, return_index=True, return_inverse=True)
+
+        with torch.no_grad():
+            self.rows = torch.stack([store[idx] for idx in users[first]])
+
+        self.slots = dict(zip(users.tolist(), inverse.tolist()))
+        self.tokens = dict(zip(users.tolist(), tokens.tolist()))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __getitem__(self, user_idx):
+        return self.rows[self.slots[int(user_idx)]]
+
+    @torch.no_grad()
+    def load(self, user_idx, net: BaseNet = None):
+        """Copies the parameters of a client into net (the template by default)."""
+        net = self.net if net is None else net
+        state = net.state_dict()
+        row = self[user_idx]
+
+        offset = 0
+        for k, shape, numel in self.layout:
+            state[k].copy_(row[offset: offset + numel].view(shape))
+            offset += numel
+
+        return net
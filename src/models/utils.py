@@ -7,6 +7,7 @@
 # ---------------------------------------------------------------------------
 
 import torch
+import hashlib
 
 from pathlib import Path
 from .basenet import BaseNet
@@ -19,4 +20,13 @@ def load_model(model: BaseNet, path: Path):
 
     model.load_state_dict(torch.load(path, map_location=torch.device('cpu')))
 
-    return model
\ No newline at end of file
+    return model
+
+def state_fingerprint(model: BaseNet, digest_size: int = 16):
+    """Hex digest of the names, shapes and values of the state dict of model."""
+    digest = hashlib.blake2b(digest_size=digest_size)
+    for k, v in model.state_dict().items():
+        digest.update(f'{k}:{tuple(v.shape)}:{v.dtype}'.encode())
+        digest.update(v.detach().cpu().contiguous().numpy().tobytes())
+
+    return digest.hexdigest()
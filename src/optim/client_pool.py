@@ -0,0 +1,99 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the process pool for parallel local training of the clients.
+# ---------------------------------------------------------------------------
+
+import os
+import torch
+import logging
+import numpy as np
+import torch.multiprocessing as mp
+
+from comm.fedavg import load_flat_state
+
+logger = logging.getLogger(__name__)
+
+# (flt, staging) inherited by the forked workers
+_worker_state = None
+
+def _init_worker(num_threads):
+    # the workers share the cores, one intra-op pool per worker would oversubscribe them
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+
+def _train_client(task):
+    position, user_idx, seed = task
+    flt, staging = _worker_state
+
+    # the seed of a task does not depend on the worker that runs it
+    torch.manual_seed(seed)
+    np.random.seed(seed % 2**32)
+
+    net = flt.model_store.net
+    load_flat_state(net, staging[position], flt.model_store.layout)
+    loss, train_stats = flt.local_train(net, user_idx)
+
+    with torch.no_grad():
+        staging[position] = torch.cat([v.reshape(-1) for v in net.state_dict().values()])
+
+    return loss, train_stats
+
+def task_seed(seed, round, user_idx):
+    """Seed of the local training of a client in a round, seed is a non-negative integer."""
+    return int(np.random.SeedSequence([seed, round, user_idx]).generate_state(1)[0])
+
+class ClientProcessPool:
+    """Forked worker processes that train the sampled clients in parallel.
+
+    The workers are forked after the training dataset is loaded, so they read it
+    from the memory of the parent. The weights of the clients of a round are
+    exchanged through one [max_clients, P] staging tensor in shared memory; a task
+    is only (position, user_idx, seed). The pool has to be restarted when the
+    dataset of the parent changes.
+
+    Arguments:
+        flt (FLT): trainer the workers train with
+        num_workers (int): number of worker processes
+        max_clients (int): maximum number of clients of a round
+        seed (int): non-negative base of the task seeds
+    """
+
+    def __init__(self, flt, num_workers: int, max_clients: int, seed: int):
+
+        global _worker_state
+
+        self.flt = flt
+        self.seed = seed
+        self.num_workers = num_workers
+        self.staging = torch.empty((max_clients, flt.model_store.nr_params), dtype=torch.float32).share_memory_()
+
+        _worker_state = (flt, self.staging)
+
+        num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+        self.pool = mp.get_context('fork').Pool(num_workers, initializer=_init_worker, initargs=(num_threads,))
+        logger.info(f'Started {num_workers} client workers with {num_threads} threads each.')
+
+    def train(self, user_idxs, round: int):
+        """Trains user_idxs in the workers and writes them back to the model store.
+
+        Returns:
+            results (list): (loss, train_stats) of local_train for every client
+        """
+        model_store = self.flt.model_store
+        for position, idx in enumerate(user_idxs):
+            self.staging[position] = model_store[idx]
+
+        tasks = [(position, idx, task_seed(self.seed, round, idx)) for position, idx in enumerate(user_idxs)]
+        results = self.pool.map(_train_client, tasks, chunksize=1)
+
+        for position, idx in enumerate(user_idxs):
+            model_store.store_row(idx, self.staging[position])
+
+        return results
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
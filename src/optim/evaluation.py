@@ -0,0 +1,271 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the evaluation of the client models.
+# ---------------------------------------------------------------------------
+
+import math
+import queue
+import torch
+import threading
+import numpy as np
+import torch.nn.functional as F
+
+from torch.func import functional_call, vmap
+from models.basenet import BaseNet
+from datasets.client_data import ClientData
+from optim.vmap_update import split_rows
+
+@torch.inference_mode()
+def evaluate_client(net: BaseNet, client_data: ClientData, user_idx, batch_size: int):
+    """Accuracy and average cross-entropy of net on all samples of a client.
+
+    Runs in inference mode on large unshuffled batches of the packed client data;
+    net is used as it is, so the caller puts it in eval mode.
+
+    Returns:
+        accuracy (float): percentage of correctly classified samples
+        test_loss (float): cross-entropy averaged over the samples
+        correct (int): number of correctly classified samples
+    """
+    test_loss = torch.zeros((), dtype=torch.float64, device=client_data.labels.device)
+    correct = torch.zeros((), dtype=torch.int64, device=client_data.labels.device)
+
+    for images, labels in client_data.batches(user_idx, batch_size):
+        log_probs = net(images)
+        # sum up batch loss
+        test_loss += F.cross_entropy(log_probs, labels, reduction='sum')
+        # get the index of the max log-probability
+        correct += (log_probs.argmax(dim=1) == labels).sum()
+
+    num_samples = client_data.num_samples(user_idx)
+    correct = int(correct.item())
+
+    return 100.00 * correct / num_samples, test_loss.item() / num_samples, correct
+
+def stratified_sample(users, strata, fraction, rng):
+    """Stratified random subset of users with a fraction of every stratum.
+
+    Strata too small to contribute a user at this fraction are pooled into one
+    stratum, so a clustering with singleton classes is sampled at random.
+
+    Arguments:
+        users (ndarray): users to sample from
+        strata (ndarray): stratum of every user
+        fraction (float): fraction of the users to sample
+        rng (np.random.Generator): random generator of the sample
+
+    Returns:
+        sampled (ndarray): sorted sampled users
+        strata (ndarray): stratum of every user, with the small ones pooled as -1
+    """
+    labels, sizes = np.unique(strata, return_counts=True)
+    strata = np.where(np.isin(strata, labels[sizes * fraction < 1]), -1, strata)
+
+    sampled = []
+    for stratum in np.unique(strata):
+        members = users[strata == stratum]
+        sampled.append(rng.choice(members, max(1, int(round(fraction * len(members)))), replace=False))
+
+    return np.sort(np.concatenate(sampled)), strata
+
+def stratified_estimate(values, weights, strata, stratum_sizes, z=1.96, within_variances=None):
+    """Stratified ratio estimate of sum(values) / sum(weights) over a population.
+
+    The variance is linearized around the ratio. A stratum with a single sampled
+    user has no variance of its own and takes the variance of all sampled users,
+    which includes the spread between strata and errs on the wide side. With
+    within_variances the values are themselves estimates, e.g. accuracies on a
+    subsample of the test data of every user, and the second stage variance of
+    the two-stage sample is added.
+
+    Arguments:
+        values (ndarray): value of every sampled user
+        weights (ndarray): weight of every sampled user, ones for a plain mean
+        strata (ndarray): stratum of every sampled user
+        stratum_sizes (dict): number of users of every stratum in the population
+        z (float): quantile of the normal distribution of the interval
+        within_variances (ndarray): variance of the value of every sampled user, None if exact
+
+    Returns:
+        estimate (float): estimated ratio
+        half_width (float): half width of the confidence interval, nan if a single user is sampled from a larger population
+    """
+    population = sum(stratum_sizes.values())
+
+    total_values, total_weights = 0.0, 0.0
+    for stratum, size in stratum_sizes.items():
+        in_stratum = strata == stratum
+        total_values += size * values[in_stratum].mean()
+        total_weights += size * weights[in_stratum].mean()
+    estimate = total_values / total_weights
+    mean_weight = total_weights / population
+
+    residuals = (values - estimate * weights) / mean_weight
+    pooled_variance = residuals.var(ddof=1) if len(residuals) > 1 else np.nan
+
+    variance = 0.0
+    for stratum, size in stratum_sizes.items():
+        in_stratum = strata == stratum
+        n = np.count_nonzero(in_stratum)
+        if n < size:
+            stratum_variance = residuals[in_stratum].var(ddof=1) if n > 1 else pooled_variance
+            variance += (size / population) ** 2 * (1 - n / size) * stratum_variance / n
+        if within_variances is not None:
+            variance += (size / population) ** 2 * within_variances[in_stratum].sum() / mean_weight ** 2 / (n * size)
+
+    return estimate, z * math.sqrt(variance)
+
+def subsample_accuracy_variance(accuracy, num_samples, population):
+    """Variance of an accuracy in percent measured on num_samples of the population samples of a user, drawn without replacement."""
+    accuracy, num_samples, population = np.asarray(accuracy), np.asarray(num_samples), np.asarray(population)
+    correction = np.where(population > 1, (population - num_samples) / np.maximum(population - 1, 1), 0.0)
+
+    return accuracy * (100 - accuracy) / num_samples * correction
+
+class EvaluationCache:
+    """Results of evaluate_client memoized by model and data.
+
+    The key of a client is the content token of its model in the model store and
+    the fingerprint of its samples, so each distinct (model, data) pair is scored
+    once and shared by all clients that have it. Pairs that did not change since
+    the previous reporting round are reused; begin_round() drops the ones that
+    were not requested in the previous round.
+    """
+
+    def __init__(self):
+
+        self.results = {}
+        self.requested = set()
+
+    def begin_round(self):
+        self.results = {key: self.results[key] for key in self.requested if key in self.results}
+        self.requested = set()
+
+    def key(self, model_store, client_data: ClientData, user_idx):
+        return int(model_store.tokens[user_idx]), client_data.fingerprint(user_idx)
+
+    def __contains__(self, key):
+        self.requested.add(key)
+        return key in self.results
+
+    def __getitem__(self, key):
+        return self.results[key]
+
+    def __setitem__(self, key, result):
+        self.results[key] = result
+
+class VmapEvaluator:
+    """evaluate_client for a group of client models in one pass.
+
+    The flat parameters of the G models are stacked and every step scores one
+    [G, batch_size] block of samples, the next batch of every client, with a
+    vmapped functional_call. Clients with fewer samples are padded and masked.
+    """
+
+    def __init__(self, net: BaseNet):
+
+        self.net = net
+        self.layout = [(k, v.shape, v.numel()) for k, v in net.state_dict().items()]
+        self.param_names = set(k for k, _ in net.named_parameters())
+
+        def compute_scores(params, buffers, images, labels, mask):
+            log_probs = functional_call(self.net, (params, buffers), (images,))
+            losses = F.cross_entropy(log_probs, labels, reduction='none')
+            correct = (log_probs.argmax(dim=1) == labels).float()
+            return (losses * mask).sum(), (correct * mask).sum()
+
+        self.scores_fn = vmap(compute_scores)
+
+    @torch.inference_mode()
+    def __call__(self, rows, client_data: ClientData, user_idxs, batch_size: int):
+        """Accuracy and average cross-entropy of the models rows on the samples of user_idxs.
+
+        Arguments:
+            rows (torch.Tensor): [G, P] flat parameters, row i is the model of user_idxs[i]
+            client_data (ClientData): packed samples of the clients
+            user_idxs (list): clients whose samples are scored
+            batch_size (int): samples per client and step
+
+        Returns:
+            results (list): (accuracy, test_loss) of every client
+        """
+        device = client_data.labels.device
+        params, buffers = split_rows(rows.to(device), self.layout, self.param_names)
+
+        lengths = [client_data.num_samples(idx) for idx in user_idxs]
+        nr_steps = math.ceil(max(lengths) / batch_size)
+
+        # padded positions point to the first sample and are masked out
+        positions = torch.zeros((len(user_idxs), nr_steps * batch_size), dtype=torch.long, device=device)
+        mask = torch.zeros((len(user_idxs), nr_steps * batch_size), device=device)
+        for i, idx in enumerate(user_idxs):
+            positions[i, :lengths[i]] = client_data.positions[idx]
+            mask[i, :lengths[i]] = 1
+
+        self.net.eval()
+
+        test_loss = torch.zeros(len(user_idxs), dtype=torch.float64, device=device)
+        correct = torch.zeros(len(user_idxs), dtype=torch.float64, device=device)
+        for start in range(0, nr_steps * batch_size, batch_size):
+            batch = positions[:, start: start + batch_size]
+            batch_loss, batch_correct = self.scores_fn(params, buffers, client_data.images[batch], 
+                                                       client_data.labels[batch], mask[:, start: start + batch_size])
+            test_loss += batch_loss
+            correct += batch_correct
+
+        correct = correct.round().long().tolist()
+        test_loss = test_loss.tolist()
+
+        return [(100.00 * correct[i] / lengths[i], test_loss[i] / lengths[i]) for i in range(len(user_idxs))]
+
+class BackgroundEvaluator:
+    """Runs evaluation jobs in one worker thread, in the order they are submitted.
+
+    Jobs are callables that evaluate a snapshot of the models and write their
+    results; one worker keeps the rows of the result files in round order. At most
+    max_pending jobs wait in the queue, submit() blocks beyond that so snapshots
+    do not pile up when evaluation is slower than training. An exception of a job
+    stops the following ones and is raised by the next submit(), drain() or close().
+    """
+
+    def __init__(self, max_pending: int = 2):
+
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.error = None
+
+        self.thread = threading.Thread(target=self._run, name='evaluation', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                if self.error is None:
+                    job()
+            except BaseException as error:
+                self.error = error
+            finally:
+                self.jobs.task_done()
+
+    def _raise(self):
+        if self.error is not None:
+            raise RuntimeError('Background evaluation failed.') from self.error
+
+    def submit(self, job):
+        self._raise()
+        self.jobs.put(job)
+
+    def drain(self):
+        """Waits until all submitted jobs are done."""
+        self.jobs.join()
+        self._raise()
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+        self._raise()
@@ -3,29 +3,37 @@
 # Created Date: 23-Nov-2020
 # 
 # Refactored By: Sayak Mukherjee
-# Last Update: 30-Nov-2023
+# Last Update: 18-Oct-2026
 # ---------------------------------------------------------------------------
 # File contains the code for FLT.
 # ---------------------------------------------------------------------------
 
 import torch
 import copy
+import functools
 import logging
 import numpy as np
-import torch.nn.functional as F
 
 from omegaconf import DictConfig
 from datasets.load_dataset import load_dataset
-from datasets.utils import DatasetSplit
-from torch.utils.data import DataLoader
-from comm.fedavg import FedAvg
+from datasets.client_data import ClientData
+from comm import get_aggregator
+from comm.fedavg import StreamingFedAvg, neighbourhood_classes
 from datasets import sampling
 from pathlib import Path
 from models.nets import CNNCifar, CNNLeaf, CNNMnist, MLP
-from utils.cluster import extract_clustering, partition_clusters, clustering_multi_center, filter_cluster_partition
+from models.store import ClientModelStore, MemmapModelStore, ModelStoreSnapshot
+from optim.vmap_update import VmapLocalUpdate
+from optim.client_pool import ClientProcessPool
+from optim.evaluation import BackgroundEvaluator, EvaluationCache, VmapEvaluator, evaluate_client, stratified_sample, stratified_estimate, \
+    subsample_accuracy_variance
+from utils.cluster import extract_clustering, partition_clusters, clustering_multi_center, filter_cluster_partition, knn_affinity_matrix
 
 logger = logging.getLogger(__name__)
 
+# streaming engines, and the engine with the same semantics for the rounds that cannot be streamed
+STREAMING_ENGINES = {'streaming': 'matrix_sequential', 'streaming_matrix': 'matrix'}
+
 class FLT:
 
     def __init__(self, config: DictConfig, device) -> None:
@@ -35,7 +43,66 @@ class FLT:
         self.logger = logging.getLogger(self.__class__.__name__)
 
         self.trainset, self.testset, self.dict_train_users, self.dict_test_users, self.cluster = self.init_dataset()
-        self.net_list = self.gen_model()
+        self.train_data, self.test_data = self.init_client_data()
+        self.model_store = self.gen_model()
+
+        # seed of the evaluation subsamples of the clients, None draws them at random for the randomised seed -1
+        self.eval_seed = None if self.config.project.seed == -1 else self.config.project.seed
+
+        # training accuracy: full (evaluate the training data), last_epoch (collected during local training) or subsample
+        self.train_accuracy = self.config.federated.get('train_accuracy', 'full')
+        self.train_eval_data = self.gen_train_eval_data()
+        self.last_epoch_stats = {}
+
+        self.aggregation = self.config.federated.get('aggregation', 'matrix_sequential')
+        # a sparse signature graph is averaged over its edges by the sparse engines
+        if self.config.federated.get('signature_graph', 'dense') != 'dense' and self.aggregation not in ('graph', 'topk'):
+            raise ValueError(f'A sparse signature graph needs aggregation graph or topk, not {self.aggregation}.')
+        self.streaming_aggregation = self.aggregation in STREAMING_ENGINES
+        self.aggregator = get_aggregator(STREAMING_ENGINES.get(self.aggregation, self.aggregation))
+
+        # number of clients trained together with torch.func.vmap, 0 trains them one by one
+        self.vmap_clients = self.config.trainer.get('vmap_clients', 0)
+        if self.vmap_clients > 0:
+            self.vmap_update = VmapLocalUpdate(self.model_store.net, 
+                                               self.config.model.lr, 
+                                               self.config.model.momentum, 
+                                               self.config.dataset.train_batch_size, 
+                                               self.config.trainer.local_ep)
+
+        # evaluation results of the distinct (model, data) pairs
+        self.evaluation_cache = EvaluationCache()
+
+        # intermediate reporting rounds evaluate a stratified sample of the users, every full_eval_period-th and the last one all users
+        self.eval_users_fraction = self.config.federated.get('eval_users_fraction', 1.0)
+        self.full_eval_period = self.config.federated.get('full_eval_period', 1)
+        self.test_eval_data = self.gen_test_eval_data()
+        self.sampled_evaluation = self.eval_users_fraction < 1 or self.test_eval_data is not self.test_data
+        self.eval_rng = np.random.default_rng(self.eval_seed) if self.sampled_evaluation else None
+        # users with the same neighbourhood in the clustering form a stratum
+        self.eval_strata = np.zeros(self.config.federated.num_users, dtype=np.int64)
+
+        # evaluation of snapshots of the models in a background thread, overlapped with the next rounds
+        self.async_evaluation = self.config.trainer.get('async_evaluation', False)
+        # the background evaluation has its own template module, the training one keeps changing
+        self.eval_net = copy.deepcopy(self.model_store.net) if self.async_evaluation else self.model_store.net
+
+        # number of client models evaluated together with torch.func.vmap, 0 evaluates them one by one
+        self.eval_vmap_clients = self.config.trainer.get('eval_vmap_clients', 0)
+        if self.eval_vmap_clients > 0:
+            self.vmap_evaluator = VmapEvaluator(self.eval_net)
+
+        # base of the seeds of the client workers, seed -1 keeps the run randomised with one entropy value for the whole run
+        self.client_seed = self.config.project.seed
+        if self.client_seed == -1:
+            self.client_seed = np.random.SeedSequence().entropy
+        # worker processes for the local training, forked after the dataset is loaded
+        self.client_pool = self.start_client_pool()
+
+        # started after the client workers are forked
+        self.background_evaluator = None
+        if self.async_evaluation:
+            self.background_evaluator = BackgroundEvaluator(self.config.trainer.get('max_pending_evaluations', 2))
 
         self.fedMLAlgo()
         
@@ -107,6 +174,33 @@ class FLT:
 
         return dataset_train, dataset_test, dict_train_users, dict_test_users, cluster
 
+    def init_client_data(self):
+
+        # every sample is transformed once, the clients draw their batches from packed tensors
+        train_data = ClientData(self.trainset, self.dict_train_users, self.device)
+        test_data = ClientData(self.testset, self.dict_test_users, self.device)
+
+        logger.info(f'Client data packed: {len(train_data.labels)} train and {len(test_data.labels)} test samples.')
+
+        return train_data, test_data
+
+    def gen_train_eval_data(self):
+
+        # a fixed subsample of every client for the post-aggregation training accuracy
+        if self.train_accuracy == 'subsample':
+            return self.train_data.subsample(self.config.federated.get('train_accuracy_samples', 100), seed=self.eval_seed)
+
+        return self.train_data
+
+    def gen_test_eval_data(self):
+
+        # a fixed subsample of every client for the test accuracy of the sampled evaluation rounds
+        eval_test_samples = self.config.federated.get('eval_test_samples', 0)
+        if eval_test_samples > 0:
+            return self.test_data.subsample(eval_test_samples, seed=self.eval_seed)
+
+        return self.test_data
+
     def gen_cluster(self):
 
         # setting the clustering format
@@ -219,7 +313,7 @@ class FLT:
 
     def gen_model(self):
 
-        img_size = self.trainset[0][0].shape
+        img_size = self.train_data.sample_shape
 
         # build model
         if self.config.model.name == 'cnn' and (self.config.dataset.name.lower() in ['cifar10', 'cinic10']):
@@ -238,18 +332,50 @@ class FLT:
 
         net.train()
 
-        # copy weights
-        net_list = np.array([copy.deepcopy(net) for i in range(self.config.federated.num_users)])
+        # all clients start from the same weights, kept in one flat [num_users, P] store
+        if self.config.federated.get('model_store', 'memory') == 'memmap':
+            store_path = Path(self.config.project.path + '/scenario' + str(self.config.federated.scenario))\
+                .joinpath(self.config.project.experiment_name).joinpath('client_models.npy')
+            model_store = MemmapModelStore(net, self.config.federated.num_users, store_path)
+            logger.info(f'Client models memory-mapped to {store_path}.')
+        else:
+            model_store = ClientModelStore(net, self.config.federated.num_users)
+
+        return model_store
+
+    def gen_aggregation_matrix(self, clustering_matrix, clustering_matrix_soft):
 
-        return net_list
+        if self.config.federated.get('aggregation', 'matrix_sequential') != 'topk':
+            return clustering_matrix
+
+        if clustering_matrix_soft is None:
+            logger.info(f'{self.config.federated.clustering_method} clustering has no signature distances, aggregating over the clustering matrix.')
+            return clustering_matrix
+
+        # graded task-relatedness over the k nearest clients instead of the thresholded matrix
+        return knn_affinity_matrix(clustering_matrix_soft, 
+                                   self.config.federated.get('topk_neighbours', 5), 
+                                   self.config.federated.get('topk_bandwidth', 1.0))
 
     def localUpdate(self, user_idx):
 
-        ldr_train = DataLoader(DatasetSplit(self.trainset, self.dict_train_users[user_idx]), 
-                               batch_size=self.config.dataset.train_batch_size, 
-                               shuffle=True)
+        net = self.model_store.load(user_idx)
+        loss, train_stats = self.local_train(net, user_idx)
+        self.model_store.store(user_idx, net)
+
+        return loss, train_stats
+
+    def local_train(self, net, user_idx):
+        """Local SGD of a client.
+
+        Returns:
+            loss (float): training loss averaged over the batches and epochs
+            train_stats (tuple): (accuracy, loss) over the samples of the last epoch
+        """
+
+        num_samples = self.train_data.num_samples(user_idx)
+        num_batches = -(-num_samples // self.config.dataset.train_batch_size)
         
-        net = copy.deepcopy(self.net_list[user_idx])
         net.train()
 
         optimizer = torch.optim.SGD(net.parameters(), 
@@ -262,8 +388,11 @@ class FLT:
         epoch_loss = []
         for iter in range(self.config.trainer.local_ep):
             batch_loss = []
-            for batch_idx, (images, labels) in enumerate(ldr_train):
-                images, labels = images.to(self.device), labels.to(self.device)
+            correct = torch.zeros((), dtype=torch.int64, device=self.device)
+            sample_loss = 0
+            for batch_idx, (images, labels) in enumerate(self.train_data.batches(user_idx, 
+                                                                                 self.config.dataset.train_batch_size, 
+                                                                                 shuffle=True)):
                 net.zero_grad()
                 log_probs = net(images)
                 loss = loss_func(log_probs, labels)
@@ -271,12 +400,75 @@ class FLT:
                 optimizer.step()
                 if self.config.project.verbose and batch_idx % 10 == 0:
                     logger.info('Update Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}'.format(
-                        iter, batch_idx * len(images), len(ldr_train.dataset),
-                               100. * batch_idx / len(ldr_train), loss.item()))
+                        iter, batch_idx * len(images), num_samples,
+                               100. * batch_idx / num_batches, loss.item()))
                 batch_loss.append(loss.item())
+                correct += (log_probs.detach().argmax(dim=1) == labels).sum()
+                sample_loss += loss.item() * len(labels)
             epoch_loss.append(sum(batch_loss)/len(batch_loss))
 
-        return net, sum(epoch_loss) / len(epoch_loss)
+        # statistics of the last epoch, of the models during training
+        train_stats = (100.00 * correct.item() / num_samples, sample_loss / num_samples)
+
+        return sum(epoch_loss) / len(epoch_loss), train_stats
+
+    def vmapLocalUpdate(self, user_idxs):
+
+        logger.info(f'Local training for users {list(user_idxs)}')
+
+        rows = torch.stack([self.model_store[idx] for idx in user_idxs]).to(self.device)
+        client_data = [self.train_data.client(idx) for idx in user_idxs]
+
+        rows, losses, train_stats = self.vmap_update(rows, client_data)
+
+        for i, idx in enumerate(user_idxs):
+            self.model_store.store_row(idx, rows[i])
+
+        return list(zip(losses, train_stats))
+
+    def start_client_pool(self):
+        """Worker processes for the local training, None to train in this process."""
+        num_workers = self.config.trainer.get('client_workers', 0)
+        if num_workers == 0:
+            return None
+
+        if self.vmap_clients > 0 or self.device != 'cpu':
+            logger.info('Client workers require cpu training without vmap_clients, training in the main process.')
+            return None
+
+        m = max(int(self.config.federated.frac *  self.config.federated.num_users), 1)
+        return ClientProcessPool(self, num_workers, m, self.client_seed)
+
+    def local_update_groups(self, idxs_users):
+        """Groups of clients trained together, one client per group without vmap."""
+        if self.client_pool is not None:
+            return [list(idxs_users)]
+
+        if self.vmap_clients == 0:
+            return [[idx] for idx in idxs_users]
+
+        # clients of similar size need little padding
+        idxs_users = sorted(idxs_users, key=lambda idx: len(self.dict_train_users[idx]))
+        return [idxs_users[start: start + self.vmap_clients] for start in range(0, len(idxs_users), self.vmap_clients)]
+
+    def aggregate(self, cluster_users, clustering_matrix):
+
+        # sample counts indexed like the rows of clustering_matrix
+        dict_users = [self.dict_train_users[idx] for idx in cluster_users]
+
+        if self.aggregation == 'loop':
+            # the loop engine averages model copies
+            net_cluster_list = [self.model_store.load(idx, copy.deepcopy(self.model_store.net)) for idx in cluster_users]
+            net_cluster_list = self.aggregator(net_cluster_list, clustering_matrix, dict_users)
+
+            for net, idx in zip(net_cluster_list, cluster_users):
+                self.model_store.store(idx, net)
+        else:
+            params, rows = self.model_store.gather(cluster_users)
+            averaged, inverse = self.aggregator(params, clustering_matrix, dict_users, rows=rows)
+            del params
+
+            self.model_store.assign(cluster_users, averaged, inverse)
 
     def fedMLAlgo(self):
 
@@ -288,7 +480,11 @@ class FLT:
 
         outputFile_log = open(export_path.joinpath('results_allmodels.csv'), 'w')
 
-        print('iteration,training_average_loss,training_accuracy,test_accuracy,training_variance,test_variance', file = outputFile)
+        # the training accuracy column is labeled with its mode unless the training data is fully evaluated
+        train_accuracy_column = 'training_accuracy' if self.train_accuracy == 'full' else 'training_accuracy_' + self.train_accuracy
+        print(f'iteration,training_average_loss,{train_accuracy_column},test_accuracy,training_variance,test_variance,' + 
+              'eval_users,training_accuracy_ci,test_accuracy_ci', file = outputFile)
+        logger.info(f'Training accuracy mode: {self.train_accuracy}')
     
         print('0, ', end = '', file = outputFile_log)
         evaluation_user_index_range = self.extract_evaluation_range()
@@ -298,8 +494,10 @@ class FLT:
             print('{:.2f}, '.format(idx), end = '', file = outputFile_log)
         print('', file = outputFile_log)
 
-        clustering_matrix = extract_clustering(self.config, self.dict_train_users, self.trainset, self.cluster, 
-                                               0, self.device)
+        clustering_matrix, clustering_matrix_soft = extract_clustering(self.config, self.train_data, self.cluster, 
+                                                                       0, self.device)
+        aggregation_matrix = self.gen_aggregation_matrix(clustering_matrix, clustering_matrix_soft)
+        self.eval_strata = neighbourhood_classes(clustering_matrix)[1]
 
         # training
         loss_train = []
@@ -313,128 +511,248 @@ class FLT:
 
         if self.config.federated.all_clients:
             logger.info("Aggregation over all clients")
-            net_local_list = self.net_list.tolist()
+
+        # streaming aggregation needs the clustering matrix before local training
+        streaming = self.streaming_aggregation and self.config.federated.all_clients and \
+            not self.config.federated.multi_center and not self.config.federated.partition_clusters_flag
+        if self.streaming_aggregation and not streaming:
+            logger.info(f'Streaming aggregation requires all_clients without multi_center and partition_clusters_flag, using {STREAMING_ENGINES[self.aggregation]} aggregation.')
+
+        # reporting rounds so far, full_eval_period counts these
+        nr_reports = 0
 
         for round in range(self.config.trainer.rounds):
 
             loss_locals = []
-
-            if not self.config.federated.all_clients:
-                net_local_list = []
+            # training statistics of the clients trained in this round
+            self.last_epoch_stats = {}
 
             m = max(int(self.config.federated.frac *  self.config.federated.num_users), 1)
             idxs_users = np.random.choice(range(self.config.federated.num_users), m, replace=False)
             logger.info(f"Local update started for {len(idxs_users)} users")
 
-            for idx in idxs_users:
-                
-                net, loss = self.localUpdate(user_idx=idx)
+            if streaming:
+                running_avg = StreamingFedAvg(clustering_matrix, self.dict_train_users, sequential=self.aggregation == 'streaming')
 
-                if self.config.federated.all_clients:
-                    net_local_list[idx] = copy.deepcopy(net)
+            for user_group in self.local_update_groups(idxs_users):
+
+                if self.client_pool is not None:
+                    results = self.client_pool.train(user_group, round)
+                elif self.vmap_clients > 0:
+                    results = self.vmapLocalUpdate(user_group)
                 else:
-                    net_local_list.append(copy.deepcopy(net))
+                    results = [self.localUpdate(user_idx=user_group[0])]
+
+                for idx, (loss, train_stats) in zip(user_group, results):
+                    if streaming:
+                        running_avg.fold(idx, self.model_store[idx])
 
-                loss_locals.append(copy.deepcopy(loss))
+                    loss_locals.append(loss)
+                    self.last_epoch_stats[idx] = train_stats
 
             logger.info(f"Local update finished for {len(idxs_users)} users")
 
-            net_local_list = np.array(net_local_list)
+            if streaming:
+                # clients that were not sampled contribute their current weights
+                for idx in np.setdiff1d(np.arange(self.config.federated.num_users), idxs_users):
+                    running_avg.fold(idx, self.model_store[idx])
+
+                self.model_store.assign(np.arange(self.config.federated.num_users), *running_avg.average())
+                del running_avg
 
             # update global weights
             if self.config.federated.multi_center:
-                clustering_matrix, est_multi_center = clustering_multi_center(self.config, net_local_list, multi_center_initialization_flag, est_multi_center, iter=round+1)
+                clustering_matrix, est_multi_center = clustering_multi_center(self.config, self.model_store.dense().cpu().numpy(), multi_center_initialization_flag, est_multi_center, iter=round+1)
+                aggregation_matrix = clustering_matrix
                 multi_center_initialization_flag = False
+                self.eval_strata = neighbourhood_classes(clustering_matrix)[1]
             
-            if self.config.federated.partition_clusters_flag:
+            if streaming:
+                cluster_partitions = {}
+            elif self.config.federated.partition_clusters_flag:
                 # cluster information
-                cluster_partitions = filter_cluster_partition(cluster_user_dict, net_local_list)
-            else:
+                cluster_partitions = filter_cluster_partition(cluster_user_dict)
+            elif self.config.federated.all_clients:
                 # 1 big cluster for all for compatibility
-                cluster_partitions = {1 : (net_local_list, clustering_matrix, np.arange(0,self.config.federated.num_users,1))}
+                cluster_partitions = {1 : (aggregation_matrix, np.arange(0,self.config.federated.num_users,1))}
+            else:
+                # aggregation over the sampled clients only
+                cluster_partitions = {1 : (aggregation_matrix[idxs_users][:, idxs_users], idxs_users)}
 
-            for cluster_idx, (net_cluster_list, filtered_clustering_matrix, cluster_users) in cluster_partitions.items():
-                logger.info(f'FedAvg over cluster {cluster_idx} with {len(net_cluster_list)} users')
-                net_cluster_list = FedAvg(net_cluster_list, filtered_clustering_matrix, self.dict_train_users)
+            for cluster_idx, (filtered_clustering_matrix, cluster_users) in cluster_partitions.items():
+                logger.info(f'FedAvg over cluster {cluster_idx} with {len(cluster_users)} users')
+                self.aggregate(cluster_users, filtered_clustering_matrix)
 
-                # copy weights to net_glob indexed globally, from averaged models, indexed locally
-                for local_idx, global_idx in enumerate(cluster_users):
-                    self.net_list[global_idx] = copy.deepcopy(net_cluster_list[local_idx])
+            report = self.model_store.memory_report()
+            logger.info(f"Model store: {report['unique_buffers']} unique buffers for {report['num_users']} users, " + 
+                        f"{report['resident_mb']:.1f}MB resident vs {report['dense_mb']:.1f}MB dense")
 
             # print loss
             loss_avg = sum(loss_locals) / len(loss_locals)
             logger.info(f'Round {round}, Average loss {loss_avg}')
-            if (round % self.config.project.iter_to_iter_results) == 0 or (round == self.config.federated.rounds - 1):
-                print(f'{round}, {loss_avg}, ', end = '', file = outputFile)
-                print(f'{round}, ', end = '', file = outputFile_log)
 
             loss_train.append(loss_avg)
 
             if self.config.federated.change_dataset_flag == True:
                 if round == (self.config.federated.change_dataset_epoch-1):
+                    # the pending evaluations read the old dataset, they finish before it is replaced
+                    if self.background_evaluator is not None:
+                        self.background_evaluator.drain()
+
                     self.config.federated.flag_with_overlap = True
 
                     self.trainset, self.testset, self.dict_train_users, self.dict_test_users, self.cluster = self.init_dataset()
+                    self.train_data, self.test_data = self.init_client_data()
+                    self.train_eval_data = self.gen_train_eval_data()
+                    self.test_eval_data = self.gen_test_eval_data()
+
+                    # the workers hold the old dataset
+                    if self.client_pool is not None:
+                        self.client_pool.close()
+                        self.client_pool = self.start_client_pool()
 
                     # clustering the clients
-                    clustering_matrix = extract_clustering(self.config, self.dict_train_users, self.trainset, self.cluster, round + 1, self.device)
+                    clustering_matrix, clustering_matrix_soft = extract_clustering(self.config, self.train_data, self.cluster, round + 1, self.device)
+                    aggregation_matrix = self.gen_aggregation_matrix(clustering_matrix, clustering_matrix_soft)
+                    self.eval_strata = neighbourhood_classes(clustering_matrix)[1]
 
             if (round % self.config.project.iter_to_iter_results) == 0 or (round == self.config.federated.rounds - 1):
                 print(f'iteration under process: {round}')
-                self.evaluate_performance(evaluation_user_index_range, outputFile, outputFile_log)
+                full_evaluation = not self.sampled_evaluation or (nr_reports % self.full_eval_period) == 0 or \
+                    round == self.config.trainer.rounds - 1
+                nr_reports += 1
+
+                if self.background_evaluator is None:
+                    self.write_results(round, loss_avg, evaluation_user_index_range, outputFile, outputFile_log, 
+                                       full=full_evaluation)
+                else:
+                    # the evaluation reads the models and round state as they are now
+                    snapshot = ModelStoreSnapshot(self.model_store, evaluation_user_index_range, self.eval_net)
+                    self.background_evaluator.submit(functools.partial(self.write_results, round, loss_avg, evaluation_user_index_range, 
+                                                                       outputFile, outputFile_log, model_store=snapshot, 
+                                                                       full=full_evaluation, last_epoch_stats=self.last_epoch_stats, 
+                                                                       eval_strata=self.eval_strata))
 
-    def localTest(self, user_idx, on_trainset=False):
+        if self.background_evaluator is not None:
+            self.background_evaluator.close()
 
-        if on_trainset:
-            data_loader = DataLoader(DatasetSplit(self.trainset, self.dict_train_users[user_idx]), 
-                                    batch_size=self.config.dataset.train_batch_size, 
-                                    shuffle=True)
-        else:
-            data_loader = DataLoader(DatasetSplit(self.testset, self.dict_test_users[user_idx]), 
-                                    batch_size=self.config.dataset.train_batch_size, 
-                                    shuffle=True)
+        if self.client_pool is not None:
+            self.client_pool.close()
+
+    def localTest(self, user_idx, on_trainset=False, net=None, client_data=None):
+
+        if client_data is None:
+            client_data = self.train_data if on_trainset else self.test_data
         
-        net = copy.deepcopy(self.net_list[user_idx])
+        # the caller may have loaded the client already
+        if net is None:
+            net = self.model_store.load(user_idx)
         net.eval()
 
-        test_loss = 0
-        correct = 0
-
-        l = len(data_loader)
-        for idx, (data, target) in enumerate(data_loader):
-            data, target = data.to(self.device), target.to(self.device) 
-            log_probs = net(data)
-            # sum up batch loss
-            test_loss += F.cross_entropy(log_probs, target, reduction='sum').item()
-            # get the index of the max log-probability
-            y_pred = log_probs.data.max(1, keepdim=True)[1]
-            correct += y_pred.eq(target.data.view_as(y_pred)).long().cpu().sum()
-
-        test_loss /= len(data_loader.dataset)
-        accuracy = 100.00 * correct / len(data_loader.dataset)
+        accuracy, test_loss, correct = evaluate_client(net, client_data, user_idx, self.config.dataset.eval_batch_size)
+
         if self.config.project.verbose:
             logger.info('\nTest set: Average loss: {:.4f} \nAccuracy: {}/{} ({:.2f}%)\n'.format(
-                test_loss, correct, len(data_loader.dataset), accuracy))
+                test_loss, correct, client_data.num_samples(user_idx), accuracy))
         return accuracy, test_loss
 
-    def evaluate_performance(self, evaluation_user_index_range, outputFile, outputFile_log):
-
-        # evaluate the performance of the models on train and test datasets
-        acc_train_final = np.zeros(self.config.federated.num_users)
-        loss_train_final = np.zeros(self.config.federated.num_users)
-        acc_test_final = np.zeros(self.config.federated.num_users)
-        loss_test_final = np.zeros(self.config.federated.num_users)
+    def evaluate_missing(self, requests, model_store):
+        """Scores the requested (model, data) pairs that are not in the evaluation cache.
+
+        Arguments:
+            requests (list): (on_trainset, client_data, users) to evaluate the models of users on client_data
+            model_store: store the models are loaded from
+
+        Returns:
+            nr_scored (int): number of distinct pairs that were scored
+        """
+        nr_scored = 0
+        for on_trainset, client_data, users in requests:
+            missing = {}
+            for idx in users:
+                key = self.evaluation_cache.key(model_store, client_data, idx)
+                if key not in self.evaluation_cache and key not in missing:
+                    missing[key] = idx
+            nr_scored += len(missing)
+
+            if self.eval_vmap_clients == 0:
+                for key, idx in missing.items():
+                    self.evaluation_cache[key] = self.localTest(idx, on_trainset=on_trainset, net=model_store.load(idx), client_data=client_data)
+                continue
+
+            # clients of similar size need little padding
+            keys = sorted(missing, key=lambda key: client_data.num_samples(missing[key]))
+            for start in range(0, len(keys), self.eval_vmap_clients):
+                group_keys = keys[start: start + self.eval_vmap_clients]
+                user_idxs = [missing[key] for key in group_keys]
+                rows = torch.stack([model_store[idx] for idx in user_idxs])
+
+                results = self.vmap_evaluator(rows, client_data, user_idxs, self.config.dataset.eval_batch_size)
+                for key, result in zip(group_keys, results):
+                    self.evaluation_cache[key] = result
+
+        return nr_scored
+
+    def write_results(self, round, loss_avg, evaluation_user_index_range, outputFile, outputFile_log, **kwargs):
+
+        print(f'{round}, {loss_avg}, ', end = '', file = outputFile)
+        print(f'{round}, ', end = '', file = outputFile_log)
+        self.evaluate_performance(evaluation_user_index_range, outputFile, outputFile_log, **kwargs)
+
+        # the rows of a background evaluation are complete once written
+        outputFile.flush()
+        outputFile_log.flush()
+
+    def evaluate_performance(self, evaluation_user_index_range, outputFile, outputFile_log, model_store=None, full=True, 
+                             last_epoch_stats=None, eval_strata=None):
+
+        # evaluate the performance of the models on train and test datasets, users that are not evaluated stay nan
+        acc_train_final = np.full(self.config.federated.num_users, np.nan)
+        loss_train_final = np.full(self.config.federated.num_users, np.nan)
+        acc_test_final = np.full(self.config.federated.num_users, np.nan)
+        loss_test_final = np.full(self.config.federated.num_users, np.nan)
 
         sum_weight_training = 0
         sum_weight_test = 0
 
+        # the current models and round state by default, e.g. a snapshot of them otherwise
+        model_store = self.model_store if model_store is None else model_store
+        last_epoch_stats = self.last_epoch_stats if last_epoch_stats is None else last_epoch_stats
+        eval_strata = self.eval_strata if eval_strata is None else eval_strata
+        self.evaluation_cache.begin_round()
+
+        if full:
+            evaluation_users = evaluation_user_index_range
+            test_data = self.test_data
+        else:
+            # stratified sample of the users, the test accuracy on a subsample of their test data
+            evaluation_users, strata = stratified_sample(evaluation_user_index_range, eval_strata[evaluation_user_index_range], 
+                                                         self.eval_users_fraction, self.eval_rng)
+            test_data = self.test_eval_data
+
+        # the training accuracy of clients trained in this round can come from their last local epoch
+        if self.train_accuracy == 'last_epoch':
+            last_epoch_users = set(idx for idx in evaluation_users if idx in last_epoch_stats)
+        else:
+            last_epoch_users = set()
+        train_users = [idx for idx in evaluation_users if idx not in last_epoch_users]
+
+        # every distinct (model, data) pair is scored once
+        nr_scored = self.evaluate_missing([(True, self.train_eval_data, train_users), 
+                                           (False, test_data, evaluation_users)], model_store)
+        logger.info(f'Evaluation: {nr_scored} of {len(train_users) + len(evaluation_users)} (model, data) pairs scored, the rest reused, ' + 
+                    f'training accuracy of {len(last_epoch_users)} users from their last local epoch.')
+
         # ----------------------------------
         # testing: average over all clients
-        for idx in evaluation_user_index_range:
+        for idx in evaluation_users:
             if idx % (len(evaluation_user_index_range) // 10) == 0:  
                 logger.info(f'user under process: {idx}')
-            acc_train_final[idx], loss_train_final[idx] = self.localTest(idx, on_trainset=True)
-            acc_test_final[idx], loss_test_final[idx] = self.localTest(idx) 
+            if idx in last_epoch_users:
+                acc_train_final[idx], loss_train_final[idx] = last_epoch_stats[idx]
+            else:
+                acc_train_final[idx], loss_train_final[idx] = self.evaluation_cache[self.evaluation_cache.key(model_store, self.train_eval_data, idx)]
+            acc_test_final[idx], loss_test_final[idx] = self.evaluation_cache[self.evaluation_cache.key(model_store, test_data, idx)]
             
             if self.config.federated.weithed_evaluation == True:
                 sum_weight_training += len(self.dict_train_users[idx])
@@ -456,13 +774,44 @@ class FLT:
             training_variance = np.var(acc_train_final[evaluation_user_index_range])
             test_variance = np.var(acc_test_final[evaluation_user_index_range])
 
-        logger.info('Training accuracy: {:.2f}'.format(training_accuracy))
-        logger.info('Testing accuracy: {:.2f}'.format(test_accuracy))
+        training_accuracy_ci, test_accuracy_ci = 0.0, 0.0
+        if not full:
+            # stratified estimate of the accuracies over all users of the evaluation range
+            stratum_sizes = dict(zip(*np.unique(strata, return_counts=True)))
+            sample_strata = strata[np.searchsorted(evaluation_user_index_range, evaluation_users)]
+
+            if self.config.federated.weithed_evaluation == True:
+                train_weights = np.array([len(self.dict_train_users[idx]) for idx in evaluation_users], dtype=np.float64)
+                test_weights = np.array([len(self.dict_test_users[idx]) for idx in evaluation_users], dtype=np.float64)
+            else:
+                train_weights = test_weights = np.ones(len(evaluation_users))
+
+            test_within_variances = None
+            if test_data is not self.test_data:
+                # the test accuracies are measured on a subsample of the test data of every user
+                test_within_variances = subsample_accuracy_variance(acc_test_final[evaluation_users] / test_weights, 
+                                                                    [test_data.num_samples(idx) for idx in evaluation_users], 
+                                                                    [self.test_data.num_samples(idx) for idx in evaluation_users]) * test_weights ** 2
+
+            training_accuracy, training_accuracy_ci = stratified_estimate(acc_train_final[evaluation_users], train_weights, 
+                                                                          sample_strata, stratum_sizes)
+            test_accuracy, test_accuracy_ci = stratified_estimate(acc_test_final[evaluation_users], test_weights, 
+                                                                  sample_strata, stratum_sizes, 
+                                                                  within_variances=test_within_variances)
+
+            training_variance = np.var(acc_train_final[evaluation_users]) / (np.sum(train_weights) if self.config.federated.weithed_evaluation else 1)
+            test_variance = np.var(acc_test_final[evaluation_users]) / (np.sum(test_weights) if self.config.federated.weithed_evaluation else 1)
+
+        logger.info('Training accuracy: {:.2f} +- {:.2f}'.format(training_accuracy, training_accuracy_ci))
+        logger.info('Testing accuracy: {:.2f} +- {:.2f}'.format(test_accuracy, test_accuracy_ci))
 
         print('{:.2f}, '.format(training_accuracy), end = '', file = outputFile)
         print('{:.2f}, '.format(test_accuracy), end = '', file = outputFile)
         print('{:.2f}, '.format(training_variance), end = '', file = outputFile)
-        print('{:.2f}'.format(test_variance), file = outputFile)
+        print('{:.2f}, '.format(test_variance), end = '', file = outputFile)
+        print('{}, '.format(len(evaluation_users)), end = '', file = outputFile)
+        print('{:.2f}, '.format(training_accuracy_ci), end = '', file = outputFile)
+        print('{:.2f}'.format(test_accuracy_ci), file = outputFile)
 
         for idx in evaluation_user_index_range:
             print('{:.2f}, '.format(acc_train_final[idx]), end = '', file = outputFile_log)
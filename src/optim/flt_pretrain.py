@@ -12,7 +12,6 @@ import logging
 import torch
 
 from pathlib import Path
-from models.utils import save_model
 from torch.utils.data import DataLoader
 from datasets.load_dataset import load_dataset
 
@@ -111,11 +110,7 @@ class FLTPretrain():
 
         self.net.load_state_dict(best_state_dict)
 
-        model_save_path = self.model_path.joinpath(self.model_name + '_' + self.pretrain_dataset + '.tar')
-        save_model(self.net, model_save_path)
-
-        logger.info(f'Pre-trained model saved in {model_save_path}.')
-
+        # the caller stores the pre-trained model, see utils.cluster.get_extractor
         return self.net
 
     def finetune(self):
@@ -0,0 +1,153 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the local training of a group of clients with torch.func.vmap.
+# ---------------------------------------------------------------------------
+
+import math
+import torch
+import torch.nn.functional as F
+
+from torch.func import functional_call, grad_and_value, vmap
+from models.basenet import BaseNet
+
+def split_rows(rows, layout, param_names):
+    """Splits [G, P] flat rows into stacked parameters and buffers of a model.
+
+    Arguments:
+        rows (torch.Tensor): [G, P] flat state dicts
+        layout (list(tuple)): (key, shape, numel) for every state dict entry
+        param_names (set): keys of the parameters, the other entries are buffers
+
+    Returns:
+        params (dict): [G, *shape] parameters
+        buffers (dict): [G, *shape] buffers
+    """
+    params, buffers = {}, {}
+
+    offset = 0
+    for k, shape, numel in layout:
+        value = rows[:, offset: offset + numel].reshape((len(rows),) + tuple(shape))
+        if k in param_names:
+            params[k] = value
+        else:
+            buffers[k] = value
+        offset += numel
+
+    return params, buffers
+
+class VmapLocalUpdate:
+    """Local SGD of a group of clients that share one architecture.
+
+    The parameters of the G clients are stacked along a leading dimension and one
+    vmapped forward/backward computes the gradients of all of them. Every client
+    keeps its own momentum buffer, shuffles its own data and runs its own number of
+    steps per epoch: batches are padded to the batch size and masked, and the
+    parameters and momentum of a client are frozen once its epoch is over.
+    """
+
+    def __init__(self, net: BaseNet, lr: float, momentum: float, batch_size: int, local_ep: int):
+
+        self.net = net
+        self.lr = lr
+        self.momentum = momentum
+        self.batch_size = batch_size
+        self.local_ep = local_ep
+
+        self.layout = [(k, v.shape, v.numel()) for k, v in net.state_dict().items()]
+        self.param_names = set(k for k, _ in net.named_parameters())
+
+        def compute_loss(params, buffers, images, labels, mask):
+            log_probs = functional_call(self.net, (params, buffers), (images,))
+            losses = F.cross_entropy(log_probs, labels, reduction='none')
+            correct = (log_probs.argmax(dim=1) == labels).float()
+            # mean over the real samples of the batch, like CrossEntropyLoss
+            return (losses * mask).sum() / mask.sum().clamp(min=1), (correct * mask).sum()
+
+        # different dropout masks for every client
+        self.grad_fn = vmap(grad_and_value(compute_loss, has_aux=True), randomness='different')
+
+    def flatten(self, params, buffers):
+        state = {**params, **buffers}
+        return torch.cat([state[k].reshape(len(state[k]), -1) for k, _, _ in self.layout], dim=1)
+
+    def batch_indices(self, lengths, offsets, device):
+        """Shuffled [G, L, B] sample indices of one epoch and their mask.
+
+        Client i has ceil(n_i / B) batches, L is the largest number of batches of
+        the group. Padded positions point to sample 0 and are masked out.
+        """
+        nr_batches = [math.ceil(n / self.batch_size) for n in lengths]
+        nr_steps = max(nr_batches)
+
+        indices = torch.zeros((len(lengths), nr_steps * self.batch_size), dtype=torch.long)
+        mask = torch.zeros((len(lengths), nr_steps * self.batch_size))
+        for i, (n, offset) in enumerate(zip(lengths, offsets)):
+            indices[i, :n] = torch.randperm(n) + offset
+            mask[i, :n] = 1
+
+        shape = (len(lengths), nr_steps, self.batch_size)
+        return indices.view(shape).to(device), mask.view(shape).to(device), torch.as_tensor(nr_batches, device=device)
+
+    def __call__(self, rows, client_data):
+        """Trains the clients of a group.
+
+        Arguments:
+            rows (torch.Tensor): [G, P] flat parameters of the clients
+            client_data (list): (images, labels) of every client
+
+        Returns:
+            rows (torch.Tensor): [G, P] trained parameters
+            losses (list): average training loss of every client
+            train_stats (list): (accuracy, loss) of every client over the samples of the last epoch
+        """
+        device = rows.device
+        params, buffers = split_rows(rows.detach().clone(), self.layout, self.param_names)
+        momentum_buffers = {k: torch.zeros_like(v) for k, v in params.items()}
+
+        lengths = [len(labels) for _, labels in client_data]
+        offsets = [0] + list(torch.tensor(lengths).cumsum(0)[:-1].tolist())
+        images = torch.cat([x for x, _ in client_data]).to(device)
+        labels = torch.cat([y for _, y in client_data]).to(device)
+
+        self.net.train()
+
+        epoch_loss = torch.zeros((self.local_ep, len(rows)), device=device)
+        for iter in range(self.local_ep):
+            indices, mask, nr_batches = self.batch_indices(lengths, offsets, device)
+            correct = torch.zeros(len(rows), device=device)
+            sample_loss = torch.zeros(len(rows), device=device)
+            min_batches = nr_batches.min().item()
+
+            for step in range(indices.shape[1]):
+                batch = indices[:, step]
+                grads, (loss, batch_correct) = self.grad_fn(params, buffers, images[batch], labels[batch], mask[:, step])
+
+                # SGD with momentum (dampening 0). Clients past their last batch have an
+                # all-zero mask and gradient, their momentum decays by 1 and the step is 0
+                active = (step < nr_batches).float()
+                all_active = step < min_batches
+                decay = self.momentum * active + (1 - active)
+                with torch.no_grad():
+                    for k in params:
+                        if all_active:
+                            momentum_buffers[k].mul_(self.momentum).add_(grads[k])
+                            params[k].add_(momentum_buffers[k], alpha=-self.lr)
+                        else:
+                            shape = (-1,) + (1,) * (params[k].dim() - 1)
+                            momentum_buffers[k].mul_(decay.view(shape)).add_(grads[k])
+                            params[k].addcmul_(momentum_buffers[k], active.view(shape), value=-self.lr)
+
+                epoch_loss[iter] += loss.detach() * active
+                correct += batch_correct
+                sample_loss += loss.detach() * mask[:, step].sum(dim=1)
+
+            epoch_loss[iter] /= nr_batches
+
+        # statistics of the last epoch, of the models during training
+        lengths = torch.as_tensor(lengths, device=device)
+        train_stats = list(zip((100.00 * correct.round() / lengths).tolist(), (sample_loss / lengths).tolist()))
+
+        return self.flatten(params, buffers), epoch_loss.mean(dim=0).tolist(), train_stats
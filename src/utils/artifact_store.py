@@ -0,0 +1,148 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the content-addressed store of the pre-trained artifacts.
+# ---------------------------------------------------------------------------
+
+import os
+import json
+import fcntl
+import pickle
+import hashlib
+import logging
+import numpy as np
+
+from pathlib import Path
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# offset alignment of the out-of-band buffers in an array pickle
+BUFFER_ALIGNMENT = 64
+
+def artifact_key(kind: str, fields: dict):
+    """Name of an artifact: its kind and the hash of the config fields it depends on."""
+    digest = hashlib.blake2b(json.dumps(fields, sort_keys=True, default=str).encode(), digest_size=8).hexdigest()
+    return f'{kind}-{digest}'
+
+def dump_array_pickle(obj, file):
+    """Pickles obj with protocol 5, its numpy arrays as raw out-of-band buffers after the pickle stream.
+
+    Layout: int64 number of entries, int64 [length of the stream, length of every
+    buffer], the stream, then the buffers, each at an offset aligned to BUFFER_ALIGNMENT.
+    """
+    buffers = []
+    stream = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    raws = [buffer.raw() for buffer in buffers]
+
+    header = np.array([len(stream)] + [raw.nbytes for raw in raws], dtype=np.int64)
+    file.write(np.int64(len(header)).tobytes())
+    file.write(header.tobytes())
+    file.write(stream)
+
+    offset = 8 + header.nbytes + len(stream)
+    for raw in raws:
+        padding = -offset % BUFFER_ALIGNMENT
+        file.write(b'\0' * padding)
+        file.write(raw)
+        offset += padding + raw.nbytes
+
+def load_array_pickle(file):
+    """Inverse of dump_array_pickle: one read of the file, the arrays are views of it."""
+    data = bytearray(os.fstat(file.fileno()).st_size)
+    file.readinto(data)
+    view = memoryview(data)
+
+    nr_entries = int(np.frombuffer(view[:8], dtype=np.int64)[0])
+    header = np.frombuffer(view[8: 8 + 8 * nr_entries], dtype=np.int64)
+    offset = 8 + header.nbytes
+    stream = view[offset: offset + header[0]]
+    offset += int(header[0])
+
+    buffers = []
+    for nbytes in header[1:]:
+        offset += -offset % BUFFER_ALIGNMENT
+        buffers.append(view[offset: offset + nbytes])
+        offset += int(nbytes)
+
+    return pickle.loads(stream, buffers=buffers)
+
+@contextmanager
+def file_lock(path: Path):
+    """Exclusive fcntl lock on the file path, created if missing, for the time of the context."""
+    with open(path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class ArtifactStore:
+    """Pre-trained artifacts in a directory, addressed by artifact_key.
+
+    An artifact is written to a temporary file and renamed into place, so a
+    reader never sees a partial file. Creating an artifact holds an exclusive
+    fcntl lock on its key: concurrent experiments that need the same artifact
+    wait for the first one to create it and then load it.
+
+    Arguments:
+        root (Path): directory of the artifacts, e.g. flt_artifacts
+    """
+
+    def __init__(self, root: Path):
+
+        self.root = Path(root)
+        Path.mkdir(self.root.joinpath('locks'), exist_ok=True, parents=True)
+
+    def path(self, key: str, suffix: str):
+        return self.root.joinpath(key + suffix)
+
+    def lock(self, key: str):
+        return file_lock(self.root.joinpath('locks', key + '.lock'))
+
+    def read(self, key: str, suffix: str, load):
+        """The artifact key loaded by load, None if it is not stored."""
+        path = self.path(key, suffix)
+        if not path.exists():
+            return None
+
+        logger.info(f'Loading artifact {path.name}.')
+        with open(path, 'rb') as file:
+            return load(file)
+
+    def write(self, key: str, suffix: str, artifact, save):
+        """Stores the artifact key with save, replacing the stored one. Call under lock(key)."""
+        path = self.path(key, suffix)
+
+        temp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        with open(temp_path, 'wb') as file:
+            save(artifact, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+
+    def get_or_create(self, key: str, suffix: str, create, save, load):
+        """Loads the artifact key, or creates and stores it first.
+
+        Arguments:
+            key (str): artifact_key of the artifact
+            suffix (str): file suffix of the artifact
+            create (callable): () -> artifact
+            save (callable): (artifact, binary file) writes the artifact
+            load (callable): (binary file) -> artifact
+
+        Returns:
+            artifact: the loaded or created artifact
+        """
+        with self.lock(key):
+            artifact = self.read(key, suffix, load)
+            if artifact is not None:
+                return artifact
+
+            logger.info(f'Artifact {self.path(key, suffix).name} not found, creating it.')
+            artifact = create()
+            self.write(key, suffix, artifact, save)
+
+        return artifact
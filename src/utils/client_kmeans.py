@@ -0,0 +1,78 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the per-client KMeans of the clustering signatures.
+# Kept free of the torch and optim imports: the worker processes import it.
+# ---------------------------------------------------------------------------
+
+import os
+import logging
+import numpy as np
+
+from tqdm import tqdm
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+from sklearn.decomposition import PCA
+from sklearn.cluster import KMeans
+
+logger = logging.getLogger(__name__)
+
+def kmeans_centers(data, n_clusters, random_state, n_init=None, pca_components=None):
+    """Centers of the KMeans clustering of the [n, e] data of one client.
+
+    Arguments:
+        data (ndarray): [n, e] samples of the client
+        n_clusters (int): number of centers
+        random_state (int): seed of the KMeans, and of the PCA
+        n_init (int): KMeans restarts, the scikit-learn default if None
+        pca_components (int): reduces the data to pca_components dimensions first if given,
+            repeating the samples if there are fewer than pca_components
+
+    Returns:
+        centers (ndarray): [n_clusters, e] or [n_clusters, pca_components] centers
+    """
+    if pca_components is not None:
+        if pca_components > len(data):
+            data = np.repeat(data, np.ceil(pca_components/len(data)), axis=0)
+        # seeded like the KMeans, the randomized solver does not draw from the global RNG
+        data = PCA(n_components=pca_components, random_state=random_state).fit_transform(data)
+
+    kwargs = {} if n_init is None else {'n_init': n_init}
+
+    return KMeans(n_clusters=n_clusters, random_state=random_state, **kwargs).fit(data).cluster_centers_
+
+def _limited_kmeans_centers(blas_threads, *args, **kwargs):
+    with threadpool_limits(limits=blas_threads):
+        return kmeans_centers(*args, **kwargs)
+
+def client_kmeans_centers(data, n_clusters, random_state, n_init=None, pca_components=None, workers=0, desc=None):
+    """kmeans_centers of every client, in the main process or across worker processes.
+
+    Every client seeds its PCA and KMeans with random_state and draws nothing from
+    the global RNG of its process, so the centers do not depend on workers.
+    The BLAS and OpenMP threads of every worker are limited to its share of the
+    cores, the workers do not oversubscribe them.
+
+    Arguments:
+        data (list): [n_i, e] samples of every client
+        n_clusters (int or list): number of centers, of every client if a list
+        workers (int): number of worker processes, 0 fits in the main process
+        desc (str): description of the progress bar
+
+    Returns:
+        centers (list): centers of every client
+    """
+    if np.isscalar(n_clusters):
+        n_clusters = [n_clusters] * len(data)
+
+    if workers == 0 or len(data) <= 1:
+        return [kmeans_centers(x, k, random_state, n_init, pca_components)
+                for x, k in tqdm(zip(data, n_clusters), total=len(data), desc=desc)]
+
+    blas_threads = max(1, (os.cpu_count() or 1) // workers)
+    logger.info(f'{desc} {len(data)} clients in {workers} workers, {blas_threads} BLAS threads each.')
+
+    return Parallel(n_jobs=workers, backend='loky')(delayed(_limited_kmeans_centers)(blas_threads, x, k, random_state, n_init, pca_components)
+                                                    for x, k in zip(data, n_clusters))
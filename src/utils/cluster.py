@@ -3,18 +3,23 @@
 # Created Date: 23-Nov-2020
 # 
 # Refactored By: Sayak Mukherjee
-# Last Update: 30-Nov-2023
+# Last Update: 18-Oct-2026
 # ---------------------------------------------------------------------------
 # File contains the code for clustering clients.
 # ---------------------------------------------------------------------------
 
 import os
-import pickle
+import math
+import random
+import itertools
 import umap
 import torch
 import logging
 import numpy as np
 import matplotlib.pyplot as plt
+import scipy.sparse
+import scipy.optimize
+import scipy.spatial
 import scipy.cluster.hierarchy as sch
 
 import time
@@ -22,112 +27,468 @@ import time
 from tqdm import tqdm
 from pathlib import Path
 from collections import defaultdict
-from sklearn.decomposition import PCA
+from contextlib import contextmanager
 from sklearn.cluster import KMeans
-from torch.utils.data import DataLoader, Dataset
-from sympy.utilities.iterables import multiset_permutations
+from torch.utils.data import DataLoader, Dataset, Subset
 
 from models import get_model
+from models.utils import state_fingerprint
 from datasets.load_dataset import load_dataset
-from datasets.utils import DatasetSplit
 from optim.flt_pretrain import FLTPretrain
+from utils.embedding_cache import EmbeddingCache
+from utils.artifact_store import ArtifactStore, artifact_key, dump_array_pickle, load_array_pickle
+from utils.signature_cache import SignatureCache
+from utils.client_kmeans import client_kmeans_centers
 
 logger = logging.getLogger(__name__)
 
-def min_matching_distance(center_0, center_1):
-    if len(center_0) < len(center_1):
-        center_small = center_0
-        center_big = center_1
+# permutations of the larger center set up to which a batch is matched by enumeration
+MATCHING_ENUMERATION_LIMIT = 120
+# pairs of center sets whose [k0, k1, d] differences are formed at once
+MATCHING_BLOCK_PAIRS = 4096
+
+def matching_costs(centers_0, centers_1):
+    """[B, k0, k1] squared Euclidean distances between the centers of B pairs of center sets."""
+    return ((centers_0[:, :, None, :] - centers_1[:, None, :, :]) ** 2).sum(axis=-1)
+
+def min_matching_distances(centers_0, centers_1):
+    """min_matching_distance of B pairs of center sets.
+
+    The smaller set of every pair is matched one to one to the larger set with the
+    least sum of squared distances, an optimal rectangular assignment. Small
+    assignments are solved for the whole batch by enumerating the permutations,
+    larger ones pair by pair with the Hungarian method.
+
+    Arguments:
+        centers_0 (ndarray): [B, k0, d] first center set of every pair
+        centers_1 (ndarray): [B, k1, d] second center set of every pair
+
+    Returns:
+        distances (ndarray): [B] sqrt of the least sum of squared distances over the size of the smaller set
+    """
+    centers_0 = np.asarray(centers_0, dtype=np.float64)
+    centers_1 = np.asarray(centers_1, dtype=np.float64)
+    if centers_0.shape[1] > centers_1.shape[1]:
+        centers_0, centers_1 = centers_1, centers_0
+
+    nr_pairs, k_small, k_big = len(centers_0), centers_0.shape[1], centers_1.shape[1]
+    if k_small == 0:
+        return np.full(nr_pairs, np.inf)
+
+    if math.perm(k_big, k_small) <= MATCHING_ENUMERATION_LIMIT:
+        permutations = np.array(list(itertools.permutations(range(k_big), k_small)), dtype=np.int64)
     else:
-        center_small = center_1
-        center_big = center_0
+        permutations = None
 
-    distance = np.inf
-    if len(center_small) > 0:
-        s = set(range(len(center_big)))
-        for p in tqdm(multiset_permutations(s)):
-            summation = 0
+    summations = np.empty(nr_pairs)
+    for start in range(0, nr_pairs, MATCHING_BLOCK_PAIRS):
+        costs = matching_costs(centers_0[start: start + MATCHING_BLOCK_PAIRS], centers_1[start: start + MATCHING_BLOCK_PAIRS])
 
-            for i in range(len(center_small)):
-                summation = summation + (np.linalg.norm(center_small[i] - center_big[p][i])**2)
+        if permutations is not None:
+            # [B, P, k_small] costs of every permutation
+            summations[start: start + len(costs)] = costs[:, np.arange(k_small), permutations].sum(axis=-1).min(axis=-1)
+        else:
+            for i, cost in enumerate(costs):
+                rows, cols = scipy.optimize.linear_sum_assignment(cost)
+                summations[start + i] = cost[rows, cols].sum()
+
+    return np.sqrt(summations) / k_small
+
+def min_matching_distance(center_0, center_1):
+    """Distance between two center sets under their best one to one matching."""
+    return min_matching_distances(np.asarray(center_0)[None], np.asarray(center_1)[None])[0]
+
+def pairwise_matching_distances(centers, block_rows=256):
+    """[N, N] min_matching_distance between the center sets of all pairs of clients.
+
+    Clients are grouped by their number of centers, so every group is one stacked
+    [n, k, d] array. Only the pairs above the diagonal are computed, block_rows
+    rows at a time, and mirrored; a center set is at distance 0 from itself.
 
-            dist = np.sqrt(summation)/len(center_small)
-            if dist < distance:
-                distance = dist
+    Arguments:
+        centers (ndarray or list): [N, k, d] centers, or the [k_i, d] centers of every client
+        block_rows (int): rows of the matrix whose pairs are batched together
+
+    Returns:
+        distances (ndarray): [N, N] symmetric distances
+    """
+    sizes = np.array([len(c) for c in centers])
+    groups = [(np.flatnonzero(sizes == k), k) for k in np.unique(sizes) if k > 0]
+    stacked = [np.asarray([centers[idx] for idx in users], dtype=np.float64).reshape(len(users), k, -1) for users, k in groups]
+
+    distances = np.zeros((len(centers), len(centers)))
+    # the smaller set of an empty and any other set is empty
+    distances[sizes == 0] = np.inf
+    distances[:, sizes == 0] = np.inf
+
+    for a, (users_a, _) in enumerate(groups):
+        for b in range(a, len(groups)):
+            users_b = groups[b][0]
+            for start in range(0, len(users_a), block_rows):
+                rows = np.arange(start, min(start + block_rows, len(users_a)))
+                if a == b:
+                    rows, cols = np.nonzero(rows[:, None] < np.arange(len(users_b))[None, :])
+                    rows = rows + start
+                else:
+                    rows, cols = np.repeat(rows, len(users_b)), np.tile(np.arange(len(users_b)), len(rows))
+
+                block = min_matching_distances(stacked[a][rows], stacked[b][cols])
+                distances[users_a[rows], users_b[cols]] = block
+                distances[users_b[cols], users_a[rows]] = block
+
+    return distances
+
+def candidate_pairs(keys_a, keys_b, radius, same_group, block_rows):
+    """Pairs (i, j) with ||keys_a[i] - keys_b[j]|| <= radius, j > i if both are the same set.
+
+    keys_b is indexed by a k-d tree and queried block_rows points of keys_a at a time.
+    """
+    tree = scipy.spatial.cKDTree(keys_b)
+
+    rows, cols = [], []
+    for start in range(0, len(keys_a), block_rows):
+        neighbours = tree.query_ball_point(keys_a[start: start + block_rows], radius)
+        lengths = np.array([len(n) for n in neighbours], dtype=np.int64)
+        block_rows_idx = np.repeat(np.arange(start, start + len(neighbours)), lengths)
+        block_cols_idx = np.concatenate([np.asarray(n, dtype=np.int64) for n in neighbours] + [np.zeros(0, dtype=np.int64)])
+
+        if same_group:
+            upper = block_cols_idx > block_rows_idx
+            block_rows_idx, block_cols_idx = block_rows_idx[upper], block_cols_idx[upper]
+        rows.append(block_rows_idx)
+        cols.append(block_cols_idx)
+
+    return np.concatenate(rows), np.concatenate(cols)
+
+def sorted_signature_keys(centers):
+    """[n, k * d] flattened center sets with the centers of every set in lexicographic order."""
+    order = np.lexsort(centers.transpose(2, 0, 1)[::-1], axis=-1)
+    return np.take_along_axis(centers, order[:, :, None], axis=1).reshape(len(centers), -1)
+
+def signature_graph(centers, threshold, candidates='mean', slack=1.5, block_rows=4096):
+    """Sparse clustering matrix of the clients whose center sets are closer than threshold.
+
+    The pairs of clients are not enumerated: a k-d tree proposes candidate pairs
+    and only those are matched exactly with min_matching_distances. For two sets of
+    k centers at distance D the distance of their means is at most sqrt(k) D, so
+    candidates='mean' queries the set means within sqrt(k) threshold and finds
+    every edge. candidates='sorted' queries the flattened sets, centers sorted,
+    within k threshold slack; the sorted order is not the best matching, so edges
+    can be missed, but the candidates are far fewer in high dimension. Sets of
+    different sizes are always compared exactly: some center of the larger set is
+    within ks threshold of the first center of the smaller set.
+
+    Arguments:
+        centers (ndarray or list): [N, k, d] centers, or the [k_i, d] centers of every client
+        threshold (float): distance under which two clients are connected
+        candidates (str): mean (exact) or sorted (approximate)
+        slack (float): radius factor of the sorted candidates
+        block_rows (int): tree queries per block
+
+    Returns:
+        clustering_matrix (csr_matrix): [N, N] 1 for pairs of clients closer than threshold
+        clustering_matrix_soft (csr_matrix): [N, N] distances of these pairs, explicit zeros on the diagonal
+    """
+    sizes = np.array([len(c) for c in centers])
+    groups = [(np.flatnonzero(sizes == k), k) for k in np.unique(sizes) if k > 0]
+    stacked = [np.asarray([centers[idx] for idx in users], dtype=np.float64).reshape(len(users), k, -1) for users, k in groups]
+
+    # a non-empty center set is at distance 0 from itself
+    nonempty = np.flatnonzero(sizes > 0)
+    edge_rows, edge_cols, edge_distances = [nonempty], [nonempty], [np.zeros(len(nonempty))]
+    nr_candidates = 0
+
+    for a, (users_a, k_a) in enumerate(groups):
+        for b in range(a, len(groups)):
+            users_b, k_b = groups[b]
+            if a == b and candidates == 'mean':
+                rows, cols = candidate_pairs(stacked[a].mean(axis=1), stacked[b].mean(axis=1), 
+                                             math.sqrt(k_a) * threshold, True, block_rows)
+            elif a == b and candidates == 'sorted':
+                keys = sorted_signature_keys(stacked[a])
+                rows, cols = candidate_pairs(keys, keys, k_a * threshold * slack, True, block_rows)
+            elif a == b:
+                raise ValueError(f'{candidates} candidates not implemented.')
+            else:
+                # groups are in increasing size, a is the smaller set
+                rows, points = candidate_pairs(stacked[a][:, 0], stacked[b].reshape(-1, stacked[b].shape[-1]), 
+                                               k_a * threshold, False, block_rows)
+                pairs = np.unique(np.stack((rows, points // k_b), axis=1), axis=0).reshape(-1, 2)
+                rows, cols = pairs[:, 0], pairs[:, 1]
+
+            nr_candidates += len(rows)
+            distances = min_matching_distances(stacked[a][rows], stacked[b][cols])
+            edges = distances < threshold
+            edge_rows += [users_a[rows[edges]], users_b[cols[edges]]]
+            edge_cols += [users_b[cols[edges]], users_a[rows[edges]]]
+            edge_distances += [distances[edges], distances[edges]]
+
+    rows, cols, distances = np.concatenate(edge_rows), np.concatenate(edge_cols), np.concatenate(edge_distances)
+    logger.info(f'Signature graph: {(len(rows) - len(nonempty)) // 2} edges from {nr_candidates} candidate pairs of {len(centers)} users')
+
+    shape = (len(centers), len(centers))
+    clustering_matrix = scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape)
+    clustering_matrix_soft = scipy.sparse.csr_matrix((distances, (rows, cols)), shape=shape)
+
+    return clustering_matrix, clustering_matrix_soft
+
+def signature_clustering(config, centers, threshold):
+    """Clustering matrix of the clients whose center sets are closer than threshold.
+
+    With federated.signature_graph dense all pairs are computed, with mean or
+    sorted the matrices are sparse and built by signature_graph.
+
+    Returns:
+        clustering_matrix (ndarray or csr_matrix): [N, N] 1 for pairs of clients closer than threshold, 0 otherwise
+        clustering_matrix_soft (ndarray or csr_matrix): [N, N] pairwise_matching_distances of the centers, 
+            only the ones under threshold if sparse
+    """
+    graph = config.federated.get('signature_graph', 'dense')
+    if graph != 'dense':
+        return signature_graph(centers, threshold, candidates=graph, slack=config.federated.get('signature_graph_slack', 1.5))
+
+    clustering_matrix_soft = pairwise_matching_distances(centers)
+    clustering_matrix = (clustering_matrix_soft < threshold).astype(np.float64)
+
+    return clustering_matrix, clustering_matrix_soft
+
+@torch.inference_mode()
+def embed_samples(images, embed, batch_size):
+    """[N, e] CPU embeddings of the [N, ...] images, batch_size images at a time."""
+    return torch.cat([embed(images[start: start + batch_size]).cpu() for start in range(0, len(images), batch_size)])
+
+def embedding_cache(config, extractor, dataset_name, split, num_samples):
+    """EmbeddingCache of a dataset split under the extractor, in flt_artifacts/embeddings.
+
+    The file is keyed by the dataset, its split and the hash of the extractor weights.
+    """
+    key = f'{dataset_name.upper()}_{config.dataset.dataset_split}_{split}_{config.model.extractor_backbone}_{state_fingerprint(extractor)}'
+
+    return EmbeddingCache(Path(config.project.path).joinpath('flt_artifacts', 'embeddings', key + '.npy'), num_samples)
+
+def cached_sample_embeddings(config, client_data, extractor, embed):
+    """Embeddings of the packed samples of client_data, the ones not in the embedding cache are encoded and stored."""
+    cache = embedding_cache(config, extractor, config.dataset.name, 'train', client_data.dataset_size)
+
+    missing = cache.missing(client_data.sample_idxs)
+    logger.info(f'Embedding cache: {len(client_data.sample_idxs) - len(missing)} of {len(client_data.sample_idxs)} samples cached.')
+    if len(missing) > 0:
+        images = client_data.images[torch.as_tensor(np.searchsorted(client_data.sample_idxs, missing), device=client_data.images.device)]
+        cache.write(missing, embed_samples(images, embed, config.dataset.eval_batch_size).numpy())
+
+    return torch.from_numpy(cache[client_data.sample_idxs])
+
+def signature_embeddings(config, client_data, extractor, embed):
+    """Embeddings of the packed samples of client_data, through the embedding cache if project.embedding_cache."""
+    if config.project.get('embedding_cache', True):
+        return cached_sample_embeddings(config, client_data, extractor, embed)
+
+    return embed_samples(client_data.images, embed, config.dataset.eval_batch_size)
+
+def extract_signatures(client_data, users, embed, batch_size, shuffle=True, sample_embeddings=None, keep=None):
+    """Embeddings of the samples of all clients in one pass over the packed samples.
+
+    Every sample is embedded once, in batches of batch_size, whatever the number
+    of clients that hold it. The embeddings are then gathered client after client,
+    each in the order client_data.client(idx, shuffle) would give, into one
+    contiguous array. The shuffles are drawn in the order of users, like the
+    per-client loaders did.
+
+    Arguments:
+        client_data (ClientData): packed samples of the clients
+        users (list): clients in the order of the shuffles
+        embed (callable): [B, ...] images to [B, e] embeddings
+        batch_size (int): samples per call of embed
+        shuffle (bool): shuffle the samples of every client
+        sample_embeddings (torch.Tensor): [len(client_data.images), e] embeddings of the packed samples, 
+            the samples of the kept clients are embedded with embed if None
+        keep (ndarray): [len(users)] bool mask of the clients to embed, all if None. The shuffles 
+            of all users are drawn either way
+
+    Returns:
+        embeddings (ndarray): [sum of n_i, e] embeddings, the i-th kept client owns embeddings[offsets[i]: offsets[i + 1]]
+        offsets (ndarray): [number of kept clients + 1] start of the embeddings of every kept client
+    """
+    positions = [client_data.sample_positions(idx, shuffle).cpu() for idx in users]
+    if keep is not None:
+        positions = [p for p, kept in zip(positions, keep) if kept]
+    offsets = np.concatenate(([0], np.cumsum([len(p) for p in positions]))).astype(np.int64)
+    positions = torch.cat(positions)
+
+    if sample_embeddings is None:
+        # only the samples of the kept clients
+        needed, positions = torch.unique(positions, return_inverse=True)
+        images = client_data.images if len(needed) == len(client_data.images) else client_data.images[needed.to(client_data.images.device)]
+        sample_embeddings = embed_samples(images, embed, batch_size)
+
+    return sample_embeddings[positions].numpy(), offsets
+
+def umap_embeddings(reducer, client_data, users, batched=False, transform_samples=10000, batch_size=128, keep=None):
+    """UMAP embeddings of the shuffled samples of all clients, contiguous per client.
+
+    By default every client is transformed by its own reducer.transform call. With
+    batched, every packed sample is transformed once, transform_samples samples per
+    call, and the embeddings are gathered by client offsets: the nearest-neighbour
+    search and the optimization epochs run once per call instead of once per client.
+    UMAP optimizes the points of a call together, so the embeddings differ slightly
+    from the per-client ones.
+
+    Returns:
+        embeddings (ndarray): [sum of n_i, manifold_dim] embeddings of the clients kept, see extract_signatures
+        offsets (ndarray): [number of kept clients + 1] start of the embeddings of every kept client
+    """
+    if batched:
+        embed = lambda x: torch.from_numpy(reducer.transform(x.reshape(len(x), -1).cpu().numpy().astype(np.float64)))
+        return extract_signatures(client_data, users, embed, transform_samples, keep=keep)
+
+    # the flattened images of every client, contiguous
+    images, offsets = extract_signatures(client_data, users, lambda x: x.reshape(len(x), -1), batch_size, keep=keep)
+
+    embeddings = [reducer.transform(images[offsets[i]: offsets[i + 1]].astype(np.float64)) for i in tqdm(range(len(offsets) - 1), desc='UMAP transform')]
+
+    return np.concatenate(embeddings), offsets
+
+def artifact_store(config):
+    """ArtifactStore of the pre-trained extractors and reducers, in flt_artifacts."""
+    return ArtifactStore(Path(config.project.path).joinpath('flt_artifacts'))
+
+@contextmanager
+def preserved_rng_state():
+    """Restores the python, numpy and torch global RNG states at the end of the context.
+
+    An artifact is created on the first run and loaded on the later ones: its
+    creation must not advance the global RNGs, or the rounds that follow would
+    differ between a cold and a cached run.
+    """
+    python_state, numpy_state, torch_state = random.getstate(), np.random.get_state(), torch.get_rng_state()
+    cuda_states = torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+    try:
+        yield
+    finally:
+        random.setstate(python_state)
+        np.random.set_state(numpy_state)
+        torch.set_rng_state(torch_state)
+        if cuda_states is not None:
+            torch.cuda.set_rng_state_all(cuda_states)
+
+def extractor_args(config):
+    """Constructor arguments of the extractor of config."""
+    if config.dataset.pre_trained_dataset in ['CIFAR10', 'CIFAR100', 'CIFAR20']:
+        return {
+                'num_hiddens': config.model.num_hiddens,
+                'num_residual_layers': config.model.num_residual_layers, 
+                'num_residual_hiddens': config.model.num_residual_hiddens,
+                'latent_size': config.model.latent_dim,
+                }
+
+    return {
+        'latent_size': config.model.latent_dim,
+        }
+
+def extractor_key(config, finetuned=True):
+    """artifact_key of the pre-trained extractor of config, of the fine-tuned one if finetuned and trainer.finetune_epochs > 0."""
+    fields = {
+        'backbone': config.model.extractor_backbone,
+        'model_args': extractor_args(config),
+        'dataset': config.dataset.pre_trained_dataset.upper(),
+        'dataset_split': config.dataset.dataset_split,
+        'epochs': config.trainer.pretrain_epochs,
+        'batch_size': config.dataset.train_batch_size,
+        'seed': config.project.seed,
+        }
     
-    return distance
+    if finetuned and config.trainer.finetune_epochs > 0:
+        fields['finetune_dataset'] = config.dataset.name.upper()
+        fields['finetune_epochs'] = config.trainer.finetune_epochs
+
+    return artifact_key('extractor', fields)
 
 def get_extractor(config, device):
 
     pretrained_dataset_name = config.dataset.pre_trained_dataset
-
-    if pretrained_dataset_name in ['CIFAR10', 'CIFAR100', 'CIFAR20']:
-        model_args = {
-                        'num_hiddens': config.model.num_hiddens,
-                        'num_residual_layers': config.model.num_residual_layers, 
-                        'num_residual_hiddens': config.model.num_residual_hiddens,
-                        'latent_size': config.model.latent_dim,
-                        }
-        
-    else:
-        model_args = {
-            'latent_size': config.model.latent_dim,
-            }
-
     model_name = config.model.extractor_backbone
 
     logger.info(f'Using extractor {model_name}')
 
-    extractor = get_model(model_name)(model_args)
+    extractor = get_model(model_name)(extractor_args(config))
+    store = artifact_store(config)
 
-    import_path = Path(config.project.path).joinpath('flt_artifacts').joinpath(model_name + '_' + pretrained_dataset_name + '.tar')
-    if not Path.exists(import_path):
-        logger.info(f'Extractor not found! Pre-training extractor.')
-        trainer = FLTPretrain(config, extractor, model_name, pretrained_dataset_name, device)
-        extractor = trainer.train()
+    def pretrain():
+        with preserved_rng_state():
+            trainer = FLTPretrain(config, extractor, model_name, pretrained_dataset_name, device)
+            return trainer.train().state_dict()
 
-    else:
-        logger.info(f'Loading pre-trained extractor.')
-        extractor_dict = extractor.state_dict()
-        loaded_dict = torch.load(import_path)
-        extractor_dict.update(loaded_dict)
-        extractor.load_state_dict(extractor_dict)
+    load_state = lambda file: torch.load(file, map_location=torch.device('cpu'))
+
+    extractor_dict = extractor.state_dict()
+    extractor_dict.update(store.get_or_create(extractor_key(config, finetuned=False), '.tar', pretrain, torch.save, load_state))
+    extractor.load_state_dict(extractor_dict)
 
     if config.trainer.finetune_epochs > 0:
-        trainer = FLTPretrain(config, extractor, model_name, config.dataset.name, device)
-        extractor = trainer.finetune()
+        def finetune():
+            with preserved_rng_state():
+                trainer = FLTPretrain(config, extractor, model_name, config.dataset.name, device)
+                return trainer.finetune().state_dict()
+        
+        extractor.load_state_dict(store.get_or_create(extractor_key(config), '.tar', finetune, torch.save, load_state))
 
     return extractor
 
+def reducer_key(config, use_AE):
+    """artifact_key of the UMAP reducer of config, fitted on the extractor embeddings if use_AE."""
+    fields = {
+        'dataset': config.dataset.pre_trained_dataset.upper(),
+        'dataset_split': config.dataset.dataset_split,
+        'manifold_dim': config.model.manifold_dim,
+        'seed': config.project.seed,
+        'extractor': extractor_key(config) if use_AE else None,
+        }
+
+    return artifact_key('umap_reducer', fields)
+
+def get_reducer(config, use_AE, device):
+    """UMAP reducer of config from the artifact store, fitted by manifold_approximation_umap if missing."""
+    def fit():
+        with preserved_rng_state():
+            return manifold_approximation_umap(config, use_AE, device)
+
+    return artifact_store(config).get_or_create(reducer_key(config, use_AE), '.p', fit, dump_array_pickle, load_array_pickle)
+
 def manifold_approximation_umap(config, use_AE, device):
 
     # check if manifold approximation is needed
     if use_AE and config.model.manifold_dim == config.model.latent_dim:
         raise AssertionError("We don't need manifold learning, AE dim = 2 !")
     
-    pretrained_dataset_name = config.pre_trained_dataset.name.upper()
+    pretrained_dataset_name = config.dataset.pre_trained_dataset.upper()
     
     dataset, _, _= load_dataset(pretrained_dataset_name, 
                                 config.dataset.path, 
                                 dataset_split=config.dataset.dataset_split)
     
-    import_path = Path(config.project.path).joinpath('flt_artifacts') # .joinpath('umap_reducer_' + pretrained_dataset_name + '.p')
     if use_AE: 
         ae_model = get_extractor(config, device)
         ae_model = ae_model.to(device)
 
-        trainloader = DataLoader(dataset['train'], batch_size = config.dataset.train_batch_size)
-        embeddings = []
-        for batch_idx, (images, labels) in enumerate(trainloader):
-            images = images.to(device)
-            _, x_comp = ae_model(images)
-            embeddings.append(x_comp.cpu().detach().numpy())
+        ae_model.eval()
+
+        # the samples that are not in the embedding cache are encoded and stored
+        cache = embedding_cache(config, ae_model, pretrained_dataset_name, 'train', len(dataset['train']))
+        missing = cache.missing(np.arange(len(dataset['train'])))
+        if len(missing) > 0:
+            trainloader = DataLoader(Subset(dataset['train'], missing), batch_size = config.dataset.eval_batch_size)
+            embeddings = []
+            with torch.inference_mode():
+                for batch_idx, (images, labels) in enumerate(trainloader):
+                    images = images.to(device)
+                    _, x_comp = ae_model(images)
+                    embeddings.append(x_comp.cpu().numpy())
+            cache.write(missing, np.concatenate(embeddings, axis=0))
         
-        embeddings = np.concatenate(embeddings, axis=0)
+        embeddings = cache[np.arange(len(dataset['train']))]
         
         logger.info('Using AE for E2E encoding ...')
         umap_data = embeddings
-        umap_model_address = import_path.joinpath('umap_reducer_' + pretrained_dataset_name + '_' + config.model.extractor_backbone + '.p')
     else:
         data_list = [data[0] for data in dataset['train']]
         data_tensor = torch.cat(data_list, dim=0)
@@ -135,16 +496,87 @@ def manifold_approximation_umap(config, use_AE, device):
 
         logger.info('AE not used in this scenario ...')
         umap_data = data_2D_np
-        umap_model_address = import_path.joinpath('umap_reducer_' + pretrained_dataset_name + '.p')
         
 
     logger.info('Training UMAP on AE embedding ...')
     umap_reducer = umap.UMAP(n_components=config.model.manifold_dim, random_state=config.project.seed)
     _ = umap_reducer.fit_transform(umap_data)
-    pickle.dump(umap_reducer, open(umap_model_address, 'wb'))
 
     return umap_reducer
 
+def kmeans_settings(config):
+    """Keyword arguments of client_kmeans_centers from the federated section of config."""
+    return {'n_init': config.federated.get('kmeans_n_init', None), 'workers': config.federated.get('clustering_workers', 0)}
+
+def signature_cache(config, method, **settings):
+    """SignatureCache of a clustering method and its settings on the current dataset, None if project.signature_cache is off."""
+    if not config.project.get('signature_cache', True):
+        return None
+
+    fields = dict(method=method, dataset=config.dataset.name.upper(), dataset_split=config.dataset.dataset_split, 
+                  kmeans_n_init=config.federated.get('kmeans_n_init', None), **settings)
+
+    return SignatureCache(artifact_store(config), artifact_key('signatures', fields))
+
+def cached_signatures(cache, client_data, users, compute, shuffle=True, client_settings=None):
+    """Signatures of the clients users, only the ones not in the cache are computed.
+
+    A client is looked up by the digest of its set of samples, so the clients whose
+    partition did not change since an earlier run, or since the last dataset
+    change, are not recomputed. The computed signatures are added to the cache.
+
+    Arguments:
+        cache (SignatureCache): cache of the signatures, None computes all
+        client_data (ClientData): samples of the clients
+        users (ndarray): clients, in the order compute draws their shuffles
+        compute (callable): [len(users)] bool mask -> list of the signatures of the masked users, 
+            drawing the shuffles of all users, e.g. through extract_signatures(keep=mask)
+        shuffle (bool): compute draws a shuffle for every client. if nothing is computed they 
+            are drawn here, the torch RNG continues like in a run without the cache
+        client_settings (list): per-client settings the signature depends on, next to its samples
+
+    Returns:
+        signatures (list): signatures of the users
+        digests (list): cache keys of the users
+    """
+    if cache is None:
+        return compute(np.ones(len(users), dtype=bool)), None
+
+    digests = [client_data.sample_digest(idx) for idx in users]
+    if client_settings is not None:
+        digests = [f'{digest}_{setting}' for digest, setting in zip(digests, client_settings)]
+
+    missing = np.array([digest not in cache for digest in digests])
+    logger.info(f'Signature cache: {len(users) - missing.sum()} of {len(users)} clients cached.')
+
+    if missing.any():
+        signatures = compute(missing)
+        cache.update({digests[i]: signature for i, signature in zip(np.flatnonzero(missing), signatures)})
+    elif shuffle:
+        for idx in users:
+            client_data.sample_positions(idx, shuffle)
+
+    return [cache[digest] for digest in digests], digests
+
+def cached_clustering(config, cache, digests, create, **settings):
+    """Clustering result of the signatures of the clients digests, create() if it is not stored.
+
+    Arguments:
+        cache (SignatureCache): cache the signatures were read from, None calls create
+        digests (list): cache keys of the clients, in the order of the result
+        create (callable): () -> clustering result of the signatures
+        settings: settings of the clustering of the signatures, e.g. its threshold
+    """
+    if cache is None:
+        return create()
+
+    fields = dict(signatures=cache.key, digests=digests, 
+                  signature_graph=config.federated.get('signature_graph', 'dense'), 
+                  signature_graph_slack=config.federated.get('signature_graph_slack', 1.5), **settings)
+
+    return artifact_store(config).get_or_create(artifact_key('clustering', fields), '.p', create, 
+                                                dump_array_pickle, load_array_pickle)
+
 def clustering_single(num_users):
     clustering_matrix = np.ones((num_users, num_users))
                 
@@ -155,19 +587,14 @@ def clustering_seperate(num_users):
                 
     return clustering_matrix
 
-def clustering_perfect(config, dict_users, dataset_train, cluster):
+def clustering_perfect(config, client_data, cluster):
 
     idxs_users = np.arange(config.federated.num_users)
     ar_label = np.zeros((config.federated.num_users, config.dataset.num_classes))-1
 
     for idx in idxs_users:
-        local_train = DataLoader(DatasetSplit(dataset_train, dict_users[idx]), 
-                                 batch_size=config.dataset.train_batch_size, 
-                                 shuffle=True)
-        label_matrix = np.empty(0, dtype=int)
-        for _, (_, labels) in enumerate(local_train):
-            label_matrix = np.concatenate((label_matrix, labels.numpy()), axis=0)
-        label_matrix = np.unique(label_matrix)
+        _, labels = client_data.client(idx, shuffle=True)
+        label_matrix = np.unique(labels.cpu().numpy())
         ar_label[idx][0:len(label_matrix)] = label_matrix
     
     clustering_matrix = np.zeros((config.federated.num_users, config.federated.num_users))
@@ -178,224 +605,195 @@ def clustering_perfect(config, dict_users, dataset_train, cluster):
                 
     return clustering_matrix
 
-def clustering_umap(config, dict_users, dataset_train, device):
+def clustering_umap(config, client_data, device):
 
     use_AE = False #TODO: Remove hard-coding
 
-    pretrained_dataset_name = config.dataset.pre_trained_dataset
-    import_path = Path(config.project.path).joinpath('flt_artifacts')
-    
-    if use_AE:
-        umap_model_address = import_path.joinpath('umap_reducer_' + pretrained_dataset_name + '_' + config.model.extractor_backbone + '.p')
-    else:
-        umap_model_address = import_path.joinpath('umap_reducer_' + pretrained_dataset_name + '.p')
-    
-    if not Path.exists(umap_model_address):
-        logger.info(f'Reducer not found! Creating reducer.')
-        reducer = manifold_approximation_umap(config, use_AE, device)
-
-    else:
-        logger.info(f'Loading pre-trained extractor.')
-        with open(umap_model_address, 'rb') as fp:
-            reducer = pickle.load(fp)
-
     idxs_users = np.arange(config.federated.num_users)
-    
-    input_dim = dataset_train[0][0].shape[-1]
-    channel_dim = dataset_train[0][0].shape[0]
-    
-    centers = np.zeros((config.federated.num_users, 2, 2))
-    for idx in tqdm(idxs_users, desc='Clustering progress'):
-        images_matrix = np.empty((0, channel_dim*input_dim*input_dim))
-        local_train = DataLoader(DatasetSplit(dataset_train, dict_users[idx]), 
-                                 batch_size=config.dataset.train_batch_size, 
-                                 shuffle=True)
-        #TODO: concatenate the matrices
-        for batch_idx, (images, labels) in enumerate(local_train):
-            # if batch_idx == 3:# TODO: abalation test
-            #     break
-            ne = images.numpy().flatten().T.reshape((len(labels), channel_dim*input_dim*input_dim))
-            images_matrix = np.vstack((images_matrix, ne))
-        embedding1 = reducer.transform(images_matrix)
-        X = list(embedding1)
-        kmeans = KMeans(n_clusters=2, random_state=0).fit(np.array(X))
-        centers[idx,:,:] = kmeans.cluster_centers_
-    
-    clustering_matrix_soft = np.zeros((config.federated.num_users, config.federated.num_users))
-    clustering_matrix = np.zeros((config.federated.num_users, config.federated.num_users))
-
-    for idx0 in tqdm(idxs_users, desc='Clustering matrix generation'):
-        for idx1 in idxs_users:
-            c0 = centers[idx0]
-            c1 = centers[idx1]
+    batched = config.federated.get('umap_transform', 'client') == 'batched'
+    transform_samples = config.federated.get('umap_transform_samples', 10000)
 
-            distance = min_matching_distance(c0, c1)
+    cache = signature_cache(config, 'umap', reducer=reducer_key(config, use_AE), batched=batched, 
+                            transform_samples=transform_samples if batched else None)
 
-            clustering_matrix_soft[idx0][idx1] = distance
+    def compute(missing):
+        reducer = get_reducer(config, use_AE, device)
+        embeddings, offsets = umap_embeddings(reducer, client_data, idxs_users, batched=batched, 
+                                              transform_samples=transform_samples, 
+                                              batch_size=config.dataset.eval_batch_size, keep=missing)
         
-            if distance < 1:
-                clustering_matrix[idx0][idx1] = 1
-            else:
-                clustering_matrix[idx0][idx1] = 0
+        return client_kmeans_centers([embeddings[offsets[position]: offsets[position + 1]] for position in range(len(offsets) - 1)], 
+                                     n_clusters=2, random_state=0, desc='Clustering progress', **kmeans_settings(config))
+    
+    signatures, digests = cached_signatures(cache, client_data, idxs_users, compute)
+    centers = np.stack(signatures)
+    
+    clustering_matrix, clustering_matrix_soft = cached_clustering(config, cache, digests, 
+                                                                  lambda: signature_clustering(config, centers, threshold=1), 
+                                                                  threshold=1)
 
     return clustering_matrix, clustering_matrix_soft, centers
 
-def clustering_encoder(config, dict_users, dataset_train, ae_model, device):
+def clustering_encoder(config, client_data, ae_model, device):
 
-    idxs_users = np.arange(config.federated.num_users.num_users)
+    idxs_users = np.arange(config.federated.num_users)
 
-    centers = np.zeros((config.federated.num_users.num_users, 2, 2))
-    embedding_matrix = np.zeros((len(dict_users[0])*config.federated.num_users.num_users, 2))
-    for user_id in tqdm(idxs_users, desc='Custering in progress ...'):
-        local_train = DataLoader(DatasetSplit(dataset_train, dict_users[user_id]), 
-                                 batch_size=config.dataset.train_batch_size, 
-                                 shuffle=True)
+    ae_model.eval()
+    embed = lambda x: ae_model(x.to(device))[1]
+    embedding_matrix = None
 
-        embeddings = []
-        for batch_idx, (images, labels) in enumerate(local_train):
-            images = images.to(device)
-            _, x_comp = ae_model(images)
-            embeddings.append(x_comp.cpu().detach().numpy())
+    cache = signature_cache(config, 'encoder', extractor=state_fingerprint(ae_model))
+
+    def compute(missing):
+        nonlocal embedding_matrix
+        embedding_matrix, offsets = extract_signatures(client_data, idxs_users, embed, config.dataset.eval_batch_size, 
+                                                       sample_embeddings=signature_embeddings(config, client_data, ae_model, embed), 
+                                                       keep=missing)
 
-        embeddings = np.concatenate(embeddings, axis=0)
-        
         # ----------------------------------
         # use Kmeans to cluster the data into 2 clusters
-        X = list(embeddings)
-        embedding_matrix[user_id*len(dict_users[0]): len(dict_users[0])*(user_id + 1),:] = embeddings
-        kmeans = KMeans(n_clusters=2, random_state=0).fit(np.array(X))
-        centers[user_id,:,:] = kmeans.cluster_centers_
+        return client_kmeans_centers([embedding_matrix[offsets[position]: offsets[position + 1]] for position in range(len(offsets) - 1)], 
+                                     n_clusters=2, random_state=0, desc='Custering in progress ...', **kmeans_settings(config))
     
-    clustering_matrix_soft = np.zeros((config.federated.num_users, config.federated.num_users))
-    clustering_matrix = np.zeros((config.federated.num_users, config.federated.num_users))
-
-    for idx0 in idxs_users:
-        for idx1 in idxs_users:
-            c0 = centers[idx0]
-            c1 = centers[idx1]
-        
-            distance = min_matching_distance(c0, c1)
-            
-            clustering_matrix_soft[idx0][idx1] = distance
-        
-            if distance < 1:
-                clustering_matrix[idx0][idx1] = 1
-            else:
-                clustering_matrix[idx0][idx1] = 0
+    signatures, digests = cached_signatures(cache, client_data, idxs_users, compute)
+    centers = np.stack(signatures)
+    
+    clustering_matrix, clustering_matrix_soft = cached_clustering(config, cache, digests, 
+                                                                  lambda: signature_clustering(config, centers, threshold=1), 
+                                                                  threshold=1)
 
     return clustering_matrix, clustering_matrix_soft, centers, embedding_matrix
 
-def clustering_pca_kmeans(config, dict_users, cluster, dataset_train):
+def clustering_pca_kmeans(config, client_data, cluster):
     idxs_users = np.random.choice(config.federated.num_users, config.federated.num_users, replace=False)
     
-    centers = np.empty((0, config.model.latent_dim), dtype=int)
-    center_dict = {}
-    embedding_matrix = np.zeros((len(dict_users[0])*config.federated.num_users, config.model.latent_dim))
-    
-    for user_id in tqdm(idxs_users, desc='Clustering in progress ...'):
-        user_dataset_train = DatasetSplit(dataset_train, dict_users[user_id])
-        
-        user_data_np = np.squeeze(np.array([item[0].view(1, -1).numpy() for item in user_dataset_train]))
-        if config.model.latent_dim > len(user_dataset_train):
-            user_data_np = np.repeat(user_data_np, np.ceil(config.model.latent_dim/len(user_dataset_train)),axis=0) 
-        pca = PCA(n_components=config.model.latent_dim)
-        embedding = pca.fit_transform(user_data_np)
-        
-        kmeans = KMeans(n_clusters=5, random_state=43).fit(embedding)
-        centers = np.vstack((centers, kmeans.cluster_centers_))
-        
-        center_dict[user_id] = kmeans.cluster_centers_
-    
-    clustering_matrix_soft = np.zeros((config.federated.num_users, config.federated.num_users))
-    clustering_matrix = np.zeros((config.federated.num_users, config.federated.num_users))
+    embedding_matrix = np.zeros((client_data.num_samples(0)*config.federated.num_users, config.model.latent_dim))
 
-    c_dict = center_dict
+    cache = signature_cache(config, 'kmeans', latent_dim=config.model.latent_dim, random_state=43)
 
-    for idx0 in tqdm(idxs_users, desc='Creating clustering matrix'):
-        c0 = c_dict[idx0]
-        for idx1 in idxs_users:
-            c0 = c_dict[idx0]
-            c1 = c_dict[idx1]
-        
-            distance = min_matching_distance(c0, c1)
-            
-            clustering_matrix_soft[idx0][idx1] = distance
+    def compute(missing):
+        user_data = []
+        for user_id in idxs_users[missing]:
+            images, _ = client_data.client(user_id)
+            user_data.append(np.squeeze(images.cpu().numpy().reshape((len(images), -1))))
         
-            if distance < 1.2:
-                clustering_matrix[idx0][idx1] = 1
-            else:
-                clustering_matrix[idx0][idx1] = 0
+        return client_kmeans_centers(user_data, n_clusters=5, random_state=43, pca_components=config.model.latent_dim, 
+                                     desc='Clustering in progress ...', **kmeans_settings(config))
+    
+    signatures, digests = cached_signatures(cache, client_data, idxs_users, compute, shuffle=False)
+    centers = np.concatenate(signatures)
+    c_dict = dict(zip(idxs_users, signatures))
+
+    # the clustering reads the signatures in the order of the clients
+    if digests is not None:
+        digests = [digests[position] for position in np.argsort(idxs_users)]
+
+    clustering_matrix, clustering_matrix_soft = cached_clustering(config, cache, digests, 
+                                                                  lambda: signature_clustering(config, [c_dict[idx] for idx in range(config.federated.num_users)], 
+                                                                                               threshold=1.2), 
+                                                                  threshold=1.2)
                 
     return clustering_matrix, clustering_matrix_soft, centers, c_dict
 
-def clustering_umap_central(config, dict_users, cluster, dataset_train, ae_model, device):
+def clustering_umap_central(config, client_data, cluster, ae_model, device):
 
     # idxs_users = np.random.shuffle(np.arange(num_users))
     idxs_users = np.random.choice(config.federated.num_users, config.federated.num_users, replace=False)
     
     #centers = np.zeros((num_users, max_num_center, 128)) # AE latent size going to be hyperparamter
-    centers = np.empty((0, config.model.latent_dim), dtype=int)
-    center_dict = {}
-    embedding_matrix = np.zeros((len(dict_users[0])*config.federated.num_users, config.model.latent_dim))
-    
-    for user_id in tqdm(idxs_users, desc='Clustering in progress ...'):
-        local_train = DataLoader(DatasetSplit(dataset_train, dict_users[user_id]), 
-                            batch_size=config.dataset.train_batch_size, 
-                            shuffle=True)
-
-        embeddings = []
-        for batch_idx, (images, labels) in enumerate(local_train):
-            images = images.to(device)
-            _, x_comp = ae_model(images)
-            embeddings.append(x_comp.cpu().detach().numpy())
-
-        embeddings = np.concatenate(embeddings, axis=0)
-        
-        # ----------------------------------
-        # use Kmeans to cluster the data into 2 clusters
-        #embedding_matrix[user_id*len(dict_users[0]): len(dict_users[0])*(user_id + 1),:] = embedding
+    embedding_matrix = np.zeros((client_data.num_samples(0)*config.federated.num_users, config.model.latent_dim))
+
+    ae_model.eval()
+    embed = lambda x: ae_model(x.to(device))[1]
+
+    # ----------------------------------
+    # number of KMeans clusters of every client
+    num_centers = []
+    for user_id in idxs_users:
         if config.dataset.name == 'FEMNIST':
-            num_center = config.federated.nr_of_embedding_clusters
+            num_centers.append(config.federated.nr_of_embedding_clusters)
         else:
             cluster_size = cluster.shape[0]
             nr_in_clusters = config.federated.num_users // cluster_size
             cluster_index = (user_id//nr_in_clusters)
             class_index_range = np.where(cluster[cluster_index] != -1)[0]
-            num_center = len(class_index_range)
+            num_centers.append(len(class_index_range))
+
+    cache = signature_cache(config, 'umap_central', extractor=state_fingerprint(ae_model))
 
-        kmeans = KMeans(n_clusters=num_center, random_state=43).fit(embeddings)
-        centers = np.vstack((centers, kmeans.cluster_centers_))
+    def compute(missing):
+        all_embeddings, offsets = extract_signatures(client_data, idxs_users, embed, config.dataset.eval_batch_size, 
+                                                     sample_embeddings=signature_embeddings(config, client_data, ae_model, embed), 
+                                                     keep=missing)
         
-        center_dict[user_id] = kmeans.cluster_centers_
+        #embedding_matrix[user_id*len(dict_users[0]): len(dict_users[0])*(user_id + 1),:] = embedding
+        return client_kmeans_centers([all_embeddings[offsets[position]: offsets[position + 1]] for position in range(len(offsets) - 1)], 
+                                     n_clusters=np.array(num_centers)[missing].tolist(), random_state=43, 
+                                     desc='Clustering in progress ...', **kmeans_settings(config))
     
-    umap_reducer = umap.UMAP(n_components=2, random_state=42)
-    umap_reducer.fit(np.reshape(centers, (-1, config.model.latent_dim)))
+    signatures, digests = cached_signatures(cache, client_data, idxs_users, compute, 
+                                            client_settings=[f'k{num_center}' for num_center in num_centers])
+    centers = np.concatenate(signatures)
+    center_dict = dict(zip(idxs_users, signatures))
     
-    clustering_matrix_soft = np.zeros((config.federated.num_users, config.federated.num_users))
-    clustering_matrix = np.zeros((config.federated.num_users, config.federated.num_users))
-
-    c_dict = {}
-    for idx in idxs_users:
-        c_dict[idx] = umap_reducer.transform(center_dict[idx])
-
-    for idx0 in tqdm(idxs_users):
-        c0 = c_dict[idx0]
-        for idx1 in idxs_users:
-            c0 = c_dict[idx0]
-            c1 = c_dict[idx1]
+    def reduce_and_cluster():
+        umap_reducer = umap.UMAP(n_components=2, random_state=42)
+        umap_reducer.fit(np.reshape(centers, (-1, config.model.latent_dim)))
         
-            distance = min_matching_distance(c0, c1)
-            
-            clustering_matrix_soft[idx0][idx1] = distance
+        c_dict = {}
+        for idx in idxs_users:
+            c_dict[idx] = umap_reducer.transform(center_dict[idx])
+
+        clustering_matrix, clustering_matrix_soft = signature_clustering(config, [c_dict[idx] for idx in range(config.federated.num_users)], 
+                                                                         threshold=1)
         
-            if distance < 1:
-                clustering_matrix[idx0][idx1] = 1
-            else:
-                clustering_matrix[idx0][idx1] = 0
+        return clustering_matrix, clustering_matrix_soft, c_dict
+
+    clustering_matrix, clustering_matrix_soft, c_dict = cached_clustering(config, cache, digests, reduce_and_cluster, threshold=1)
                 
     return clustering_matrix, clustering_matrix_soft, centers, embedding_matrix, c_dict
 
-def extract_clustering(config, dict_users, dataset_train, cluster, iter, device):
+def knn_affinity_matrix(clustering_matrix_soft, k, bandwidth=1.0):
+    """
+    Keeps the k nearest neighbours of every client (itself included) as a sparse affinity matrix.
+
+    Arguments:
+        clustering_matrix_soft (ndarray or csr_matrix): pairwise signature distances, 
+            if sparse only the stored ones, e.g. the edges of signature_graph
+        k (int): number of neighbours per client
+        bandwidth (float): distance scale of the gaussian affinity exp(-(d/bandwidth)^2)
+
+    Returns:
+        affinity_matrix (csr_matrix): [N, N] matrix with (at most, if sparse) k entries per row
+    """
+    if scipy.sparse.issparse(clustering_matrix_soft):
+        distances = scipy.sparse.csr_matrix(clustering_matrix_soft)
+        nearest = []
+        for i in range(distances.shape[0]):
+            start, stop = distances.indptr[i], distances.indptr[i + 1]
+            nearest.append(start + np.argsort(distances.data[start: stop], kind='stable')[:k])
+        rows = np.repeat(np.arange(distances.shape[0]), [len(n) for n in nearest])
+        nearest = np.concatenate(nearest)
+        cols = distances.indices[nearest]
+        affinity = np.exp(-(distances.data[nearest] / bandwidth)**2)
+
+        return scipy.sparse.csr_matrix((affinity, (rows, cols)), shape=distances.shape)
+
+    distances = np.asarray(clustering_matrix_soft, dtype=float)
+    k = min(k, distances.shape[1])
+
+    neighbours = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    rows = np.repeat(np.arange(distances.shape[0]), k)
+    cols = neighbours.reshape(-1)
+    affinity = np.exp(-(distances[rows, cols] / bandwidth)**2)
+
+    return scipy.sparse.csr_matrix((affinity, (rows, cols)), shape=distances.shape)
+
+def extract_clustering(config, client_data, cluster, iter, device):
+    """
+    Returns the clustering (adjacency) matrix and, for the signature based methods,
+    the pairwise signature distances it was thresholded from (None otherwise).
+    """
 
     logger.info(f'Extracting clusters')
 
@@ -406,6 +804,8 @@ def extract_clustering(config, dict_users, dataset_train, cluster, iter, device)
 
     logger.info(f'Clustering method: {config.federated.clustering_method}')
 
+    clustering_matrix_soft = None
+
     if config.federated.clustering_method == 'single':
         clustering_matrix = clustering_single(config.federated.num_users)
         
@@ -413,7 +813,7 @@ def extract_clustering(config, dict_users, dataset_train, cluster, iter, device)
         clustering_matrix = clustering_seperate(config.federated.num_users)
 
     elif config.federated.clustering_method == 'perfect':
-        clustering_matrix = clustering_perfect(config, dict_users, dataset_train, cluster)
+        clustering_matrix = clustering_perfect(config, client_data, cluster)
 
         fig_path = export_path.joinpath(f'clust_perfect_nr_users-{config.federated.num_users}_nr_clusters_{config.federated.nr_of_embedding_clusters}_ep_{config.trainer.rounds}_itr_{iter}.png')
         plt.figure()
@@ -422,38 +822,46 @@ def extract_clustering(config, dict_users, dataset_train, cluster, iter, device)
         plt.close()
 
     elif config.federated.clustering_method == 'umap':
-        clustering_matrix, _, _ = clustering_umap(config, dict_users, dataset_train, device)
+        clustering_matrix, clustering_matrix_soft, _ = clustering_umap(config, client_data, device)
 
     elif config.federated.clustering_method == 'encoder':
         ae_model = get_extractor(config, device)
         ae_model = ae_model.to(device)
 
-        clustering_matrix, _, _, _ =\
-            clustering_encoder(config, dict_users, dataset_train, ae_model, device)
+        clustering_matrix, clustering_matrix_soft, _, _ =\
+            clustering_encoder(config, client_data, ae_model, device)
 
     elif config.federated.clustering_method == 'umap_central':
         ae_model = get_extractor(config, device)
         ae_model = ae_model.to(device)
         clustering_matrix, clustering_matrix_soft, _, _, _ =\
-                clustering_umap_central(config, dict_users, cluster, dataset_train, ae_model, device)
+                clustering_umap_central(config, client_data, cluster, ae_model, device)
 
         fig_path = export_path.joinpath(f'clust_umapcentral_nr_users-{config.federated.num_users}_nr_clusters_{config.federated.nr_of_embedding_clusters}_ep_{config.trainer.rounds}_itr_{iter}.png')
         plt.figure()
-        plt.matshow(clustering_matrix,origin='lower')
+        if scipy.sparse.issparse(clustering_matrix):
+            # the edges of a signature graph, a dense image of it may not fit in memory
+            plt.spy(clustering_matrix, markersize=0.1, origin='lower')
+        else:
+            plt.matshow(clustering_matrix,origin='lower')
         plt.savefig(fig_path)
         plt.close()
 
     elif config.federated.clustering_method == 'kmeans':
         clustering_matrix, clustering_matrix_soft, _, _ =\
-                clustering_pca_kmeans(config, dict_users, cluster, dataset_train)
+                clustering_pca_kmeans(config, client_data, cluster)
         
         fig_path = export_path.joinpath(f'clust_umapcentral_nr_users-{config.federated.num_users}_nr_clusters_{config.federated.nr_of_embedding_clusters}_ep_{config.trainer.rounds}_itr_{iter}.png')
         plt.figure()
-        plt.matshow(clustering_matrix,origin='lower')
+        if scipy.sparse.issparse(clustering_matrix):
+            # the edges of a signature graph, a dense image of it may not fit in memory
+            plt.spy(clustering_matrix, markersize=0.1, origin='lower')
+        else:
+            plt.matshow(clustering_matrix,origin='lower')
         plt.savefig(fig_path)
         plt.close()
         
-    return clustering_matrix
+    return clustering_matrix, clustering_matrix_soft
 
 def partition_clusters(config, clustering_matrix, metric='euclidean', plotting=False):
     """
@@ -468,6 +876,9 @@ def partition_clusters(config, clustering_matrix, metric='euclidean', plotting=F
 
     By: Attila Szabo
     """
+    if scipy.sparse.issparse(clustering_matrix):
+        raise ValueError('Hierarchical clustering needs a dense clustering matrix, use signature_graph: dense.')
+
     export_path = Path(config.project.path + '/scenario' + str(config.federated.scenario)).joinpath(config.project.experiment_name)
     export_path = export_path.joinpath('plots')
     if not Path.exists(export_path):
@@ -540,15 +951,14 @@ def partition_clusters(config, clustering_matrix, metric='euclidean', plotting=F
 
     return cluster_user_dict
 
-def clustering_multi_center(config, net_local_list, multi_center_initialization_flag, 
+def clustering_multi_center(config, model_params, multi_center_initialization_flag, 
                             est_multi_center, iter):
-    
-    def get_model_params_length(model):
-
-        lst = [list(model[k].cpu().numpy().flatten()) for  k in model.keys()]
-        flat_list = [item for sublist in lst for item in sublist]
+    """
+    Clusters the clients by KMeans over their flat model parameters.
 
-        return len(flat_list)
+    Arguments:
+        model_params (ndarray): [num_users, P] flat parameters of the client models
+    """
     
     export_path = Path(config.project.path + '/scenario' + str(config.federated.scenario)).joinpath(config.project.experiment_name)
     export_path = export_path.joinpath('plots')
@@ -556,15 +966,7 @@ def clustering_multi_center(config, net_local_list, multi_center_initialization_
         Path.mkdir(export_path, exist_ok=True)
 
     num_users = config.federated.num_users
-    model_params_length = get_model_params_length(net_local_list[0].state_dict())
-    models_parameter_list = np.zeros((num_users, model_params_length))
-
-    for i in range(num_users):
-        model = net_local_list[i].state_dict()
-        lst = [list(model[k].cpu().numpy().flatten()) for  k in model.keys()]
-        flat_list = [item for sublist in lst for item in sublist]
-
-        models_parameter_list[i] = np.array(flat_list).reshape(1,model_params_length)
+    models_parameter_list = np.asarray(model_params, dtype=np.float64)
 
     if multi_center_initialization_flag:                
         kmeans = KMeans(n_clusters=config.federated.nr_of_embedding_clusters, n_init=20).fit(models_parameter_list)
@@ -589,24 +991,22 @@ def clustering_multi_center(config, net_local_list, multi_center_initialization_
 
     return clustering_matrix, est_multi_center_new
 
-def filter_cluster_partition(cluster_user_dict, net_local_list):
+def filter_cluster_partition(cluster_user_dict):
     """
-    Creates cluster_dict structure for FedAvg, containing ie. weights
+    Creates cluster_dict structure for FedAvg, the weights are read from the model store
     
     Arguments:
         cluster_user_dict (dict(int,list)): cluster ids mapped to user ids
-        net_local_list (list): list of weights
     
     Returns:
-        cluster_dict (dict(int,tuple)): dictionary containing weights, 
-            adjacency matrix and members for a cluster
+        cluster_dict (dict(int,tuple)): dictionary containing adjacency matrix 
+            and members for a cluster
 
     By: Attila Szabo
     """
     cluster_dict = defaultdict(tuple)
 
     for i, cluster_members in cluster_user_dict.items():
-        cluster_dict[i] = (net_local_list[cluster_members], 
-                            np.ones((len(cluster_members), len(cluster_members))),
+        cluster_dict[i] = (np.ones((len(cluster_members), len(cluster_members))),
                             cluster_members)
     return cluster_dict
\ No newline at end of file
@@ -0,0 +1,84 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the on-disk cache of the extractor embeddings of a dataset split.
+# ---------------------------------------------------------------------------
+
+import os
+import logging
+import numpy as np
+
+from pathlib import Path
+from utils.artifact_store import file_lock
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """Latent codes of the samples of a dataset split in a memory-mapped float32 file.
+
+    Row i holds the embedding of sample i of the split. Rows are filled on demand
+    and a boolean file next to the embeddings marks the filled ones, so runs on
+    different client partitions of the same split only encode the samples no run
+    has encoded yet. The embedding dimension is fixed by the first write. Writes
+    hold an fcntl lock and replace files atomically, so concurrent runs can share
+    the cache.
+
+    Arguments:
+        path (Path): .npy file of the [num_samples, dim] embeddings
+        num_samples (int): number of samples of the split
+    """
+
+    def __init__(self, path: Path, num_samples: int):
+
+        self.path = Path(path)
+        self.filled_path = self.path.with_name(self.path.stem + '_filled.npy')
+        self.num_samples = num_samples
+
+        if self.path.exists() and self.filled_path.exists():
+            self.filled = np.load(self.filled_path)
+        else:
+            self.filled = np.zeros(num_samples, dtype=bool)
+
+    def missing(self, idxs):
+        """Sample indices of idxs that are not in the cache."""
+        idxs = np.asarray(idxs)
+        return idxs[~self.filled[idxs]]
+
+    def write(self, idxs, embeddings):
+        """Stores the [len(idxs), dim] embeddings of the samples idxs."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        Path.mkdir(self.path.parent, exist_ok=True, parents=True)
+
+        # runs sharing the cache write it one at a time
+        with file_lock(self.path.with_name(self.path.stem + '.lock')):
+            if not self.path.exists():
+                # created whole under a temporary name, a reader never sees it half initialized
+                temp_path = self.path.with_name(f'.{self.path.stem}.{os.getpid()}.tmp.npy')
+                rows = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float32, shape=(self.num_samples, embeddings.shape[1]))
+                rows.flush()
+                del rows
+                os.replace(temp_path, self.path)
+
+            rows = np.load(self.path, mmap_mode='r+')
+            rows[np.asarray(idxs)] = embeddings
+            rows.flush()
+            del rows
+
+            # the rows are on disk before they are marked, next to the rows other runs marked
+            if self.filled_path.exists():
+                self.filled |= np.load(self.filled_path)
+            self.filled[np.asarray(idxs)] = True
+
+            temp_path = self.filled_path.with_name(f'.{self.filled_path.stem}.{os.getpid()}.tmp.npy')
+            np.save(temp_path, self.filled)
+            os.replace(temp_path, self.filled_path)
+
+    def __getitem__(self, idxs):
+        """[len(idxs), dim] copy of the embeddings of the samples idxs."""
+        rows = np.load(self.path, mmap_mode='r')
+        embeddings = np.array(rows[np.asarray(idxs)])
+        del rows
+
+        return embeddings
@@ -0,0 +1,47 @@
+#----------------------------------------------------------------------------
+# Created By  : Sayak Mukherjee
+# Created Date: 18-Oct-2026
+#
+# ---------------------------------------------------------------------------
+# File contains the on-disk cache of the clustering signatures of the clients.
+# ---------------------------------------------------------------------------
+
+import logging
+
+from utils.artifact_store import ArtifactStore, dump_array_pickle, load_array_pickle
+
+logger = logging.getLogger(__name__)
+
+class SignatureCache:
+    """Signatures (center sets) of clients, stored by the digest of their set of samples.
+
+    All signatures computed under the same settings share one artifact of the
+    store. Updates merge into the stored artifact under its lock, so runs on
+    different partitions of the same dataset add to each other's signatures.
+
+    Arguments:
+        store (ArtifactStore): store of the artifact
+        key (str): artifact_key of the settings the signatures are computed with
+    """
+
+    def __init__(self, store: ArtifactStore, key: str):
+
+        self.store = store
+        self.key = key
+        self.signatures = store.read(key, '.p', load_array_pickle) or {}
+
+    def __contains__(self, digest):
+        return digest in self.signatures
+
+    def __getitem__(self, digest):
+        return self.signatures[digest]
+
+    def update(self, signatures: dict):
+        """Stores the signatures, a dict of digest to signature."""
+        with self.store.lock(self.key):
+            # signatures other runs stored since this cache was read
+            stored = self.store.read(self.key, '.p', load_array_pickle) or {}
+            stored.update(signatures)
+            self.store.write(self.key, '.p', stored, dump_array_pickle)
+
+        self.signatures = stored
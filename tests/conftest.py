@@ -0,0 +1,6 @@
+import sys
+
+from pathlib import Path
+
+# the modules import each other from the source directory, like main.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[1].joinpath('src')))
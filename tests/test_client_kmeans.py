@@ -0,0 +1,14 @@
+import numpy as np
+
+from utils.client_kmeans import client_kmeans_centers
+
+def test_centers_do_not_depend_on_workers():
+    rng = np.random.default_rng(0)
+    data = [rng.normal(size=(60, 784)) for _ in range(6)]
+
+    # the PCA of 784 dimensions to 8 takes the randomized solver
+    serial = client_kmeans_centers(data, n_clusters=5, random_state=43, pca_components=8, workers=0)
+    parallel = client_kmeans_centers(data, n_clusters=5, random_state=43, pca_components=8, workers=2)
+
+    for centers_serial, centers_parallel in zip(serial, parallel):
+        np.testing.assert_array_equal(centers_serial, centers_parallel)
@@ -0,0 +1,47 @@
+import numpy as np
+import multiprocessing as mp
+
+from utils.embedding_cache import EmbeddingCache
+
+NUM_SAMPLES, DIM = 50, 4
+
+def embeddings_of(idxs):
+    return np.asarray(idxs, dtype=np.float32)[:, None] + np.arange(DIM, dtype=np.float32)
+
+def fill(path, idxs):
+    EmbeddingCache(path, NUM_SAMPLES).write(idxs, embeddings_of(idxs))
+
+def test_round_trip_and_missing(tmp_path):
+    path = tmp_path.joinpath('embeddings.npy')
+    cache = EmbeddingCache(path, NUM_SAMPLES)
+    np.testing.assert_array_equal(cache.missing([3, 1, 7]), [3, 1, 7])
+
+    cache.write([7, 1], embeddings_of([7, 1]))
+    np.testing.assert_array_equal(cache.missing([3, 1, 7]), [3])
+    np.testing.assert_array_equal(cache[[1, 7]], embeddings_of([1, 7]))
+
+    # a later run reads what this one stored
+    reopened = EmbeddingCache(path, NUM_SAMPLES)
+    np.testing.assert_array_equal(reopened.missing(np.arange(10)), [0, 2, 3, 4, 5, 6, 8, 9])
+    np.testing.assert_array_equal(reopened[[7]], embeddings_of([7]))
+
+def test_writes_of_concurrent_runs_are_merged(tmp_path):
+    path = tmp_path.joinpath('embeddings.npy')
+    first, second = EmbeddingCache(path, NUM_SAMPLES), EmbeddingCache(path, NUM_SAMPLES)
+
+    first.write([0, 1], embeddings_of([0, 1]))
+    # second was opened before first wrote, its write keeps the rows first marked
+    second.write([2], embeddings_of([2]))
+
+    np.testing.assert_array_equal(EmbeddingCache(path, NUM_SAMPLES).missing(np.arange(4)), [3])
+
+def test_processes_share_the_cache(tmp_path):
+    path = tmp_path.joinpath('embeddings.npy')
+    chunks = np.array_split(np.arange(NUM_SAMPLES), 5)
+
+    with mp.get_context('spawn').Pool(5) as pool:
+        pool.starmap(fill, [(path, chunk) for chunk in chunks])
+
+    cache = EmbeddingCache(path, NUM_SAMPLES)
+    assert len(cache.missing(np.arange(NUM_SAMPLES))) == 0
+    np.testing.assert_array_equal(cache[np.arange(NUM_SAMPLES)], embeddings_of(np.arange(NUM_SAMPLES)))
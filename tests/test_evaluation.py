@@ -0,0 +1,103 @@
+import torch
+import numpy as np
+
+from datasets.client_data import ClientData
+from models.nets import MLP
+from models.store import ClientModelStore
+from optim.evaluation import EvaluationCache, VmapEvaluator, evaluate_client, stratified_sample, stratified_estimate
+
+def make_client_data(seed=0):
+    """Six clients, clients 0 and 1 and clients 4 and 5 with the same samples."""
+    rng = np.random.default_rng(seed)
+    dataset = [(torch.as_tensor(rng.normal(size=(1, 4, 4)), dtype=torch.float32), int(i % 3)) for i in range(100)]
+    dict_users = {0: set(range(0, 20)), 1: set(range(0, 20)), 2: set(range(20, 45)), 3: set(range(45, 52)),
+                  4: set(range(52, 100)), 5: set(range(52, 100))}
+
+    return ClientData(dataset, dict_users)
+
+def make_store(num_users=6, seed=0):
+    torch.manual_seed(seed)
+    return ClientModelStore(MLP(dim_in=16, dim_hidden=8, dim_out=3), num_users)
+
+def test_cache_key_is_shared_by_equal_model_and_data():
+    client_data = make_client_data()
+    store = make_store()
+    cache = EvaluationCache()
+
+    keys = [cache.key(store, client_data, idx) for idx in range(6)]
+    # all clients start with the same model, the clients with the same samples share a key
+    assert keys[0] == keys[1] and keys[4] == keys[5]
+    assert len(set(keys)) == 4
+
+    store.store(1)
+    assert cache.key(store, client_data, 1) != cache.key(store, client_data, 0)
+
+    # a subsample has its own fingerprints
+    subset = client_data.subsample(5)
+    assert cache.key(store, subset, 0) != keys[0]
+
+def test_cache_keeps_the_results_requested_in_the_previous_round():
+    client_data = make_client_data()
+    store = make_store()
+    cache = EvaluationCache()
+
+    key_0, key_2 = cache.key(store, client_data, 0), cache.key(store, client_data, 2)
+    for key in (key_0, key_2):
+        assert key not in cache
+        cache[key] = (50.0, 1.0)
+
+    cache.begin_round()
+    assert key_0 in cache and cache[key_0] == (50.0, 1.0)
+
+    # key_2 was not requested in the round that ended
+    cache.begin_round()
+    assert key_0 in cache
+    assert key_2 not in cache
+
+def test_vmap_evaluation_matches_evaluate_client():
+    client_data = make_client_data()
+    store = make_store()
+    for idx in range(6):
+        torch.manual_seed(idx)
+        with torch.no_grad():
+            for p in store.net.parameters():
+                p.normal_()
+        store.store(idx)
+
+    # clients of 20, 25 and 7 samples: batches of 8 pad every client
+    user_idxs = [0, 2, 3]
+    rows = torch.stack([store[idx] for idx in user_idxs])
+    results = VmapEvaluator(store.net)(rows, client_data, user_idxs, batch_size=8)
+
+    net = store.net.eval()
+    for idx, (accuracy, test_loss) in zip(user_idxs, results):
+        expected_accuracy, expected_loss, _ = evaluate_client(store.load(idx, net), client_data, idx, batch_size=8)
+        assert accuracy == expected_accuracy
+        assert np.isclose(test_loss, expected_loss, rtol=1e-5)
+
+def test_stratified_estimate_of_the_whole_population_is_exact():
+    rng = np.random.default_rng(0)
+    values, weights = rng.random(30) * 100, rng.integers(10, 50, 30).astype(float)
+    strata = np.repeat(np.arange(3), 10)
+
+    estimate, half_width = stratified_estimate(values, weights, strata, {0: 10, 1: 10, 2: 10})
+
+    assert np.isclose(estimate, values.sum() / weights.sum())
+    assert half_width == 0
+
+def test_stratified_interval_covers_the_population_mean():
+    rng = np.random.default_rng(0)
+    users = np.arange(200)
+    # a few large strata and singleton strata, pooled by the sample
+    strata = np.concatenate((np.repeat(np.arange(4), 45), np.arange(4, 24)))
+    values = rng.normal(strata % 4 * 10, 5) + 50
+    population_mean = values.mean()
+
+    covered = 0
+    for _ in range(400):
+        sampled, sample_strata = stratified_sample(users, strata, 0.2, rng)
+        stratum_sizes = dict(zip(*np.unique(sample_strata, return_counts=True)))
+        estimate, half_width = stratified_estimate(values[sampled], np.ones(len(sampled)), sample_strata[sampled], stratum_sizes)
+        covered += abs(estimate - population_mean) <= half_width
+
+    assert 0.85 <= covered / 400 <= 0.99
@@ -0,0 +1,113 @@
+import copy
+import torch
+import numpy as np
+import scipy.sparse
+
+from comm import get_aggregator
+from comm.fedavg import FedAvg, StreamingFedAvg, flatten_state_dicts, fedavg_matrix
+
+def make_models(num_users=7, seed=0):
+    torch.manual_seed(seed)
+    return [torch.nn.Sequential(torch.nn.Linear(5, 4), torch.nn.ReLU(), torch.nn.Linear(4, 3)) for _ in range(num_users)]
+
+def make_clustering(num_users=7, seed=0):
+    """Symmetric adjacency matrix with a self-loop on every client, and unequal client sizes."""
+    rng = np.random.default_rng(seed)
+    clustering_matrix = rng.random((num_users, num_users)) < 0.4
+    clustering_matrix = (clustering_matrix | clustering_matrix.T | np.eye(num_users, dtype=bool)).astype(int)
+    dict_users = {idx: set(range(10 * (idx + 1))) for idx in range(num_users)}
+
+    return clustering_matrix, dict_users
+
+def jacobi_reference(net_list, clustering_matrix, dict_users):
+    """The FedAvg loop with every client averaging the models as they were before aggregation."""
+    params, _ = flatten_state_dicts(net_list, dtype=torch.float64)
+    averaged = torch.zeros_like(params)
+    for idx in range(len(net_list)):
+        sum_len = 0
+        for i in range(len(net_list)):
+            if clustering_matrix[idx][i] == 1:
+                averaged[idx] += params[i] * len(dict_users[i])
+                sum_len += len(dict_users[i])
+        averaged[idx] /= sum_len
+
+    return averaged
+
+def aggregated(name, net_list, *args):
+    net_list = get_aggregator(name)(copy.deepcopy(net_list), *args)
+    return flatten_state_dicts(net_list, dtype=torch.float64)[0]
+
+def test_loop_engine_is_fedavg():
+    models = make_models()
+    clustering_matrix, dict_users = make_clustering()
+
+    reference = flatten_state_dicts(FedAvg(copy.deepcopy(models), clustering_matrix, dict_users), dtype=torch.float64)[0]
+
+    torch.testing.assert_close(aggregated('loop', models, clustering_matrix, dict_users), reference)
+
+def test_matrix_sequential_matches_loop():
+    models = make_models()
+    clustering_matrix, dict_users = make_clustering()
+
+    reference = aggregated('loop', models, clustering_matrix, dict_users)
+
+    torch.testing.assert_close(aggregated('matrix_sequential', models, clustering_matrix, dict_users), reference, rtol=1e-5, atol=1e-6)
+
+def test_matrix_matches_jacobi_loop():
+    models = make_models()
+    clustering_matrix, dict_users = make_clustering()
+
+    reference = jacobi_reference(models, clustering_matrix, dict_users)
+
+    torch.testing.assert_close(aggregated('matrix', models, clustering_matrix, dict_users), reference, rtol=1e-5, atol=1e-6)
+
+def test_sparse_engines_match_jacobi_loop():
+    models = make_models()
+    clustering_matrix, dict_users = make_clustering()
+
+    reference = jacobi_reference(models, clustering_matrix, dict_users)
+
+    for name in ('topk', 'graph'):
+        affinity_matrix = scipy.sparse.csr_matrix(clustering_matrix)
+        torch.testing.assert_close(aggregated(name, models, affinity_matrix, dict_users), reference, rtol=1e-5, atol=1e-6)
+
+def test_shared_rows_match_distinct_rows():
+    models = make_models()
+    clustering_matrix, dict_users = make_clustering()
+    params, _ = flatten_state_dicts(models)
+
+    # clients 0, 2 and 4 hold the same model
+    rows = np.array([0, 1, 0, 2, 0, 3, 4])
+    distinct = params[:5]
+
+    for sequential in (False, True):
+        averaged, inverse = fedavg_matrix(distinct[rows], clustering_matrix, dict_users, sequential)
+        averaged_rows, inverse_rows = fedavg_matrix(distinct, clustering_matrix, dict_users, sequential, rows=rows)
+
+        torch.testing.assert_close(averaged_rows[inverse_rows], averaged[inverse], rtol=1e-5, atol=1e-6)
+
+def streamed(models, clustering_matrix, dict_users, sequential):
+    """StreamingFedAvg with the models folded in a shuffled order."""
+    running_avg = StreamingFedAvg(clustering_matrix, dict_users, sequential=sequential)
+    params, _ = flatten_state_dicts(models)
+    for idx in np.random.default_rng(0).permutation(len(models)):
+        running_avg.fold(idx, params[idx])
+
+    averaged, inverse = running_avg.average()
+    return averaged[inverse].double()
+
+def test_streaming_matches_loop():
+    models = make_models()
+    clustering_matrix, dict_users = make_clustering()
+
+    reference = aggregated('loop', models, clustering_matrix, dict_users)
+
+    torch.testing.assert_close(streamed(models, clustering_matrix, dict_users, sequential=True), reference, rtol=1e-5, atol=1e-6)
+
+def test_streaming_matrix_matches_jacobi_loop():
+    models = make_models()
+    clustering_matrix, dict_users = make_clustering()
+
+    reference = jacobi_reference(models, clustering_matrix, dict_users)
+
+    torch.testing.assert_close(streamed(models, clustering_matrix, dict_users, sequential=False), reference, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,89 @@
+import torch
+import random
+import pytest
+import numpy as np
+
+from pathlib import Path
+from omegaconf import OmegaConf
+from torch.utils.data import Dataset
+
+import optim.flt
+import optim.flt_pretrain
+import utils.cluster
+
+CONFIG_PATH = Path(__file__).resolve().parents[1].joinpath('configs', 'default.yaml')
+
+class SyntheticMNIST(Dataset):
+    """Random MNIST-shaped images with samples_per_class samples of every class."""
+
+    def __init__(self, samples_per_class, seed):
+
+        rng = np.random.default_rng(seed)
+        self.train_labels = torch.arange(10).repeat_interleave(samples_per_class)
+        self.images = torch.as_tensor(rng.random((len(self.train_labels), 1, 28, 28)), dtype=torch.float32)
+
+    def __len__(self):
+        return len(self.train_labels)
+
+    def __getitem__(self, idx):
+        return self.images[idx], int(self.train_labels[idx])
+
+def make_config(path, **overrides):
+    config = OmegaConf.load(CONFIG_PATH)
+    config = OmegaConf.merge(config, {
+        'dataset': {'name': 'MNIST', 'path': str(path), 'num_channels': 1},
+        'federated': {'num_users': 10, 'frac': 0.5, 'clustering_method': 'perfect', 'rounds': 2},
+        'project': {'path': str(path), 'verbose': False, 'embedding_cache': False, 'signature_cache': False},
+        'trainer': {'rounds': 2, 'accelerator': 'cpu'},
+        })
+
+    for key, value in overrides.items():
+        OmegaConf.update(config, key, value)
+
+    return config
+
+def run_flt(monkeypatch, config):
+    datasets = {'train': SyntheticMNIST(40, seed=0), 'test': SyntheticMNIST(10, seed=1)}
+    # the client data and the data the extractor is pre-trained on
+    for module in (optim.flt, optim.flt_pretrain, utils.cluster):
+        monkeypatch.setattr(module, 'load_dataset', lambda name, path, dataset_split: (datasets, None, None))
+
+    # main.py creates the scenario directory
+    export_path = Path(config.project.path).joinpath(f'scenario{config.federated.scenario}', config.project.experiment_name)
+    Path.mkdir(export_path.parent, parents=True, exist_ok=True)
+
+    flt = optim.flt.FLT(config, 'cpu')
+
+    return flt, export_path.joinpath('results.csv').read_text().splitlines()
+
+def test_randomised_seed_with_sampled_evaluation(monkeypatch, tmp_path):
+    # seed -1 keeps the run randomised: the evaluation subsamples, the stratified sample and the worker seeds
+    config = make_config(tmp_path, **{'project.seed': -1, 'federated.eval_users_fraction': 0.5, 'federated.eval_test_samples': 5,
+                                      'federated.full_eval_period': 2, 'federated.train_accuracy': 'subsample',
+                                      'federated.train_accuracy_samples': 5, 'trainer.client_workers': 2})
+    flt, results = run_flt(monkeypatch, config)
+
+    assert flt.sampled_evaluation and flt.eval_seed is None
+    # a header and one row per round
+    assert len(results) == 3
+
+def test_sparse_signature_graph_needs_a_sparse_engine(monkeypatch, tmp_path):
+    config = make_config(tmp_path, **{'federated.signature_graph': 'mean', 'federated.aggregation': 'matrix_sequential'})
+
+    with pytest.raises(ValueError, match='sparse signature graph'):
+        run_flt(monkeypatch, config)
+
+def test_cached_extractor_run_matches_cold_run(monkeypatch, tmp_path):
+    config = make_config(tmp_path, **{'dataset.pre_trained_dataset': 'MNIST', 'federated.clustering_method': 'encoder',
+                                      'trainer.pretrain_epochs': 1, 'trainer.finetune_epochs': 1})
+
+    # seeded like main.py, the first run pre-trains and fine-tunes the extractor, the second loads them
+    rounds = []
+    for _ in range(2):
+        random.seed(1)
+        np.random.seed(1)
+        torch.manual_seed(1)
+        rounds.append(run_flt(monkeypatch, config)[1][1])
+
+    assert len(list(tmp_path.joinpath('flt_artifacts').glob('extractor-*.tar'))) == 2
+    assert rounds[1] == rounds[0]
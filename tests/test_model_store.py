@@ -0,0 +1,107 @@
+import torch
+import numpy as np
+
+from comm import get_aggregator
+from comm.fedavg import ColumnChunkAverage, aggregation_weights
+from models.nets import MLP
+from models.store import ClientModelStore, MemmapModelStore, MemmapRows
+
+NUM_USERS = 6
+
+def make_net(seed=0):
+    torch.manual_seed(seed)
+    return MLP(dim_in=12, dim_hidden=8, dim_out=3)
+
+def perturbed(store, user_idx, seed):
+    """Loads a client into the template, perturbs it, stores it back, returns the stored row."""
+    torch.manual_seed(seed)
+    store.load(user_idx)
+    with torch.no_grad():
+        for p in store.net.parameters():
+            p.add_(torch.randn_like(p))
+    store.store(user_idx)
+
+    return store[user_idx].clone()
+
+def make_clustering():
+    membership = np.array([0, 0, 1, 1, 1, 2])
+    clustering_matrix = (membership[:, None] == membership[None, :]).astype(int)
+    dict_users = [np.arange(10 * (idx + 1)) for idx in range(NUM_USERS)]
+
+    return clustering_matrix, dict_users
+
+def stores(tmp_path):
+    return [ClientModelStore(make_net(), NUM_USERS), MemmapModelStore(make_net(), NUM_USERS, tmp_path.joinpath('client_models.npy'))]
+
+def test_round_trip(tmp_path):
+    for store in stores(tmp_path):
+        initial = store[0].clone()
+        row = perturbed(store, 3, seed=1)
+
+        net = store.load(3, make_net(seed=2))
+        torch.testing.assert_close(torch.cat([v.reshape(-1) for v in net.state_dict().values()]), row)
+
+        # the other clients keep the initial weights
+        for user_idx in (0, 2, 5):
+            torch.testing.assert_close(store[user_idx], initial)
+
+def test_copy_on_write_refcount():
+    store = ClientModelStore(make_net(), NUM_USERS)
+    assert store.memory_report()['unique_buffers'] == 1
+    assert store.refcount[store.slots[0]] == NUM_USERS
+
+    perturbed(store, 3, seed=1)
+    perturbed(store, 4, seed=2)
+    assert store.memory_report()['unique_buffers'] == 3
+    assert store.refcount[store.slots[0]] == NUM_USERS - 2
+    assert store.refcount.sum() == NUM_USERS
+
+    # storing a client that owns its row does not copy it
+    slot = store.slots[3]
+    perturbed(store, 3, seed=3)
+    assert store.slots[3] == slot and store.memory_report()['unique_buffers'] == 3
+
+    clustering_matrix, dict_users = make_clustering()
+    params, rows = store.gather(np.arange(NUM_USERS))
+    averaged, inverse = get_aggregator('matrix')(params, clustering_matrix, dict_users, rows=rows)
+    store.assign(np.arange(NUM_USERS), averaged, inverse)
+
+    # one shared row per cluster, the released rows are reused or compacted away
+    assert store.memory_report()['unique_buffers'] == 3
+    assert store.refcount.sum() == NUM_USERS
+    assert len(set(store.tokens[np.arange(NUM_USERS)].tolist())) == 3
+    for user_idx in range(NUM_USERS):
+        torch.testing.assert_close(store[user_idx], averaged[inverse[user_idx]])
+
+def test_aggregation_matches_across_stores(tmp_path):
+    clustering_matrix, dict_users = make_clustering()
+    users = np.arange(NUM_USERS)
+
+    results = []
+    for store in stores(tmp_path):
+        for user_idx in range(NUM_USERS):
+            perturbed(store, user_idx, seed=user_idx)
+
+        params, rows = store.gather(users)
+        averaged, inverse = get_aggregator('matrix_sequential')(params, clustering_matrix, dict_users, rows=rows)
+        del params
+        store.assign(users, averaged, inverse)
+        results.append(store.dense())
+
+    torch.testing.assert_close(results[1], results[0])
+
+def test_column_chunks_are_written_in_place(tmp_path):
+    store = MemmapModelStore(make_net(), NUM_USERS, tmp_path.joinpath('client_models.npy'))
+    for user_idx in range(NUM_USERS):
+        perturbed(store, user_idx, seed=user_idx)
+
+    clustering_matrix, dict_users = make_clustering()
+    weights = aggregation_weights(clustering_matrix, dict_users, sequential=True)
+    expected = torch.as_tensor(weights, dtype=torch.float32) @ store.dense()
+
+    # chunks of a few columns: the later chunks are read after the earlier ones are written
+    averaged = ColumnChunkAverage(MemmapRows(store, np.arange(NUM_USERS)), weights, chunk_numel=5 * NUM_USERS)
+    assert averaged.chunk == 5
+    store.assign(np.arange(NUM_USERS), averaged, np.arange(NUM_USERS))
+
+    torch.testing.assert_close(store.dense(), expected)
@@ -0,0 +1,48 @@
+import torch
+import numpy as np
+
+from omegaconf import OmegaConf
+
+# utils.cluster imports optim, which imports utils.cluster: enter through optim like main.py
+import optim
+from datasets.client_data import ClientData
+from utils.cluster import clustering_pca_kmeans
+
+def make_config(path, **federated):
+    return OmegaConf.create({
+        'project': {'path': str(path), 'signature_cache': True},
+        'dataset': {'name': 'synthetic', 'dataset_split': 'none', 'eval_batch_size': 16},
+        'model': {'latent_dim': 8},
+        'federated': {'num_users': 6, 'signature_graph': 'dense', **federated},
+        })
+
+def make_client_data(num_users=6, samples=60, seed=0):
+    rng = np.random.default_rng(seed)
+    dataset = [(torch.as_tensor(rng.normal(size=(1, 28, 28)), dtype=torch.float32), int(i % 3)) for i in range(num_users * samples)]
+    dict_users = {idx: set(range(idx * samples, (idx + 1) * samples)) for idx in range(num_users)}
+
+    return ClientData(dataset, dict_users)
+
+def clustering_run(config, client_data):
+    """clustering_pca_kmeans from a fixed global RNG, and the global RNG state after it."""
+    np.random.seed(1)
+    clustering_matrix, clustering_matrix_soft, _, _ = clustering_pca_kmeans(config, client_data, None)
+
+    return clustering_matrix, clustering_matrix_soft, np.random.random()
+
+def test_cached_clustering_matches_uncached(tmp_path):
+    client_data = make_client_data()
+    config = make_config(tmp_path)
+
+    # the first run fills the cache, the second reads it
+    miss = clustering_run(config, client_data)
+    hit = clustering_run(config, client_data)
+
+    config.project.signature_cache = False
+    uncached = clustering_run(config, client_data)
+
+    for run in (hit, uncached):
+        np.testing.assert_array_equal(run[0], miss[0])
+        np.testing.assert_array_equal(run[1], miss[1])
+        # the clustering draws the same from the global RNG, the client sampling that follows is the same
+        assert run[2] == miss[2]